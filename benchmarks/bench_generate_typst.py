@@ -0,0 +1,87 @@
+"""Микробенчмарк подготовки данных отчёта для typst-шаблона.
+
+Запуск из корня проекта (нужны переменные окружения бота, как для тестов):
+    python benchmarks/bench_generate_typst.py [--repeat 20]
+
+Для каждого размера отчёта выводит время первого вызова generate_report_data, медиану последующих вызовов
+с пустым кэшем строк таблицы (все нарушения новые) и с заполненным кэшем (повторный отчёт по тем же нарушениям).
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from bot.enums import UserRole, ViolationStatus  # noqa: E402
+from bot.handlers.reports_handlers.generate_typst import fragment_cache, generate_report_data  # noqa: E402
+
+SIZES = (1, 50, 500)
+ASPECT_RATIOS = (0.56, 0.75, 1.0, 1.33, 1.78)
+
+
+def make_violations(count: int, seed: int = 0) -> tuple[list[SimpleNamespace], dict[str, str]]:
+    """Синтетические нарушения с 1-4 фотографиями и словарь путей изображений по хэшам."""
+    rnd = random.Random(seed)
+    detector = SimpleNamespace(id=1, first_name="Иванов И.И.", user_role=UserRole.OTPB)
+    area = SimpleNamespace(id=1, name="Цех №1", responsible_text="Петров П.П.", responsible_user=None)
+    violations = []
+    imgs_mapping = {}
+    for number in range(1, count + 1):
+        files = []
+        for index in range(rnd.randint(1, 4)):
+            img_hash = f"{number:08d}{index:056d}"
+            path = f"images/{img_hash[:2]}/{img_hash}.jpg"
+            imgs_mapping[img_hash] = f"/data/thumbnails/{img_hash[:2]}/{img_hash}.jpg"
+            files.append(SimpleNamespace(hash=img_hash, path=path, aspect_ratio=rnd.choice(ASPECT_RATIOS)))
+        violations.append(
+            SimpleNamespace(
+                id=number,
+                number=number,
+                description="Нарушение требований охраны труда при проведении работ " * 2,
+                category="Работы на высоте",
+                status=ViolationStatus.ACTIVE,
+                actions_needed="Устранить. Срок устранения: 01.01.2026",
+                created_at=datetime(2025, 1, 1, 12, 0),
+                updated_at=datetime(2025, 1, 1, 12, 0),
+                area=area,
+                detector=detector,
+                files=files,
+            )
+        )
+    return violations, imgs_mapping
+
+
+def bench(count: int, repeat: int) -> tuple[float, float, float]:
+    """Возвращает время первого вызова и медианы вызовов с пустым и заполненным кэшем в миллисекундах."""
+    created_by = SimpleNamespace(id=0, first_name="Сидоров С.С.", user_role=UserRole.ADMIN)
+    cold, warm = [], []
+    for _ in range(repeat + 1):
+        # новые данные на каждый вызов, чтобы измерение не зависело от изменения списков фотографий
+        violations, imgs_mapping = make_violations(count)
+        fragment_cache.clear()
+        for timings in (cold, warm):
+            started = time.perf_counter()
+            generate_report_data(violations, created_by=created_by, imgs_mapping=imgs_mapping)
+            timings.append((time.perf_counter() - started) * 1000)
+    return cold[0], statistics.median(cold[1:]), statistics.median(warm[1:])
+
+
+def main() -> None:
+    """Точка входа."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    print(f"{'нарушений':>10} {'первый, мс':>12} {'без кэша, мс':>13} {'с кэшем, мс':>12}")
+    for count in SIZES:
+        first, cold, warm = bench(count, args.repeat)
+        print(f"{count:>10} {first:>12.2f} {cold:>13.2f} {warm:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Бенчмарк уменьшения фотографий в разных режимах декодирования.
+
+Запуск из корня проекта (нужны переменные окружения бота, как для тестов):
+    python benchmarks/bench_image_decode.py [--repeat 10] [--max-side 640]
+
+Для типичных фотографий с телефона (jpeg) и одного png сравнивает режимы DECODE_PROFILES:
+медиану времени shrink_image, размер результата и PSNR относительно режима "quality" (полное декодирование).
+"""
+
+import argparse
+import math
+import statistics
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from bot.utils.image_processing import DECODE_PROFILES, ThumbnailProfile, shrink_image  # noqa: E402
+
+# (название, размер, формат)
+SAMPLES = (
+    ("телефон 12 Мп, горизонтальная", (4032, 3024), "JPEG"),
+    ("телефон 12 Мп, вертикальная", (3024, 4032), "JPEG"),
+    ("телефон 48 Мп", (8000, 6000), "JPEG"),
+    ("фото из telegram", (1280, 960), "JPEG"),
+    ("скриншот", (1080, 2400), "PNG"),
+)
+
+
+def make_photo(size: tuple[int, int], image_format: str) -> bytes:
+    """Синтетическая фотография: шум, градиенты и контрастные фигуры, чтобы было что сглаживать."""
+    width, height = size
+    noise = Image.effect_noise(size, 50)
+    gradient = Image.linear_gradient("L").resize(size)
+    image = Image.merge("RGB", (noise, gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    draw = ImageDraw.Draw(image)
+    for step in range(0, width, max(1, width // 40)):
+        draw.line((step, 0, width - step, height), fill=(255, 255, 255), width=3)
+    buffer = BytesIO()
+    image.save(buffer, image_format, **({"quality": 92} if image_format == "JPEG" else {}))
+    return buffer.getvalue()
+
+
+def psnr(first: Image.Image, second: Image.Image) -> float:
+    """Пиковое отношение сигнал/шум двух изображений одного размера, дБ."""
+    if first.size != second.size:
+        second = second.resize(first.size)
+    mse = statistics.fmean(value ** 2 for value in ImageStat.Stat(ImageChops.difference(first, second)).rms)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def main() -> None:
+    """Точка входа."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--max-side", type=int, default=640)
+    args = parser.parse_args()
+
+    print(f"{'фотография':<32} {'режим':<9} {'медиана, мс':>12} {'размер, КБ':>11} {'PSNR, дБ':>9}")
+    for title, size, image_format in SAMPLES:
+        data = make_photo(size, image_format)
+        reference = None
+        for decode in DECODE_PROFILES:
+            profile = ThumbnailProfile(max_side=args.max_side, decode=decode)
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                result = shrink_image(data, profile)
+                timings.append((time.perf_counter() - started) * 1000)
+            with Image.open(result) as image:
+                image.load()
+            if reference is None:
+                reference = image
+            print(
+                f"{title:<32} {decode:<9} {statistics.median(timings):>12.1f} "
+                f"{result.getbuffer().nbytes / 1024:>11.1f} {psnr(reference, image):>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
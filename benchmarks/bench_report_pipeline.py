@@ -0,0 +1,255 @@
+"""Сквозной бенчмарк создания pdf-отчёта по этапам.
+
+Запуск из корня проекта (нужны переменные окружения бота, как для тестов):
+    python benchmarks/bench_report_pipeline.py [--sizes 1,10,100,1000] [--output results.json]
+
+Для каждого размера отчёта создается отдельная база sqlite с синтетическими нарушениями и настоящими
+jpeg-файлами разных размеров и пропорций, после чего по отдельности замеряются этапы:
+    query         - выборка активных нарушений репозиторием;
+    images        - подготовка уменьшенных копий фотографий (холодный запуск), их количество и размер;
+                    процессы пула запускаются заранее, время запуска - meta.image_pool_start;
+    images_warm   - повторная подготовка, когда копии уже есть;
+    generate      - запись данных отчёта в json и typ-файла;
+    compile       - компиляция typst (null, если компилятор не найден);
+    total         - сумма этапов холодного запуска от запроса до готового pdf.
+Результаты выводятся в формате json (для сравнения между версиями), краткая таблица - в stderr.
+Все файлы создаются во временном каталоге внутри data и удаляются по завершении.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import UTC, datetime
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from bot.config import settings  # noqa: E402
+from bot.constants import MAX_IMAGE_WORKERS  # noqa: E402
+from bot.db.database import SimpleBase  # noqa: E402
+from bot.db.models import AreaModel, FileModel, UserModel, ViolationModel  # noqa: E402
+from bot.enums import UserRole, ViolationStatus  # noqa: E402
+from bot.handlers.reports_handlers.create_reports import prepare_images_within_budget, write_typst_file  # noqa: E402
+from bot.handlers.reports_handlers.generate_typst import generate_report_data  # noqa: E402
+from bot.logger_config import log  # noqa: E402
+from bot.repositories.violation_repo import ViolationRepository  # noqa: E402
+from bot.services.typst_render import get_typst_command, typst_renderer  # noqa: E402
+from bot.utils.image_utils import get_hash, get_process_pool, shutdown_process_pool, thumbnail_store  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine  # noqa: E402
+
+SIZES = (1, 10, 100, 1000)
+# размеры фотографий: типичные для telegram (до 1280 по длинной стороне) и присланные документом
+IMAGE_SHAPES = ((1280, 960), (960, 1280), (1280, 720), (720, 1280), (1280, 1280), (2560, 1920), (1920, 2560))
+
+
+def make_base_images(rnd: random.Random) -> list[Image.Image]:
+    """Зашумленные основы изображений, чтобы размер jpeg был близок к фотографиям."""
+    bases = []
+    for width, height in IMAGE_SHAPES:
+        noise = Image.effect_noise((width, height), 60)
+        gradient = Image.linear_gradient("L").resize((width, height))
+        base = Image.merge("RGB", (noise, gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+        ImageDraw.Draw(base).ellipse(
+            (width // 4, height // 4, width // 2, height // 2), fill=(rnd.randrange(256), 90, 40)
+        )
+        bases.append(base)
+    return bases
+
+
+def make_image_files(root: Path, count: int, rnd: random.Random) -> list[tuple[str, str, float]]:
+    """Создает count уникальных jpeg-файлов и возвращает (хэш, путь от DATA_DIR, пропорции)."""
+    bases = make_base_images(rnd)
+    files = []
+    for index in range(count):
+        image = bases[rnd.randrange(len(bases))].copy()
+        width, height = image.size
+        x, y = rnd.randrange(width - 64), rnd.randrange(height - 64)
+        # небольшая уникальная метка, чтобы у каждого файла был свой хэш
+        ImageDraw.Draw(image).rectangle((x, y, x + 63, y + 63), fill=(index % 256, index // 256 % 256, 200))
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        body = buffer.getvalue()
+        img_hash = get_hash(body)
+        path = root / "images" / img_hash[:2] / f"{img_hash}.jpg"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(body)
+        files.append((img_hash, str(path.relative_to(settings.DATA_DIR)), width / height))
+    return files
+
+
+async def fill_database(session: AsyncSession, count: int, images: list, rnd: random.Random) -> UserModel:
+    """Заполняет базу count активными нарушениями с 1-4 фотографиями и возвращает автора отчёта."""
+    admin = UserModel(telegram_id=1, first_name="Сидоров С.С.", user_role=UserRole.ADMIN)
+    detector = UserModel(telegram_id=2, first_name="Иванов И.И.", user_role=UserRole.OTPB)
+    areas = [AreaModel(name=f"Цех №{number}", responsible_text="Петров П.П.") for number in range(1, 6)]
+    session.add_all([admin, detector, *areas])
+    image_iter = iter(images)
+    for number in range(1, count + 1):
+        files = []
+        for _ in range(rnd.randint(1, 4)):
+            img_hash, path, aspect_ratio = next(image_iter)
+            files.append(FileModel(hash=img_hash, path=path, aspect_ratio=aspect_ratio))
+        session.add(
+            ViolationModel(
+                number=number,
+                detector=detector,
+                area=rnd.choice(areas),
+                description="Нарушение требований охраны труда при проведении работ " * 2,
+                category="Работы на высоте",
+                status=ViolationStatus.ACTIVE,
+                actions_needed="Устранить. Срок устранения: 01.01.2026",
+                files=files,
+            )
+        )
+    await session.commit()
+    return admin
+
+
+def timed(results: dict, stage: str, started: float) -> float:
+    """Записывает длительность этапа в секундах и возвращает текущее время."""
+    now = time.perf_counter()
+    results[stage] = round(now - started, 6)
+    return now
+
+
+async def bench(count: int, work_dir: Path, images: list, typst_found: bool) -> dict:
+    """Замер этапов создания отчёта для count нарушений."""
+    rnd = random.Random(count)
+    run_dir = work_dir / f"run_{count}"
+    run_dir.mkdir()
+    thumbnail_store.root = run_dir / "thumbnails"
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{run_dir / 'bench.db'}")
+    async with engine.begin() as connection:
+        await connection.run_sync(SimpleBase.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as session:
+        created_by = await fill_database(session, count, images, rnd)
+
+    results: dict = {"violations": count}
+    async with session_factory() as session:
+        started = time.perf_counter()
+        violations = await ViolationRepository(session).get_active_violations()
+        now = timed(results, "query", started)
+        imgs_mapping = await prepare_images_within_budget(violations)
+        now = timed(results, "images", now)
+        typ_file = run_dir / "report.typ"
+        await asyncio.to_thread(write_typst_file, created_by, violations, typ_file, imgs_mapping)
+        now = timed(results, "generate", now)
+        if typst_found:
+            await typst_renderer.compile(typ_file, run_dir / "report.pdf")
+            timed(results, "compile", now)
+            results["pdf_bytes"] = (run_dir / "report.pdf").stat().st_size
+        else:
+            results["compile"] = results["pdf_bytes"] = None
+        results["total"] = round(time.perf_counter() - started, 6)
+
+        results["images_count"] = len(imgs_mapping)
+        results["images_bytes"] = sum(
+            (settings.BASE_DIR / path.lstrip("/")).stat().st_size for path in imgs_mapping.values()
+        )
+        started = time.perf_counter()
+        await prepare_images_within_budget(violations)
+        timed(results, "images_warm", started)
+        # отдельный замер генерации без записи файла, для сравнения с bench_generate_typst
+        started = time.perf_counter()
+        generate_report_data(violations, created_by=created_by, imgs_mapping=imgs_mapping)
+        timed(results, "generate_only", started)
+    await engine.dispose()
+    return results
+
+
+def get_metadata(typst_found: bool) -> dict:
+    """Сведения об окружении, без которых результаты разных запусков нельзя сравнивать."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    typst_version = None
+    if typst_found:
+        version = subprocess.run([*get_typst_command(), "--version"], capture_output=True, text=True)
+        typst_version = version.stdout.strip()
+    return {
+        "timestamp": datetime.now(tz=UTC).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "typst": typst_version,
+    }
+
+
+async def start_image_workers() -> float:
+    """Запускает все процессы пула обработки изображений и возвращает время запуска в секундах.
+
+    В боте пул запускается один раз за время работы, поэтому его запуск не входит в замер этапа images.
+    Кроме того, процессы пула выполняют верхний уровень этого скрипта с импортом модулей бота,
+    чего у процессов бота нет (см. main.py).
+    """
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    await asyncio.gather(*(loop.run_in_executor(pool, time.sleep, 0.1) for _ in range(MAX_IMAGE_WORKERS)))
+    return round(time.perf_counter() - started, 6)
+
+
+async def run(sizes: list[int]) -> dict:
+    """Прогон всех размеров в общем временном каталоге."""
+    typst_found = shutil.which(get_typst_command()[0]) is not None
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_", dir=settings.DATA_DIR))
+    try:
+        rnd = random.Random(0)
+        # фотографий с запасом на самый большой отчёт: до 4 на нарушение
+        images = make_image_files(work_dir, 4 * max(sizes), rnd)
+        pool_start = await start_image_workers()
+        results = [await bench(count, work_dir, images, typst_found) for count in sizes]
+    finally:
+        await shutdown_process_pool()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {"meta": {**get_metadata(typst_found), "image_pool_start": pool_start}, "results": results}
+
+
+def print_table(report: dict) -> None:
+    """Краткая таблица результатов в stderr, в миллисекундах."""
+    stages = ("query", "images", "images_warm", "generate", "compile", "total")
+    print(f"{'нарушений':>10}" + "".join(f"{stage:>13}" for stage in stages), file=sys.stderr)
+    for row in report["results"]:
+        cells = "".join(
+            f"{'-':>13}" if row[stage] is None else f"{row[stage] * 1000:>13.1f}" for stage in stages
+        )
+        print(f"{row['violations']:>10}{cells}", file=sys.stderr)
+
+
+def main() -> None:
+    """Точка входа."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="размеры отчётов через запятую")
+    parser.add_argument("--output", type=Path, help="файл для результатов в json, по умолчанию stdout")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    log.disable("bot")
+    report = asyncio.run(run(sizes))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    print_table(report)
+
+
+if __name__ == "__main__":
+    main()
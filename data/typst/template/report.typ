@@ -0,0 +1,112 @@
+// Шаблон предписания. Все данные отчёта передаются в json, см. generate_typst.generate_report_data.
+// Шаблон не меняется от отчёта к отчёту, поэтому typst разбирает его один раз и кэширует.
+//
+// Использование из документа:
+//   #import "/data/typst/template/report.typ": report
+//   #report(json("/data/typst/job_xxx/report.json"))
+// или напрямую: typst compile --root . --input data=/путь/к/report.json data/typst/template/report.typ
+
+// стили
+#let centered-title(body) = align(center)[
+  #text(size: 16pt, weight: "bold")[#body]]
+
+#let default-author = (role: "Ведущий инженер по ОТ и ПБ", name: "Жгулев Н.С./Муталинов Т.Е.")
+
+// одна фотография или несколько в ряд: ширина колонок пропорциональна соотношению сторон,
+// поэтому фотографии ряда получаются одной высоты
+#let photo-row(row, gutter) = {
+  let cells = row.map(photo => box(inset: 0pt, stroke: white)[#image(photo.path)])
+  if row.len() == 1 {
+    cells.first()
+  } else {
+    grid(columns: row.map(photo => photo.ratio * 1fr), gutter: gutter, ..cells)
+  }
+}
+
+#let photos(rows, gutter) = stack(dir: ttb, ..rows.map(row => photo-row(row, gutter)))
+
+#let description(violation) = [
+  Описание: #violation.description \ \
+  Категория: #violation.category \ \
+  Место нарушения: #violation.area \ \
+  Ответственный: #violation.responsible \ \
+  Нарушение зафиксировал: #violation.detector
+]
+
+#let violation-row(violation, gutter) = (
+  [#violation.number],
+  [#violation.date],
+  photos(violation.photo_rows, gutter),
+  align(left, description(violation)),
+  align(left, violation.terms),
+  text(size: 10pt, weight: "bold", violation.status),
+)
+
+#let report(data) = {
+  let settings = data.report_settings
+  let columns = ("number", "date", "photos", "violations", "terms", "corrected")
+  let author = if data.created_by == none { default-author } else { data.created_by }
+  let gutter = eval(data.image_row_gutter)
+
+  // базовые настройки
+  set page(
+    width: eval(settings.page_size.width),
+    height: eval(settings.page_size.height),
+    margin: eval(settings.page_size.margin),
+  )
+  set text(
+    font: "DejaVu Sans", // поставляется с ботом: src/bot/fonts
+    size: 10pt,
+  )
+  set heading(numbering: "1.")
+
+  // шапка
+  align(right)[Ответственным: \ #data.responsible]
+  align(right)[#author.role \ #author.name]
+
+  // заголовок
+  centered-title[Предписание]
+  [Дата формирования предписания: #data.today]
+  centered-title[Устранить следующие нарушения:]
+
+  // таблица
+  set table(
+    align: center,
+    inset: 5pt,
+    stroke: 0.5pt,
+  )
+  table(
+    columns: columns.map(column => eval(settings.col_width.at(column))),
+    // шапка таблицы
+    ..columns.map(column => strong(settings.headers.at(column))),
+    ..data.violations.map(violation => violation-row(violation, gutter)).flatten(),
+  )
+  [\ ]
+  text(size: 12pt, weight: "bold")[О выполнении настоящего предписания прошу сообщить по
+    каждому пункту \ согласно сроку устранения письменно.]
+  [\ \ ]
+  block[
+    #set par(leading: 1em)
+    #align(left)[
+      Предписание выдал: \
+      дата:#h(0.3cm) #data.today #h(0.3cm)
+      подпись:
+      #if data.sign_path != none [
+        #box(width: 3cm)[#hide[w]#place(top + left, dx: -3mm, dy: -10mm)[#image(data.sign_path, width: 3cm)]]
+      ] else [
+        #box(width: 3cm)[#hide[w]]
+      ]
+      #author.role #author.name
+    ]
+  ]
+  [\ ]
+  align(left)[
+    Контроль устранения нарушений провел: \ \
+    дата:#h(3cm)
+    подпись:#h(2cm)
+  ]
+}
+
+#if "data" in sys.inputs {
+  report(json(sys.inputs.data))
+}
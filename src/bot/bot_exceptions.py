@@ -33,3 +33,16 @@ class StringInputError(ValueError):
         # Объединяем все сообщения в одну строку
         error_message = "/n".join(messages)
         super().__init__(error_message)
+
+
+class TypstCompileError(RuntimeError):
+    """Исключение при ошибке компиляции typst-документа."""
+
+    def __init__(self, stderr: str | None = None) -> None:
+        """Инициализация текста исключения."""
+        self.stderr = stderr
+        super().__init__("Не удалось скомпилировать Typst файл")
+
+
+class TypstWatchError(RuntimeError):
+    """Процесс typst watch завершился или не ответил, нужна обычная компиляция."""
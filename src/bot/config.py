@@ -98,6 +98,18 @@ class Settings(BaseSettings):
     def report_template(self) -> Path:
         return self.typst_dir / "template"
 
+    @computed_field
+    @property
+    def report_store_dir(self) -> Path:
+        """Готовые отчёты, см. services.report_store."""
+        return self.DATA_DIR / "reports"
+
+    @computed_field
+    @property
+    def font_dir(self) -> Path:
+        """Шрифты, которые использует шаблон отчёта."""
+        return Path(__file__).resolve().parent / "fonts"
+
     @computed_field
     @property
     def image_dir(self) -> Path:
@@ -110,6 +122,18 @@ class Settings(BaseSettings):
         """Нужно записывать в базу относительный путь, чтобы typst нормально его обрабатывал"""
         return self.DATA_DIR / "images"
 
+    @computed_field
+    @property
+    def image_staging_dir(self) -> Path:
+        """Фотографии незавершенных регистраций нарушений, см. image_utils.StagingArea."""
+        return self.DATA_DIR / "staging"
+
+    @computed_field
+    @property
+    def thumbnail_dir(self) -> Path:
+        """Уменьшенные копии фотографий для отчетов."""
+        return self.DATA_DIR / "thumbnails"
+
 
     @field_validator("SUPER_USERS_TG_ID", mode="before")
     def parse_tuple(cls, value):
@@ -1,5 +1,6 @@
 """Константы бота."""
 
+import os
 from pathlib import Path
 from datetime import timezone, timedelta
 
@@ -56,8 +57,75 @@ def action_needed_deadline() -> tuple[dict[str, str], ...]:
 MAX_SEND_PHOTO = 4
 # какое должно быть оптимальное суммарное соотношение сторон у двух изображений в одной строке таблицы
 FIT_IMAGES_ASPECT_RATIO = 1.9
-# время ожидания в секундах загрузки каждого фото когда пользователь отправляет несколько фото
-MAX_SECONDS_TO_WAIT_WHILE_UPLOADING_PHOTOS = 1.0
-
-
-
+# максимальное количество фотографий в одном ряду таблицы отчёта
+MAX_IMAGES_PER_ROW = 3
+# время ожидания в секундах следующего фото альбома после получения предыдущего (фото скачиваются параллельно)
+MAX_SECONDS_TO_WAIT_WHILE_UPLOADING_PHOTOS = 0.5
+# максимальное количество фото в одном альбоме telegram: после получения стольких фото альбом собран
+MEDIA_GROUP_MAX_SIZE = 10
+# максимальное количество альбомов, которые собираются одновременно (от всех пользователей)
+MEDIA_GROUP_MAX_PENDING = 100
+# сколько секунд альбом может собираться вместе со скачиванием фото, после чего он отбрасывается
+MEDIA_GROUP_TTL = 60
+# максимальное количество одновременно выполняемых компиляций typst
+MAX_TYPST_WORKERS = 2
+# сколько из них могут занимать фоновые (прогревающие кэш) компиляции; один слот всегда остается интерактивным
+MAX_TYPST_BACKGROUND_WORKERS = 1
+# приоритет (nice) процессов фоновой компиляции typst
+TYPST_BACKGROUND_NICENESS = 10
+# typst использует только шрифты бота (settings.font_dir) и не сканирует системные шрифты при каждом запуске
+TYPST_USE_BUNDLED_FONTS = True
+# способ компиляции интерактивных отчётов: "process" - отдельный запуск typst на каждый отчёт,
+# "watch" - долгоживущие процессы typst watch, которые сохраняют загруженные шрифты и изображения между отчётами
+TYPST_BACKEND = "process"
+# сколько секунд ждать результата от процесса typst watch, после чего отчёт компилируется обычным способом
+TYPST_WATCH_TIMEOUT = 60
+# максимальный суммарный размер хранилища готовых отчётов (pdf, zip, xlsx) в байтах
+REPORT_STORE_MAX_BYTES = 512 * 1024 * 1024
+# время хранения неиспользуемого отчёта в хранилище
+REPORT_STORE_MAX_AGE = timedelta(days=7)
+# максимальный суммарный размер хранилища уменьшенных копий фотографий в байтах
+THUMBNAIL_STORE_MAX_BYTES = 1024 * 1024 * 1024
+# режим декодирования фотографий при уменьшении: "quality" - полное декодирование,
+# "balanced" и "fast" - черновое декодирование jpeg в уменьшенном масштабе (см. image_processing.DECODE_PROFILES)
+IMAGE_DECODE_PROFILE = "balanced"
+# разрешение фотографий в pdf-отчёте: размер уменьшенной копии считается по ширине ячейки и раскладке ряда
+REPORT_IMAGE_DPI = 150
+# шаг округления стороны уменьшенной копии вверх, чтобы близкие размеры использовали одну копию
+REPORT_IMAGE_SIDE_STEP = 32
+# разрешение и количество первых страниц png-превью отчёта, которое отправляется фотографией вместо pdf
+REPORT_PREVIEW_PPI = 110
+REPORT_PREVIEW_PAGES = 2
+# при проверке нарушения командой /check отправлять превью отчёта вместо pdf
+VIOLATION_REVIEW_PREVIEW = True
+# количество строк таблицы отчёта (данных отдельных нарушений), которые хранятся в памяти для повторных отчётов
+REPORT_FRAGMENT_CACHE_SIZE = 5000
+# количество процессов для параллельной подготовки изображений отчётов
+MAX_IMAGE_WORKERS = os.cpu_count() or 1
+# количество процессов подготовки изображений фоновых (прогревающих кэш) отчётов и их приоритет (nice)
+MAX_IMAGE_BACKGROUND_WORKERS = 1
+IMAGE_BACKGROUND_NICENESS = 10
+# количество потоков для обработки фотографий нового нарушения (чтение размеров из файлов)
+MAX_IMAGE_INGEST_WORKERS = 4
+# сколько хранятся фотографии незавершенной регистрации нарушения, после чего они удаляются
+IMAGE_STAGING_TTL = timedelta(hours=24)
+# как часто удаляются устаревшие фотографии незавершенных регистраций
+IMAGE_STAGING_SWEEP_INTERVAL = timedelta(hours=1)
+# фотографии, добавленные или измененные позже, не удаляются сборкой мусора, даже если на них никто не ссылается;
+# срок больше IMAGE_STAGING_TTL, чтобы не задеть фотографии только что подтвержденных нарушений
+IMAGE_GC_GRACE = timedelta(days=2)
+# количество строк, получаемых из базы и удаляемых за один раз при сборке мусора фотографий
+IMAGE_GC_CHUNK_SIZE = 1000
+# количество строк, получаемых из базы за один раз при выгрузке статистики
+STAT_EXPORT_CHUNK_SIZE = 1000
+# ограничения одной части (тома) большого отчёта: размер pdf должен проходить в telegram (50 МБ) и в почтовое вложение
+REPORT_PART_MAX_BYTES = 20 * 1024 * 1024
+REPORT_PART_MAX_VIOLATIONS = 200
+# оценка размера текста и разметки одного нарушения в pdf, без учета фотографий
+REPORT_VIOLATION_OVERHEAD_BYTES = 8 * 1024
+# отправлять тома отчёта по почте одним zip-архивом, а не отдельными письмами
+REPORT_VOLUMES_AS_ZIP = False
+# ограничение размера отчётов, отправляемых по почте; при превышении понижается качество jpeg
+REPORT_EMAIL_MAX_BYTES = 15 * 1024 * 1024
+# качество jpeg, которое последовательно пробуется, если отчёт не укладывается в ограничение размера
+REPORT_BUDGET_QUALITY_STEPS = (35, 25, 15)
@@ -1,98 +1,385 @@
 """Создание отчётов нарушений."""
 
-import io
-from datetime import date
-import platform
-import subprocess
-import tempfile
+import asyncio
+import hashlib
+import time
+import uuid
+import zipfile
+from datetime import date, datetime
 from pathlib import Path
 from collections import defaultdict
+from contextlib import suppress
+from typing import Any
 
 from openpyxl import Workbook
-from typing import Sequence
+from collections.abc import AsyncIterator, Callable, Coroutine, Sequence
 
+from bot.constants import (
+    REPORT_BUDGET_QUALITY_STEPS,
+    REPORT_PART_MAX_BYTES,
+    REPORT_IMAGE_DPI,
+    REPORT_PART_MAX_VIOLATIONS,
+    REPORT_PREVIEW_PAGES,
+    REPORT_PREVIEW_PPI,
+    REPORT_VIOLATION_OVERHEAD_BYTES,
+)
 from bot.enums import ViolationStatus
 from bot.db.models import UserModel, ViolationModel
 from bot.logger_config import log
-from bot.handlers.reports_handlers.reports_utils import remove_default_sheet
-from bot.handlers.reports_handlers.generate_typst import generate_typst
+from bot.handlers.reports_handlers.generate_typst import generate_report_data, generate_typst, get_report_settings
+from bot.handlers.reports_handlers.image_layout import plan_thumbnail_profiles
+from bot.handlers.reports_handlers.reports_utils import split_report_parts
 from bot.config import settings
-from bot.utils.image_utils import create_temp_images
+from bot.repositories.violation_repo import ViolationRepository
+from bot.services.report_store import report_fingerprint, report_store
+from bot.services.typst_render import typst_renderer
+from bot.utils.image_processing import JPEG_QUALITY
+from bot.utils.image_utils import prepare_report_images, report_images_in_use
 
 def write_typst_file(created_by: UserModel, violations: tuple, typ_file: Path, imgs_mapping: dict[str, str]) -> None:
-    typst_document = generate_typst(violations, created_by=created_by, imgs_mapping=imgs_mapping)
+    """Записывает данные отчёта в json рядом с typ-файлом и сам typ-файл, подключающий шаблон."""
+    data_file = typ_file.with_suffix(".json")
+    with data_file.open("w", encoding="utf-8") as df:
+        df.write(generate_report_data(violations, created_by=created_by, imgs_mapping=imgs_mapping))
     with typ_file.open("w", encoding="utf-8") as tf:
-        tf.write(typst_document)
+        tf.write(generate_typst(data_file))
 
 
-def create_typst_report(created_by: UserModel, violations: Sequence[ViolationModel]) -> Path:
-    """Создание отчёта pdf с помощью typst."""
-
+def get_file_number(violations: Sequence[ViolationModel]) -> str:
+    """Номер для имени файла отчёта: номер нарушения или диапазон номеров."""
     if violations:
         first, last= violations[0], violations[-1]
         if first == last:
-            file_number = str(first.number)
             log.info("создается предписание № {f.number}({f.id})", f=first)
-        else:
-            file_number = f"{first.number}_{last.number}"
-            log.info("создаются предписания №№ {f.number}({f.id}) - {l.number}({l.id})", f=first, l=last)
+            return str(first.number)
+        log.info("создаются предписания №№ {f.number}({f.id}) - {l.number}({l.id})", f=first, l=last)
+        return f"{first.number}_{last.number}"
+
+    log.info("создается предписание по пустой выборке")
+    return "отсутствует"
+
+
+class _InflightReport:
+    """Выполняющаяся компиляция отчёта и число ожидающих её запросов."""
+
+    def __init__(self, task: asyncio.Task, background: bool) -> None:
+        self.task = task
+        self.background = background  # компиляция запущена с пониженным приоритетом
+        self.waiters = 0
+        self.replaced_by: _InflightReport | None = None  # компиляция, которая заменила отмененную фоновую
+
+
+# компиляции, выполняющиеся сейчас, по отпечатку отчёта
+_inflight_reports: dict[str, _InflightReport] = {}
 
-    else:
-        file_number ="отсутствует"
-        log.info("создается предписание по пустой выборке")
-
-    typ_file = settings.report_typ_file
-    tmp = tempfile.TemporaryDirectory(dir=settings.typst_dir)
-    temp_img_dir = Path(tmp.name)
-    imgs_mapping = create_temp_images(temp_img_dir, violations)
-
-
-    write_typst_file(created_by, violations, typ_file, imgs_mapping)
-    # pdf_file = settings.report_pdf_file
-    pdf_file = settings.typst_dir / f"предписание_{file_number}.pdf"
-    if pdf_file.exists():
-        try:
-            pdf_file.unlink()
-        except OSError as e:
-            log.error("Ошибка удаления файла {f} перед созданием нового", f=pdf_file)
-            log.exception(e)
-    if platform.system() == "Windows":
-        typst_command = settings.typst_dir / "typst.exe"
-        cmd = [typst_command, "compile", "--root", settings.BASE_DIR, typ_file, pdf_file]
 
+async def _shared_render[T](
+        fingerprint: str,
+        render: Callable[[bool], Coroutine[Any, Any, T]],
+        name: str,
+        background: bool,
+) -> T:
+    """Запускает компиляцию отчёта или присоединяется к уже выполняющейся компиляции с тем же отпечатком.
+
+    render(background) создает компиляцию с нужным приоритетом. Если обычный запрос застает фоновую компиляцию
+    (прогрев кэша), она отменяется и заменяется обычной, а ожидавшие её запросы переходят к новой компиляции.
+    """
+    inflight = _inflight_reports.get(fingerprint)
+    if inflight is None or (inflight.background and not background):
+        previous = inflight
+        task = asyncio.create_task(render(background))
+        inflight = _inflight_reports[fingerprint] = _InflightReport(task, background)
+        task.add_done_callback(lambda _, started=inflight: _forget_inflight(fingerprint, started))
+        if previous is not None:
+            log.debug("фоновая компиляция {f} заменена обычной", f=name)
+            previous.replaced_by = inflight
+            previous.task.cancel()
     else:
-        cmd = ["typst", "compile", "--root", settings.BASE_DIR, typ_file, pdf_file]
+        log.debug("ожидание уже выполняющейся компиляции {f}", f=name)
 
+    inflight.waiters += 1
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-        log.info(result.stdout)
-        log.warning(result.stderr)
-    except subprocess.CalledProcessError as e:
-        log.warning(e.stdout)
-        log.error(e.stderr)
-        msg = "Не удалось скомпилировать Typst файл"
-        raise RuntimeError(msg)
+        while True:
+            try:
+                return await asyncio.shield(inflight.task)
+            except asyncio.CancelledError:
+                # отменили сам запрос или компиляцию, которую никто не заменял
+                if inflight.replaced_by is None or asyncio.current_task().cancelling():
+                    raise
+            inflight.waiters -= 1
+            inflight = inflight.replaced_by
+            inflight.waiters += 1
     finally:
-        tmp.cleanup()
-    typ_file.unlink(missing_ok=True)
+        inflight.waiters -= 1
+        # компиляцию отменяем, только если отчёт больше никто не ждет
+        if inflight.waiters == 0 and not inflight.task.done():
+            inflight.task.cancel()
+
+
+def _forget_inflight(fingerprint: str, inflight: _InflightReport) -> None:
+    """Убирает завершившуюся компиляцию из выполняющихся, если её еще не заменила другая."""
+    if _inflight_reports.get(fingerprint) is inflight:
+        del _inflight_reports[fingerprint]
+
+
+async def create_typst_report(
+        created_by: UserModel,
+        violations: Sequence[ViolationModel],
+        file_name: str | None = None,
+        background: bool = False,
+        byte_budget: int | None = None,
+) -> Path:
+    """Создание отчёта pdf с помощью typst.
+
+    Подготовка изображений и компиляция выполняются вне цикла событий, каждое задание работает
+    в собственном временном каталоге. Если набор нарушений не менялся, возвращается pdf из кэша,
+    а одновременные запросы одного и того же отчёта ожидают одну общую компиляцию.
+    background - фоновое создание отчёта (прогрев кэша) с пониженным приоритетом подготовки изображений и компиляции;
+    обычный запрос того же отчёта заменяет фоновую компиляцию обычной.
+    byte_budget - желаемый предельный размер pdf, при превышении понижается качество фотографий.
+    """
+    if file_name is None:
+        file_name = f"предписание_{get_file_number(violations)}.pdf"
+
+    fingerprint = report_fingerprint(created_by, violations, file_name, f"budget={byte_budget}")
+    cached = await asyncio.to_thread(report_store.get, fingerprint)
+    if cached is not None:
+        log.success(f"PDF взят из кэша: {cached}")
+        return cached
+
+    return await _shared_render(
+        fingerprint,
+        lambda background: _render_typst_report(
+            created_by, violations, file_name, fingerprint, background, byte_budget
+        ),
+        file_name,
+        background,
+    )
+
+
+async def _render_typst_report(
+        created_by: UserModel,
+        violations: Sequence[ViolationModel],
+        file_name: str,
+        fingerprint: str,
+        background: bool,
+        byte_budget: int | None,
+) -> Path:
+    """Компиляция отчёта во временном каталоге и перенос результата в хранилище отчётов."""
+    started = time.perf_counter()
+    async with report_images_in_use(violations), typst_renderer.workspace() as job_dir:
+        imgs_mapping = await prepare_images_within_budget(violations, byte_budget, background=background)
+        typ_file = job_dir / "report.typ"
+        await asyncio.to_thread(write_typst_file, created_by, violations, typ_file, imgs_mapping)
+        job_pdf = await typst_renderer.compile(typ_file, job_dir / file_name, background=background)
+        pdf_file = await asyncio.to_thread(
+            report_store.put,
+            fingerprint,
+            job_pdf,
+            kind="pdf",
+            fingerprint=fingerprint,
+            created_by=created_by.id,
+            violations=[violation.id for violation in violations],
+            byte_budget=byte_budget,
+            background=background,
+            render_seconds=round(time.perf_counter() - started, 3),
+        )
     log.success(f"PDF успешно создан: {pdf_file}")
     return pdf_file
 
 
-def create_static_report(violations: tuple) -> bytes:
-    """Создание статистического отчёта xlsx."""
-    # TODO добавить период выгрузки для violations после получения достаточного объема данных
-    wb = Workbook()
-    wb = remove_default_sheet(wb)
+async def create_typst_preview(
+        created_by: UserModel,
+        violations: Sequence[ViolationModel],
+        pages: int = REPORT_PREVIEW_PAGES,
+        ppi: int = REPORT_PREVIEW_PPI,
+        background: bool = False,
+) -> list[bytes]:
+    """Превью отчёта: первые pages страниц в png с разрешением ppi.
+
+    Используются те же данные и шаблон, что и для pdf, а фотографии готовятся под разрешение превью,
+    поэтому оно создается быстрее pdf и занимает меньше места. Превью хранится в report_store
+    под отпечатком отчёта, как pdf в create_typst_report, и одновременные запросы ожидают одну компиляцию.
+    background - фоновое создание превью (прогрев кэша). Возвращает содержимое png по страницам.
+    """
+    fingerprint = report_fingerprint(created_by, violations, variant=f"preview pages={pages} ppi={ppi}")
+    png_files = await asyncio.to_thread(report_store.get_pages, fingerprint)
+    if png_files:
+        log.debug("превью взято из кэша: {k}", k=fingerprint)
+    else:
+        png_files = await _shared_render(
+            fingerprint,
+            lambda background: _render_typst_preview(created_by, violations, fingerprint, pages, ppi, background),
+            f"превью {get_file_number(violations)}",
+            background,
+        )
+    return [await asyncio.to_thread(png_file.read_bytes) for png_file in png_files]
+
+
+async def _render_typst_preview(
+        created_by: UserModel,
+        violations: Sequence[ViolationModel],
+        fingerprint: str,
+        pages: int,
+        ppi: int,
+        background: bool,
+) -> list[Path]:
+    """Компиляция превью во временном каталоге и перенос страниц в хранилище отчётов."""
+    started = time.perf_counter()
+    async with report_images_in_use(violations), typst_renderer.workspace() as job_dir:
+        imgs_mapping = await prepare_images_within_budget(violations, dpi=ppi, background=background)
+        typ_file = job_dir / "report.typ"
+        await asyncio.to_thread(write_typst_file, created_by, violations, typ_file, imgs_mapping)
+        png_files = await typst_renderer.compile_png(typ_file, job_dir, ppi=ppi, pages=pages, background=background)
+        return await asyncio.to_thread(
+            report_store.put_pages,
+            fingerprint,
+            png_files,
+            kind="preview",
+            fingerprint=fingerprint,
+            created_by=created_by.id,
+            violations=[violation.id for violation in violations],
+            ppi=ppi,
+            background=background,
+            render_seconds=round(time.perf_counter() - started, 3),
+        )
+
+
+def estimate_violation_sizes(violations: Sequence[ViolationModel], imgs_mapping: dict[str, str]) -> list[int]:
+    """Оценка вклада каждого нарушения в размер pdf: уменьшенные фотографии и текст."""
+    sizes = []
+    for violation in violations:
+        size = REPORT_VIOLATION_OVERHEAD_BYTES
+        for img in violation.files:
+            with suppress(KeyError, OSError):
+                size += (settings.BASE_DIR / imgs_mapping[img.hash].lstrip("/")).stat().st_size
+        sizes.append(size)
+    return sizes
+
+
+async def prepare_images_within_budget(
+        violations: Sequence[ViolationModel],
+        byte_budget: int | None = None,
+        dpi: int = REPORT_IMAGE_DPI,
+        background: bool = False,
+) -> dict[str, str]:
+    """Подготавливает фотографии отчёта в размерах, которые они займут в ячейках таблицы при разрешении dpi.
+
+    Если задан byte_budget, а оценка размера отчёта его превышает, качество jpeg последовательно
+    понижается (REPORT_BUDGET_QUALITY_STEPS). Если не помогает и самое низкое качество, используется оно.
+    background - изображения фонового отчёта, см. prepare_report_images.
+    Возвращает словарь, как prepare_report_images.
+    """
+    report_settings = await asyncio.to_thread(get_report_settings)
+    for quality in (JPEG_QUALITY, *REPORT_BUDGET_QUALITY_STEPS):
+        profiles = plan_thumbnail_profiles(violations, report_settings, quality=quality, dpi=dpi)
+        imgs_mapping = await prepare_report_images(violations, profiles, background)
+        if byte_budget is None:
+            break
+        size = sum(await asyncio.to_thread(estimate_violation_sizes, violations, imgs_mapping))
+        if size <= byte_budget:
+            break
+        log.info("оценка размера отчёта {s} байт при качестве {q} больше {b}", s=size, q=quality, b=byte_budget)
+    return imgs_mapping
+
+
+async def iter_typst_report_volumes(
+        created_by: UserModel,
+        violations: Sequence[ViolationModel],
+        byte_budget: int | None = None,
+) -> AsyncIterator[Path]:
+    """Создание большого отчёта в виде пронумерованных томов.
+
+    Нарушения делятся на части, ограниченные количеством и оценочным размером, части компилируются
+    параллельно (в пределах пула typst), а тома отдаются по порядку сразу по готовности.
+    Небольшой отчёт отдается одним файлом, как в create_typst_report.
+    byte_budget - ограничение размера каждого тома, см. create_typst_report.
+    """
+    # деление на тома по обычному качеству, качество понижается уже внутри тома, если он не укладывается
+    imgs_mapping = await prepare_images_within_budget(violations)
+    sizes = await asyncio.to_thread(estimate_violation_sizes, violations, imgs_mapping)
+    max_bytes = REPORT_PART_MAX_BYTES if byte_budget is None else min(REPORT_PART_MAX_BYTES, byte_budget)
+    parts = split_report_parts(violations, sizes, max_bytes, REPORT_PART_MAX_VIOLATIONS)
+    if len(parts) == 1:
+        yield await create_typst_report(created_by, violations, byte_budget=byte_budget)
+        return
+
+    file_number = get_file_number(violations)
+    log.info("отчет разделен на {n} томов", n=len(parts))
+    tasks = [
+        asyncio.create_task(
+            create_typst_report(
+                created_by,
+                part,
+                f"предписание_{file_number}_том_{index}_из_{len(parts)}.pdf",
+                byte_budget=byte_budget,
+            )
+        )
+        for index, part in enumerate(parts, start=1)
+    ]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        # если получатель прекратил чтение томов, незавершенные компиляции не нужны
+        for task in tasks:
+            task.cancel()
+
+
+async def create_chunked_typst_report(
+        created_by: UserModel,
+        violations: Sequence[ViolationModel],
+        as_zip: bool = False,
+        byte_budget: int | None = None,
+) -> list[Path]:
+    """Создание большого отчёта томами. При as_zip тома упаковываются в один zip-архив."""
+    volumes = [volume async for volume in iter_typst_report_volumes(created_by, violations, byte_budget)]
+    if not as_zip or len(volumes) == 1:
+        return volumes
+    return [await asyncio.to_thread(pack_report_volumes, volumes, f"предписание_{get_file_number(violations)}.zip")]
+
+
+def pack_report_volumes(volumes: Sequence[Path], archive_name: str) -> Path:
+    """Упаковывает тома отчёта в zip-архив без повторного сжатия pdf.
+
+    Тома лежат в хранилище отчётов в каталогах своих отпечатков, поэтому ключ архива составляется
+    из них, и архив из тех же томов повторно не собирается.
+    """
+    volume_keys = [volume.parent.name for volume in volumes]
+    key = "zip-" + hashlib.sha256("|".join([archive_name, *volume_keys]).encode()).hexdigest()
+    archive = report_store.get(key)
+    if archive is not None:
+        return archive
+    started = time.perf_counter()
+    tmp_path = settings.typst_dir / f"{uuid.uuid4().hex}.tmp"
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as zf:
+        for volume in volumes:
+            zf.write(volume, arcname=volume.name)
+    return report_store.put(
+        key,
+        tmp_path,
+        file_name=archive_name,
+        kind="zip",
+        volumes=volume_keys,
+        render_seconds=round(time.perf_counter() - started, 3),
+    )
+
+
+async def create_static_report(
+        violation_repo: ViolationRepository,
+        start_date: datetime | None = None,
+        end_date: datetime | None = None,
+) -> Path:
+    """Создание статистического отчёта xlsx.
+
+    Строки читаются из базы порциями и сразу записываются в книгу в режиме write-only,
+    поэтому расход памяти не зависит от количества нарушений. Возвращает путь к файлу отчёта.
+    """
+    started = time.perf_counter()
+    wb = Workbook(write_only=True)
 
     # полный отчёт
-    wb.create_sheet(title="Полный отчёт")
-    full_report_ws = wb["Полный отчёт"]
+    full_report_ws = wb.create_sheet(title="Полный отчёт")
     # шапка
     full_report_ws.append(
         [
@@ -108,47 +395,37 @@ def create_static_report(violations: tuple) -> bytes:
             "Обнаружено работником",  # ["detector"]["first_name"] + ["detector"]["user_role"]
         ]
     )
+
     # данные полного отчёта
-    for violation in violations:
-        full_report_ws.append(
-            [
-                violation.number,
-                violation.area.name,
-                violation.description,
-                violation.area.responsible_user.first_name
-                if violation.area.responsible_user_id
-                else (violation.area.responsible_text),
-                violation.category,
-                violation.actions_needed,
-                violation.status,
-                violation.created_at.strftime("%d.%m.%Y %H:%M:%S"),
-                violation.updated_at.strftime("%d.%m.%Y %H:%M:%S")
-                if violation.status == ViolationStatus.CORRECTED
-                else "",
-                f"ФИО: {violation.detector.first_name} Роль:{violation.detector.user_role}",
-            ]
-        )
+    async for rows in violation_repo.stream_violations_for_statistics(start_date, end_date):
+        for row in rows:
+            full_report_ws.append(
+                [
+                    row.number,
+                    row.area_name,
+                    row.description,
+                    row.responsible,
+                    row.category,
+                    row.actions_needed,
+                    row.status,
+                    row.created_at.strftime("%d.%m.%Y %H:%M:%S"),
+                    row.updated_at.strftime("%d.%m.%Y %H:%M:%S")
+                    if row.status == ViolationStatus.CORRECTED
+                    else "",
+                    f"ФИО: {row.detector_name} Роль:{row.detector_role}",
+                ]
+            )
 
-    # отчёт по каждому месту нарушения
+    # отчёт по каждому месту нарушения, количество подсчитывается в базе
     area_report_data = {}
+    for row in await violation_repo.count_violations_by_area_and_status(start_date, end_date):
+        if row.area_name not in area_report_data:
+            area_report_data[row.area_name] = {"violations": defaultdict(int)}
 
-    for violation in violations:
-        area_name = violation.area.name
-        responsible = (
-            violation.area.responsible_user.first_name
-            if violation.area.responsible_user_id
-            else (violation.area.responsible_text)
-        )
-        status = violation.status
+        area_report_data[row.area_name]["violations"][row.status] += row.violations_count
+        area_report_data[row.area_name]["responsible"] = row.responsible
 
-        if area_name not in area_report_data:
-            area_report_data[area_name] = {"violations": defaultdict(int)}
-
-        area_report_data[area_name]["violations"][status] += 1
-        area_report_data[area_name]["responsible"] = responsible
-
-    wb.create_sheet(title="Места нарушения")
-    area_report_ws = wb["Места нарушения"]
+    area_report_ws = wb.create_sheet(title="Места нарушения")
 
     # шапка
     area_report_ws.append(
@@ -161,7 +438,7 @@ def create_static_report(violations: tuple) -> bytes:
             ViolationStatus.REJECTED.value,
         ]
     )
-    # данные полного отчёта
+    # данные отчёта по местам нарушения
     for area, violation_statuses in area_report_data.items():
         area_report_ws.append(
             [
@@ -174,18 +451,19 @@ def create_static_report(violations: tuple) -> bytes:
             ]
         )
 
-    # результат
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return output.getvalue()
-
-
-def save_static_report(body: bytes) -> Path:
-    filename = f"статистика за {date.today().strftime("%d.%m.%Y")}.xlsx"
-    fullpath = settings.typst_dir / filename
-    with fullpath.open(mode="wb") as xlsx:
-        xlsx.write(body)
-    log.info(f"Файл статистики {filename} записан.")
+    # результат: статистика зависит от текущего состояния базы, поэтому каждый отчёт хранится под новым ключом
+    today = date.today().strftime("%d.%m.%Y")
+    tmp_path = settings.typst_dir / f"{uuid.uuid4().hex}.tmp"
+    await asyncio.to_thread(wb.save, tmp_path)
+    fullpath = await asyncio.to_thread(
+        report_store.put,
+        report_store.new_key("stat"),
+        tmp_path,
+        file_name=f"статистика за {today}.xlsx",
+        kind="xlsx",
+        start_date=start_date,
+        end_date=end_date,
+        render_seconds=round(time.perf_counter() - started, 3),
+    )
+    log.info(f"Файл статистики {fullpath.name} записан.")
     return fullpath
-
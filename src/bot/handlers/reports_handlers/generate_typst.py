@@ -1,34 +1,36 @@
-from dataclasses import dataclass
 import json
-from pathlib import Path
+import threading
+from collections import OrderedDict
 from datetime import datetime, timezone
-from jinja2 import Environment, FileSystemLoader
+from pathlib import Path
 from typing import Callable
 from bot.db.models import FileModel
 from bot.config import settings
-from bot.constants import tz, FIT_IMAGES_ASPECT_RATIO
-from bot.db.models import UserModel
+from bot.constants import REPORT_FRAGMENT_CACHE_SIZE, tz
+from bot.db.models import UserModel, ViolationModel
+from bot.utils.image_utils import typst_root_path
+from bot.handlers.reports_handlers.image_layout import IMAGE_ROW_GUTTER_PT, pack_image_rows
+
 
+_report_settings_cache: dict[str, object] = {"mtime": None, "value": None}
 
 
-@dataclass
-class ViolationData:
-    number: str
-    date: str
-    photos: str
-    description: str
-    terms: str
-    status: str
+def get_report_settings() -> dict:
+    """Возвращает настройки отчёта, перечитывая файл только после его изменения."""
+    mtime = settings.report_config_file.stat().st_mtime_ns
+    if _report_settings_cache["mtime"] != mtime:
+        with settings.report_config_file.open(encoding="utf-8") as file:
+            _report_settings_cache["value"] = json.load(file)
+        _report_settings_cache["mtime"] = mtime
+    return _report_settings_cache["value"]
 
 
-def _get_sign_path(user: UserModel) -> Path | None:
+def _get_sign_path(user: UserModel) -> str | None:
     """Если изображение подписи для данного пользователя доступно, возвращает путь, доступный для использования
     в typst-отчете."""
-    sign_subpath = Path("signs") / f"{user.id}.png"
-    rel_sign_path = settings.image_dir / sign_subpath
-    sign_path = settings.image_write_dir / sign_subpath
+    sign_path = settings.image_write_dir / "signs" / f"{user.id}.png"
     if sign_path.exists():
-        return Path("..") / rel_sign_path
+        return typst_root_path(sign_path)
     return None
 
 type ImgResolver = Callable[[FileModel], str]
@@ -36,114 +38,138 @@ type ImgResolver = Callable[[FileModel], str]
 def _image_resolver_factory(img_map: dict[str, str]) -> ImgResolver:
 
     def _get_image_path(image: FileModel) -> str:
-        """Возвращает путь фотографии из базы, доступной для использования в typst-шаблоне."""
-        path = img_map[image.path]
+        """Возвращает путь уменьшенной копии фотографии для typst-шаблона по хэшу фотографии."""
+        path = img_map[image.hash]
         return path
 
     return _get_image_path
 
-def _image_string(image: FileModel, img_resolver: ImgResolver) -> str:
-    """Возвращает фрагмент форматирования typst, представляющий собой картинку."""
-    image_path_relative = img_resolver(image)
-    return f'box(inset:0pt, stroke:white)[#image("{image_path_relative}")]'
-
-
-def _image_grid(images: list[FileModel], img_resolver: ImgResolver) -> str:
-    """ "Функция создает фрагмент форматирования, где две фотографии расположены в ряд."""
-    output = []
-    data_list = []
-    template = "grid(columns: ({0}fr, {1}fr), gutter: 2pt,{2})\n"
-    for image in images:
-        output.append(_image_string(image, img_resolver))
-        data_list.append(int(image.aspect_ratio * 100))
-    data_list.append(",\n".join(output))
-    return template.format(*data_list)
-
-
-def _image_row_expression(images: list[FileModel], img_resolver: ImgResolver) -> str:
-    """Выбирает какой фрагмент форматирования вернуть: одну или две фотографии в ряд."""
-    if len(images) == 1:
-        return _image_string(images[0], img_resolver)
-    elif len(images) > 1:
-        return _image_grid(images, img_resolver)
-    raise Exception("Пустой список изображений")
-
-def _get_images_struct(images: list[FileModel]):
+
+def _get_images_struct(images: list[FileModel]) -> list[list[FileModel]]:
     """Формирует структуру (список списков) из рядов изображений.
 
-    В каждом ряду тоже может быть несколько изображений. В текущей реализации: одно или два."""
-    images.sort(key=lambda x: x.aspect_ratio)
-    rows = []
-    while images:
-        pair_aspect_ratio = []
-        cur_img = images.pop()
-        row = [cur_img]
-        for pair in images:
-            pair_aspect_ratio.append(FIT_IMAGES_ASPECT_RATIO - cur_img.aspect_ratio - pair.aspect_ratio)
-        only_pozitive_delta = list(filter(lambda x: x >= 0, pair_aspect_ratio))
-        if only_pozitive_delta and images:
-            pair_index = pair_aspect_ratio.index(min(only_pozitive_delta))
-            row.append(images.pop(pair_index))
-        rows.append(row)
-
-    return rows
-
-
-def _get_images_layout(images: list[FileModel], img_resolver: ImgResolver) -> str:
-    """Компонует фотографии в таблице.
-
-    Если фотографии вертикальные, компонует их по две в ряд. Если горизонтальные, то по одной.
-    Возвращает фрагмент форматирования для ячейки таблицы, где размещены все фотографии."""
-    imgs_string = ""
-    img_rows = _get_images_struct(images)
-    for row in img_rows:
-        imgs_string += _image_row_expression(row, img_resolver) + ",\n"
-    result = "#stack(dir: ttb, {})".format(imgs_string)
-    return result
-
-
-def generate_typst(violations: tuple, created_by: UserModel, imgs_mapping: dict) -> str:
-    """Генерация typst-кода.."""
+    В каждом ряду от одной до MAX_IMAGES_PER_ROW фотографий, см. image_layout.pack_image_rows.
+    """
+    return pack_image_rows(images)
+
+
+def _get_images_layout(images: list[FileModel], img_resolver: ImgResolver) -> list[list[dict]]:
+    """Ряды фотографий для ячейки таблицы: путь и соотношение сторон каждой фотографии.
+
+    Вертикальные фотографии компонуются по несколько в ряд, горизонтальные - по одной.
+    """
+    return [
+        [{"path": img_resolver(image), "ratio": image.aspect_ratio} for image in row]
+        for row in _get_images_struct(images)
+    ]
+
+
+def _violation_data(violation: ViolationModel, img_resolver: ImgResolver) -> dict:
+    """Данные строки таблицы отчёта для одного нарушения."""
+    return {
+        "number": str(violation.number),
+        "date": violation.created_at.replace(tzinfo=timezone.utc).astimezone(tz=tz).strftime("%d.%m.%Y %H:%M"),
+        "photo_rows": _get_images_layout(violation.files, img_resolver),
+        "description": violation.description,
+        "category": violation.category,
+        "area": violation.area.name,
+        "responsible": violation.area.responsible_text,
+        "detector": violation.detector.first_name,
+        "terms": violation.actions_needed,
+        "status": str(violation.status),
+    }
+
+
+class FragmentCache:
+    """Кэш строк таблицы отчёта: данные нарушения, уже сериализованные в json.
+
+    Ежедневные, ежемесячные и сводные отчёты в основном состоят из нарушений, которые уже попадали в прежние
+    отчёты, поэтому заново собираются только изменившиеся строки. Вытесняются давно не использованные записи.
+    """
+
+    def __init__(self, max_size: int = REPORT_FRAGMENT_CACHE_SIZE) -> None:
+        """Инициализация кэша."""
+        self.max_size = max_size
+        self._fragments: OrderedDict[tuple, str] = OrderedDict()
+        # данные отчёта собираются в потоках, в том числе для нескольких томов одновременно
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(violation: ViolationModel, img_resolver: ImgResolver) -> tuple:
+        """Всё, от чего зависит строка таблицы.
+
+        Время изменения нарушения не меняется при переименовании места нарушения или автора,
+        поэтому эти значения входят в ключ отдельно, как и пути уменьшенных копий фотографий.
+        Статус учитывается отдельно, как в report_fingerprint: время изменения хранится с точностью
+        до секунды, и смена статуса в ту же секунду его не меняет.
+        """
+        return (
+            violation.id,
+            violation.updated_at,
+            violation.status,
+            violation.area.name,
+            violation.area.responsible_text,
+            violation.detector.first_name,
+            tuple(img_resolver(image) for image in violation.files),
+        )
+
+    def get(self, violation: ViolationModel, img_resolver: ImgResolver) -> str:
+        """Возвращает данные нарушения в json, собирая их только при отсутствии в кэше."""
+        key = self.key(violation, img_resolver)
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                return fragment
+        fragment = json.dumps(_violation_data(violation, img_resolver), ensure_ascii=False)
+        with self._lock:
+            self._fragments[key] = fragment
+            while len(self._fragments) > self.max_size:
+                self._fragments.popitem(last=False)
+        return fragment
+
+    def clear(self) -> None:
+        """Очищает кэш."""
+        with self._lock:
+            self._fragments.clear()
+
+
+fragment_cache = FragmentCache()
+
+
+def generate_report_data(violations: tuple, created_by: UserModel, imgs_mapping: dict) -> str:
+    """Данные отчёта для шаблона report.typ в формате json.
+
+    Вся вёрстка выполняется в шаблоне, здесь собираются только значения. Строки таблицы берутся
+    из fragment_cache, поэтому время генерации зависит от числа изменившихся нарушений, а не от размера отчёта.
+    """
     responsible_mans = []
     for i in violations:
         if i.area.responsible_user:
             responsible_mans.append(i.area.responsible_user.first_name)
         else:
             responsible_mans.append(i.area.responsible_text)
-    responsible_str = ", ".join(set(responsible_mans))
-    with settings.report_config_file.open(encoding="utf-8") as file:
-        report_settings = json.load(file)
-
-    env = Environment(loader=FileSystemLoader(settings.report_template))
-    template = env.get_template("main.j2")
-    violation_table = []
-    for violation in violations:
-        description = f"""
-            Описание: {violation.description} \\ \\
-            Категория: {violation.category} \\ \\
-            Место нарушения: {violation.area.name} \\ \\
-            Ответственный: {violation.area.responsible_text} \\ \\
-            Нарушение зафиксировал: {violation.detector.first_name}"""
-
-        violation_table.append(
-            ViolationData(
-                number=violation.number,
-                date=violation.created_at.replace(tzinfo=timezone.utc).astimezone(tz=tz).strftime("%d.%m.%Y %H:%M"),
-                photos=_get_images_layout(violation.files, _image_resolver_factory(imgs_mapping)),
-                description=description,
-                terms=violation.actions_needed,
-                status=violation.status,
-            )
-        )
-
-    # TODO: вместо словаря лучше передавать объект со всеми параметрами.
-    context = {
-        "report_settings": report_settings,
-        "responsible_str": responsible_str,
-        "created_by": created_by,
-        "today": datetime.now(tz=tz).strftime("%d.%m.%Y"),
-        "violations": violation_table,
-        "sign_path": _get_sign_path(created_by),
-    }
-    typst_code = template.render(**context)
-    return typst_code
+    img_resolver = _image_resolver_factory(imgs_mapping)
+    header = json.dumps(
+        {
+            "report_settings": get_report_settings(),
+            "responsible": ", ".join(set(responsible_mans)),
+            "created_by": {"role": str(created_by.user_role), "name": created_by.first_name} if created_by else None,
+            "today": datetime.now(tz=tz).strftime("%d.%m.%Y"),
+            "sign_path": _get_sign_path(created_by) if created_by else None,
+            "image_row_gutter": f"{IMAGE_ROW_GUTTER_PT}pt",
+        },
+        ensure_ascii=False,
+    )
+    rows = ",".join(fragment_cache.get(violation, img_resolver) for violation in violations)
+    # строки таблицы уже в json, поэтому добавляются к заголовку без повторной сериализации
+    return f'{header[:-1]}, "violations": [{rows}]}}'
+
+
+def generate_typst(data_file: Path) -> str:
+    """Документ typst, который подключает шаблон отчёта и передает ему файл данных.
+
+    Пути указываются от корня проекта, поэтому документ можно компилировать из любого каталога.
+    """
+    template = typst_root_path(settings.report_template / "report.typ")
+    return f'#import "{template}": report\n#report(json("{typst_root_path(data_file)}"))\n'
@@ -0,0 +1,180 @@
+"""Компоновка фотографий нарушения по рядам ячейки отчёта.
+
+Фотографии в ряду выравниваются по высоте: ширина колонки пропорциональна соотношению сторон, поэтому
+высота ряда равна ширине ячейки, деленной на сумму соотношений сторон фотографий ряда. В ряд ставится
+от одной до max_per_row фотографий, если сумма их соотношений сторон не превышает max_row_ratio,
+иначе фотографии становятся слишком мелкими. Среди допустимых раскладок выбирается та, у которой
+суммарная высота рядов минимальна.
+"""
+
+import math
+import re
+from collections.abc import Iterable, Sequence
+from functools import cache
+from itertools import combinations
+from typing import Protocol
+
+from bot.constants import FIT_IMAGES_ASPECT_RATIO, MAX_IMAGES_PER_ROW, REPORT_IMAGE_DPI, REPORT_IMAGE_SIDE_STEP
+from bot.db.models import ViolationModel
+from bot.logger_config import log
+from bot.utils.image_processing import JPEG_QUALITY, MAX_SIDE, ThumbnailProfile
+
+# до этого количества фотографий раскладка ищется среди всех разбиений на ряды,
+# для большего количества - среди рядов из соседних по соотношению сторон фотографий
+EXACT_LAYOUT_MAX_IMAGES = 8
+# промежуток между фотографиями в ряду и внутренний отступ ячейки таблицы, как в шаблоне отчёта (в pt)
+IMAGE_ROW_GUTTER_PT = 2
+TABLE_CELL_INSET_PT = 5
+
+MM_PER_UNIT = {"mm": 1.0, "cm": 10.0, "in": 25.4, "pt": 25.4 / 72}
+
+
+class HasAspectRatio(Protocol):
+    """Фотография с известным соотношением сторон (FileModel или ImageInfo)."""
+
+    aspect_ratio: float
+
+
+def _row_fits(ratios: Sequence[float], max_row_ratio: float) -> bool:
+    return len(ratios) == 1 or sum(ratios) <= max_row_ratio
+
+
+def _pack_exact(ratios: Sequence[float], max_row_ratio: float, max_per_row: int) -> list[tuple[int, ...]]:
+    """Оптимальное разбиение на ряды динамическим программированием по множествам оставшихся фотографий.
+
+    Первая из оставшихся фотографий всегда попадает в очередной ряд, поэтому каждое разбиение
+    рассматривается один раз.
+    """
+    count = len(ratios)
+
+    @cache
+    def solve(remaining: int) -> tuple[float, tuple[tuple[int, ...], ...]]:
+        if not remaining:
+            return 0.0, ()
+        first = (remaining & -remaining).bit_length() - 1
+        others = [index for index in range(first + 1, count) if remaining >> index & 1]
+        best: tuple[float, tuple[tuple[int, ...], ...]] | None = None
+        for partners_count in range(max_per_row):
+            for partners in combinations(others, partners_count):
+                row = (first, *partners)
+                row_ratios = [ratios[index] for index in row]
+                if not _row_fits(row_ratios, max_row_ratio):
+                    continue
+                rest = remaining
+                for index in row:
+                    rest &= ~(1 << index)
+                height, rows = solve(rest)
+                height += 1 / sum(row_ratios)
+                if best is None or height < best[0] - 1e-9:
+                    best = (height, (row, *rows))
+        return best
+
+    return list(solve((1 << count) - 1)[1])
+
+
+def _pack_sorted(ratios: Sequence[float], max_row_ratio: float, max_per_row: int) -> list[tuple[int, ...]]:
+    """Разбиение на ряды из соседних фотографий в порядке возрастания соотношения сторон, за линейное время."""
+    order = sorted(range(len(ratios)), key=lambda index: ratios[index])
+    heights = [0.0] + [float("inf")] * len(order)
+    row_start = [0] * (len(order) + 1)
+    for end in range(1, len(order) + 1):
+        for size in range(1, min(max_per_row, end) + 1):
+            row_ratios = [ratios[index] for index in order[end - size:end]]
+            if not _row_fits(row_ratios, max_row_ratio):
+                break
+            height = heights[end - size] + 1 / sum(row_ratios)
+            if height < heights[end] - 1e-9:
+                heights[end], row_start[end] = height, end - size
+
+    rows = []
+    end = len(order)
+    while end:
+        rows.append(tuple(order[row_start[end]:end]))
+        end = row_start[end]
+    return rows
+
+
+def pack_image_rows[T: HasAspectRatio](
+        images: Sequence[T],
+        max_row_ratio: float = FIT_IMAGES_ASPECT_RATIO,
+        max_per_row: int = MAX_IMAGES_PER_ROW,
+) -> list[list[T]]:
+    """Раскладывает фотографии по рядам с минимальной суммарной высотой.
+
+    Ряды и фотографии внутри ряда идут в порядке, в котором фотографии были присланы.
+    Исходная последовательность не изменяется.
+    """
+    if not images:
+        return []
+    ratios = [image.aspect_ratio for image in images]
+    if len(images) <= EXACT_LAYOUT_MAX_IMAGES:
+        rows = _pack_exact(ratios, max_row_ratio, max_per_row)
+    else:
+        rows = _pack_sorted(ratios, max_row_ratio, max_per_row)
+    ordered_rows = sorted(sorted(row) for row in rows)
+    return [[images[index] for index in row] for row in ordered_rows]
+
+
+def parse_length_mm(value: str) -> float:
+    """Переводит длину typst (мм, см, дюймы, пункты) в миллиметры."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(mm|cm|in|pt)\s*", value)
+    if match is None:
+        raise ValueError(f"Длина {value!r} не поддерживается")
+    return float(match[1]) * MM_PER_UNIT[match[2]]
+
+
+def photo_cell_width_mm(report_settings: dict) -> float | None:
+    """Ширина содержимого ячейки с фотографиями в миллиметрах по настройкам отчёта.
+
+    Колонка auto занимает место, оставшееся от остальных колонок. Если ширину не удается вычислить,
+    возвращает None.
+    """
+    widths = report_settings["col_width"]
+    try:
+        if widths["photos"] != "auto":
+            width = parse_length_mm(widths["photos"])
+        else:
+            page = report_settings["page_size"]
+            width = parse_length_mm(page["width"]) - 2 * parse_length_mm(page["margin"])
+            width -= sum(parse_length_mm(value) for key, value in widths.items() if key != "photos")
+    except (KeyError, ValueError) as e:
+        log.warning("Не удалось вычислить ширину ячейки с фотографиями: {e}", e=e)
+        return None
+    return width - 2 * TABLE_CELL_INSET_PT * MM_PER_UNIT["pt"]
+
+
+def row_image_sides_px(row: Sequence[HasAspectRatio], cell_width_mm: float, dpi: int) -> list[int]:
+    """Наибольшая сторона каждой фотографии ряда в пикселях при заданном разрешении.
+
+    Фотографии ряда одной высоты, ширина каждой пропорциональна ее соотношению сторон.
+    """
+    content_width = cell_width_mm - (len(row) - 1) * IMAGE_ROW_GUTTER_PT * MM_PER_UNIT["pt"]
+    height = content_width / sum(image.aspect_ratio for image in row)
+    return [math.ceil(max(height * image.aspect_ratio, height) / 25.4 * dpi) for image in row]
+
+
+def plan_thumbnail_profiles(
+        violations: Iterable[ViolationModel],
+        report_settings: dict,
+        quality: int = JPEG_QUALITY,
+        dpi: int = REPORT_IMAGE_DPI,
+) -> dict[str, ThumbnailProfile]:
+    """Профили уменьшенных копий по хэшам фотографий для раскладки, которая будет в отчёте.
+
+    Сторона копии округляется вверх до REPORT_IMAGE_SIDE_STEP; если фотография встречается в нескольких
+    нарушениях, берется наибольший размер.
+    """
+    cell_width = photo_cell_width_mm(report_settings)
+    profiles: dict[str, ThumbnailProfile] = {}
+    for violation in violations:
+        for row in pack_image_rows(violation.files):
+            if cell_width is None:
+                sides = [MAX_SIDE] * len(row)
+            else:
+                sides = row_image_sides_px(row, cell_width, dpi)
+            for image, side in zip(row, sides, strict=True):
+                side = math.ceil(side / REPORT_IMAGE_SIDE_STEP) * REPORT_IMAGE_SIDE_STEP
+                current = profiles.get(image.hash)
+                if current is None or current.max_side < side:
+                    profiles[image.hash] = ThumbnailProfile(max_side=side, quality=quality)
+    return profiles
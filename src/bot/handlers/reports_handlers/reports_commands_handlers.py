@@ -1,26 +1,41 @@
 """Обработчики команд для отчётов."""
 
 from datetime import datetime, timedelta
-from aiogram import Router, types
-from aiogram.types import FSInputFile, BufferedInputFile
+from collections.abc import Sequence
+from aiogram import Bot, Router, types
+from aiogram.types import FSInputFile
 from aiogram.fsm.context import FSMContext
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.constants import tz
-from bot.db.models import UserModel
+from bot.db.models import UserModel, ViolationModel
 from bot.logger_config import log
 from bot.common_utils import verify_string_as_integer
 from bot.keyboards.common_keyboards import generate_cancel_button
 from bot.repositories.violation_repo import ViolationRepository
 from bot.handlers.reports_handlers.states import ReportStates
 from bot.handlers.reports_handlers.reports_utils import validate_date_interval
-from bot.handlers.reports_handlers.create_reports import create_typst_report, create_static_report, save_static_report
+from bot.handlers.reports_handlers.create_reports import (
+    create_static_report,
+    create_typst_report,
+    iter_typst_report_volumes,
+)
 from bot.keyboards.inline_keyboards.create_keyboard import create_keyboard
 from bot.keyboards.inline_keyboards.callback_factories import ReportTypeFactory, ReportPeriodFactory
 
 router = Router(name=__name__)
 
 
+async def send_report_volumes(
+    bot: Bot, chat_id: int, created_by: UserModel, violations: Sequence[ViolationModel]
+) -> None:
+    """Отправка отчёта пользователю. Большой отчёт отправляется томами по мере их готовности."""
+    async for volume in iter_typst_report_volumes(created_by, violations):
+        document = FSInputFile(volume)
+        await bot.send_document(chat_id=chat_id, document=document, caption="Отчёт.")
+        log.info(f"Отчет {document.filename} отправлен.")
+
+
 @router.callback_query(ReportTypeFactory.filter())
 async def handle_report_type_select(
     callback: types.CallbackQuery,
@@ -56,11 +71,7 @@ async def handle_report_type_select(
 
         case "active":
             violations = await violation_repo.get_active_violations()
-            result_report = create_typst_report(violations=violations, created_by=group_user)
-            document = FSInputFile(result_report)
-            log.info(f"Отчет {document.filename} сформирован.", document)
-            await callback.message.bot.send_document(chat_id=callback.from_user.id, document=document, caption="Отчёт.")
-            log.info(f"Отчет {document.filename} отправлен.", document)
+            await send_report_volumes(callback.message.bot, callback.from_user.id, group_user, violations)
             await callback.message.answer("Отчёт сгенерирован.")
             await state.clear()
 
@@ -71,18 +82,10 @@ async def handle_report_type_select(
             log.info("Вошли в  ветку формирования отчета")
             violations = await violation_repo.get_not_reviewed_violations()
             log.info("получили список предписаний")
-            result_report = create_typst_report(violations=violations, created_by=group_user)
-            log.info("создали файл отчета")
-            document = FSInputFile(result_report)
-            log.info("отправили файл в телеграм")
             log.info("надо отправить пользователю {user}", user=callback.from_user.id )
             try:
                 # raise ValueError
-                await callback.message.bot.send_document(
-                    chat_id=callback.from_user.id,
-                    document=document,
-                    caption="Отчёт."
-                )
+                await send_report_volumes(callback.message.bot, callback.from_user.id, group_user, violations)
             except Exception as e:
                 log.error("Ошибка отправки файла пользователю {user}", user=callback.from_user.id)
                 # log.exception(e)
@@ -95,10 +98,8 @@ async def handle_report_type_select(
             log.debug("User {user} selected report type 'review'.", user=group_user.first_name)
 
         case "stat":
-            violations = await violation_repo.get_all_violations()
-            report = create_static_report(violations=violations)
-            save_static_report(report)
-            document = BufferedInputFile(report, filename="static_report.xlsx")
+            report_file = await create_static_report(violation_repo)
+            document = FSInputFile(report_file, filename="static_report.xlsx")
             caption = "Итоговый расчёт за весь период."
             user_tg = callback.from_user.id
             await callback.bot.send_document(chat_id=user_tg, document=document, caption=caption)
@@ -129,7 +130,7 @@ async def handle_report_by_id(
         return
 
     try:
-        pdf_file = create_typst_report(violations=(violation,), created_by=group_user)
+        pdf_file = await create_typst_report(violations=(violation,), created_by=group_user)
         document = FSInputFile(pdf_file)
         caption = f"Нарушение №{violation_id}"
         await message.bot.send_document(chat_id=message.from_user.id, document=document, caption=caption)
@@ -204,9 +205,7 @@ async def handle_report_sum(
         return
 
     try:
-        result_report = create_typst_report(violations=violations, created_by=group_user)
-        document = FSInputFile(result_report)
-        await callback.message.bot.send_document(chat_id=callback.from_user.id, document=document, caption="Отчёт.")
+        await send_report_volumes(callback.message.bot, callback.from_user.id, group_user, violations)
         await callback.message.answer("Отчёт сгенерирован.")
         await callback.answer("Отчёт сгенерирован.")
 
@@ -244,15 +243,7 @@ async def handle_report_range(
     if not violations:
         await message.answer("В выбранном периоде отчёт пуст.")
         return
-    result_report = create_typst_report(violations=violations, created_by=group_user)
-    document = FSInputFile(result_report)
-    log.info(f"Отчет {document.filename} сформирован.", document)
     await message.chat.do("upload_document")
-    await message.bot.send_document(
-        chat_id=message.from_user.id,
-        document=document,
-        caption="Отчёт."
-    )
-    log.info(f"Отчет {document.filename} отправлен.", document)
+    await send_report_volumes(message.bot, message.from_user.id, group_user, violations)
     await message.answer("Отчёт сгенерирован.")
     await state.clear()
@@ -6,6 +6,7 @@ import json
 from pathlib import Path
 from datetime import datetime, timezone
 from contextlib import suppress
+from collections.abc import Sequence
 
 from openpyxl import Workbook
 
@@ -41,3 +42,23 @@ def validate_date_interval(date_interval: str) -> bool | tuple[datetime, datetim
         return False
 
     return result
+
+
+def split_report_parts(items: Sequence, sizes: Sequence[int], max_bytes: int, max_items: int) -> list[list]:
+    """Делит нарушения отчёта на части по порядку.
+
+    В каждой части не больше max_items нарушений и, если возможно, не больше max_bytes оценочного размера.
+    Нарушение, которое само больше max_bytes, попадает в отдельную часть. Всегда возвращается хотя бы одна часть.
+    """
+    parts = []
+    current = []
+    current_size = 0
+    for item, size in zip(items, sizes, strict=True):
+        if current and (len(current) >= max_items or current_size + size > max_bytes):
+            parts.append(current)
+            current = []
+            current_size = 0
+        current.append(item)
+        current_size += size
+    parts.append(current)
+    return parts
@@ -1,21 +1,24 @@
 
 from pathlib import Path
-from aiogram import F, Router, types
-from aiogram.types import FSInputFile, BufferedInputFile
+from aiogram import Bot, F, Router, types
+from aiogram.types import FSInputFile, BufferedInputFile, InputMediaPhoto
 from aiogram.fsm.context import FSMContext
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.enums import ViolationStatus
 from bot.config import settings
+from bot.constants import VIOLATION_REVIEW_PREVIEW
 
-from bot.db.models import UserModel
+from bot.db.models import UserModel, ViolationModel
 from bot.logger_config import log
 from bot.keyboards.common_keyboards import  generate_yes_no_keyboard
 from bot.repositories.violation_repo import ViolationRepository
 from .states import ViolationCheckStates
-from bot.handlers.reports_handlers.create_reports import create_typst_report
+from bot.handlers.reports_handlers.create_reports import create_typst_preview, create_typst_report
+from bot.services.report_warmup import schedule_report_warmup
 from bot.keyboards.inline_keyboards.create_keyboard import create_keyboard
-from bot.utils.image_utils import get_file, shrink_image
+from bot.utils.image_processing import shrink_image
+from bot.utils.image_utils import get_file
 from bot.keyboards.inline_keyboards.callback_factories import (
     ViolationsFactory,
     ViolationsActionFactory,
@@ -44,10 +47,7 @@ async def handle_violation_review(
         area=violation.area.name,
     )
 
-    # отправка акта нарушения для review
-    pdf_file = create_typst_report(violations=(violation,), created_by=group_user)
     caption = f"Место: {violation.area.name}\nОписание: {violation.description}"
-    document = FSInputFile(pdf_file)
     user_tg = callback.from_user.id
 
     violation_description = (
@@ -61,7 +61,12 @@ async def handle_violation_review(
     )
     await state.update_data(text=violation_description)
 
-    await callback.message.bot.send_document(chat_id=user_tg, document=document, caption=caption)
+    # отправка акта нарушения для review
+    if VIOLATION_REVIEW_PREVIEW:
+        await send_report_preview(callback.message.bot, user_tg, violation, group_user, caption)
+    else:
+        pdf_file = await create_typst_report(violations=(violation,), created_by=group_user)
+        await callback.message.bot.send_document(chat_id=user_tg, document=FSInputFile(pdf_file), caption=caption)
 
     actions_to_kb = ({"action": "activate", "name": "Утвердить"}, {"action": "reject", "name": "Отклонить"})
     action_kb = await create_keyboard(items=actions_to_kb, text_key="name", callback_factory=ViolationsActionFactory)
@@ -78,6 +83,24 @@ async def handle_violation_review(
 
 
 
+async def send_report_preview(
+    bot: Bot, chat_id: int, violation: ViolationModel, created_by: UserModel, caption: str
+) -> None:
+    """Отправляет превью отчёта по нарушению фотографией, а если страниц несколько - альбомом."""
+    pages = await create_typst_preview(violations=(violation,), created_by=created_by)
+    photos = [
+        BufferedInputFile(page, filename=f"предписание_{violation.number}_{index}.png")
+        for index, page in enumerate(pages, start=1)
+    ]
+    if len(photos) == 1:
+        await bot.send_photo(chat_id=chat_id, photo=photos[0], caption=caption)
+        return
+    media = [
+        InputMediaPhoto(media=photo, caption=caption if index == 0 else None) for index, photo in enumerate(photos)
+    ]
+    await bot.send_media_group(chat_id=chat_id, media=media)
+
+
 @router.callback_query(ViolationsFactory.filter(), ViolationCheckStates.lstart)
 async def light_handle_violation_review(
     callback: types.CallbackQuery,
@@ -162,7 +185,7 @@ async def handle_detection_activation_yes_no_response(
             caption_pdf = f"Детали нарушения №{data['number']}"
             log.info("файл, отправляемый в группу: {v.id}({v.number}) место: {v.area.name} описание: {v.description} ",
                      v=violation_data)
-            pdf_file = create_typst_report(violations=(violation_data,), created_by=group_user)
+            pdf_file = await create_typst_report(violations=(violation_data,), created_by=group_user)
             document = FSInputFile(pdf_file)
             await message.bot.send_message(chat_id=settings.TG_GROUP_ID, text=data["text"])
             try:
@@ -191,6 +214,8 @@ async def handle_detection_activation_yes_no_response(
                 number=data["number"],
                 new_status=ViolationStatus.ACTIVE.name,
             )
+            # статус изменился, pdf для остальных администраторов готовится заранее
+            schedule_report_warmup(data["id"])
             await message.answer("Нарушение отправлено группу.")
 
         else:
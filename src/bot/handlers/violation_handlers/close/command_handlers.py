@@ -43,7 +43,7 @@ async def handle_violation_close(
     )
 
     # отправка акта нарушения для проверки перед закрытием
-    pdf_file = create_typst_report(violations=(violation,), created_by=group_user)
+    pdf_file = await create_typst_report(violations=(violation,), created_by=group_user)
     caption = f"Место: {violation.area.name}\nОписание: {violation.description}"
     document = FSInputFile(pdf_file)
     user_tg = callback.from_user.id
@@ -1,8 +1,6 @@
 """Обработчики обнаружения нарушений."""
 
 import asyncio
-from dataclasses import dataclass, field
-from collections import defaultdict
 from aiogram import F, Router, types
 from aiogram.types import BufferedInputFile, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
@@ -10,18 +8,17 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.enums import ViolationStatus
 from bot.config import settings
-from bot.constants import (
-    MAX_SEND_PHOTO,
-    MAX_SECONDS_TO_WAIT_WHILE_UPLOADING_PHOTOS,
-    action_needed_deadline,
-)
+from bot.constants import MAX_SEND_PHOTO, action_needed_deadline
 from bot.db.models import UserModel
+from bot.services.media_group_aggregator import MediaGroup, MediaGroupAdd, media_group_aggregator
 from bot.services.violation_service import ViolationService
+from bot.services.report_warmup import schedule_report_warmup
 from bot.logger_config import log
 from bot.repositories.area_repo import AreaRepository
 from bot.repositories.user_repo import UserRepository
 from bot.keyboards.common_keyboards import generate_cancel_button, generate_yes_no_keyboard
-from bot.utils.image_utils import shrink_image
+from bot.utils.image_processing import shrink_image
+from bot.utils.image_utils import download_image, get_file, image_staging
 from .states import DetectionStates
 from bot.keyboards.inline_keyboards.create_keyboard import create_keyboard, create_multi_select_keyboard
 from bot.keyboards.inline_keyboards.callback_factories import (
@@ -41,17 +38,6 @@ router = Router(name=__name__)
 
 
 
-@dataclass
-class MediaGroupContext:
-    photos: list[bytes] = field(default_factory=list)  # список фото
-    caption: str | None = None  # подпись
-    event: asyncio.Event = field(default_factory=asyncio.Event)  # для сброса таймера
-    task: asyncio.Task | None = None  # ссылка на запущенную задачу
-
-
-media_groups: dict[str, MediaGroupContext] = defaultdict(MediaGroupContext)
-
-
 @router.message(DetectionStates.send_photo, F.media_group_id)
 async def handle_media_group(
     message: types.Message,
@@ -62,58 +48,44 @@ async def handle_media_group(
     log.info("добавление изображения в медиагруппу")
     if not message.photo:
         return
-    media_group_id = message.media_group_id
-    ctx = media_groups[media_group_id]
-
-    if message.caption:
-        ctx.caption = message.caption
-    # добавляем изображение
     file_id = message.photo[-1].file_id
-    file = await message.bot.get_file(file_id)
-    picture = await message.bot.download_file(file.file_path)
-    ctx.photos.append(picture.read())
-
-    if ctx.task is None:
-        ctx.event = asyncio.Event()
-        ctx.task = asyncio.create_task(
-            process_media_group_after_delay(message, state, group_user, media_group_id),
+    result = media_group_aggregator.add(
+        user_id=message.from_user.id,
+        media_group_id=message.media_group_id,
+        download=lambda: download_image(message.bot, file_id),
+        caption=message.caption,
+        # ответ на альбом отправляется на первое полученное фото
+        on_complete=lambda album: process_media_group(message, state, group_user, album),
+    )
+    if result is MediaGroupAdd.REJECTED:
+        await message.answer("Сейчас обрабатывается слишком много фото, отправьте их повторно через минуту.")
+    elif result is MediaGroupAdd.LATE:
+        await message.reply(
+            "⚠️ Это фото получено после обработки альбома и не добавлено к нарушению. "
+            "Если оно нужно, отмените отправку и отправьте все фото заново."
         )
-    else:
-        ctx.event.set()
 
 
-async def process_media_group_after_delay(
-    message: types.Message, state: FSMContext, group_user: UserModel, media_group_id: str
+async def process_media_group(
+    message: types.Message, state: FSMContext, group_user: UserModel, album: MediaGroup
 ) -> None:
-    """Завершает обработку MediaGroup после задержки."""
+    """Завершает обработку MediaGroup после получения и скачивания всех фото."""
     log.info("окончательная обработка медиагруппы")
-    # возможно, нужно обернуть всю функцию в try fimally
-    ctx = media_groups[media_group_id]
-    # если приходит новая картинка из медиагруппы, перезапускаем таймер
-    # если событие не установлено (event.set()), то происходит ошибка таймаута, выходим из цикла
-    while True:
-        try:
-            await asyncio.wait_for(ctx.event.wait(), timeout=MAX_SECONDS_TO_WAIT_WHILE_UPLOADING_PHOTOS)
-            ctx.event.clear()
-            continue
-        except asyncio.TimeoutError:
-            break
-
-    if len(ctx.photos) > MAX_SEND_PHOTO:
+    if album.error is not None:
+        await message.answer("Не удалось получить фото, отправьте их повторно.")
+        return
+    if album.overflow:
         await message.answer(f"⚠️ Можно отправить не более {MAX_SEND_PHOTO} фото.")
-        media_groups.pop(media_group_id)
         return
 
-    photos = ctx.photos
-    media_groups.pop(media_group_id)
-    await state.update_data(images=photos, caption=ctx.caption)
+    await state.update_data(images=album.hashes, caption=album.caption)
     await state.set_state(DetectionStates.send_media_group)
     async with async_session_factory() as session:
         await handle_get_violation_photo(message, state, group_user, session)
 
 
 @router.message(DetectionStates.send_photo)
-# для обработки медиагруппы не нужен фильтр состояния, так как она вызывается напрямую из process_media_group_after_delay
+# для обработки медиагруппы не нужен фильтр состояния, так как она вызывается напрямую из process_media_group
 async def handle_get_violation_photo(
     message: types.Message,
     state: FSMContext,
@@ -137,10 +109,7 @@ async def handle_get_violation_photo(
     else:
         # одно фото
         log.info("одно фото")
-        file_id = message.photo[-1].file_id
-        file = await message.bot.get_file(file_id)
-        picture = await message.bot.download_file(file.file_path)
-        images = [picture.read()]
+        images = [await download_image(message.bot, message.photo[-1].file_id)]
     await state.update_data(
         images=images, description=description, detector_id=group_user.id, status=ViolationStatus.REVIEW
     )
@@ -157,7 +126,6 @@ async def handle_get_violation_photo(
     await message.reply("Выберите место нарушения:", reply_markup=areas_keyboard)
     log.debug(f"User {group_user.first_name} sent photo for detection.")
     await state.set_state(DetectionStates.enter_area)
-    media_groups.clear()
 
 
 @router.callback_query(AreaSelectFactory.filter(), DetectionStates.enter_area)
@@ -277,8 +245,13 @@ async def handle_ok_button(callback: types.CallbackQuery, state: FSMContext, ses
 
     area_repo = AreaRepository(session)
     area = await area_repo.get_area_by_id(data["area_id"])
-    # Отправляем фото
-    shrinked = shrink_image(data["images"][0]).getvalue()
+    # Отправляем фото, в состоянии хранятся только хэши фотографий
+    first_image = image_staging.locate(data["images"][0])
+    if not first_image.exists():
+        await callback.message.answer("Фотографии нарушения устарели, для повторного ввода вызовите команду /detect.")
+        await state.clear()
+        return
+    shrinked = (await asyncio.to_thread(lambda: shrink_image(get_file(first_image)))).getvalue()
     photo_file = BufferedInputFile(shrinked, filename="photo.jpg")
     user_tg = callback.from_user.id
     caption = f"Вы отправили фото нарушения с описанием: {data['description']}"
@@ -309,11 +282,20 @@ async def handle_detection_yes_no_response(
     data = await state.get_data()
     if message.text == "✅ Да":
         violation_service = ViolationService(session)
-        success = await violation_service.add(data)
+        try:
+            success = await violation_service.add(data)
+        except FileNotFoundError:
+            # фотографии брошенной регистрации удаляются по истечении IMAGE_STAGING_TTL
+            log.warning("Фотографии нарушения {user} устарели", user=group_user.first_name)
+            await message.answer("Фотографии нарушения устарели, для повторного ввода вызовите команду /detect.")
+            await state.clear()
+            return
         if success:
             await message.answer(f"Данные нарушения №{success.number} сохранены.")
             log.info("Создано нарушение № {number}({id}) area_id: {description}", number=success.number, id=success.id,
                      description=success.description)
+            # отчёт нарушения готовится заранее, к моменту проверки администратором он будет в кэше
+            schedule_report_warmup(success.id)
             # оповещаем админов
             user_repo = UserRepository(session)
             # этот подход не универсальный, он ссылается на базу,  ан не на .env
@@ -1,6 +1,11 @@
+from collections.abc import AsyncIterator, Collection, Sequence
+
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from bot.db.models import FileModel
+from sqlalchemy import Row, delete, select
+from sqlalchemy.exc import SQLAlchemyError
+from bot.constants import IMAGE_GC_CHUNK_SIZE
+from bot.db.models import FileModel, ViolationFile, ViolationModel
+from bot.logger_config import log
 class ImageRepository:
     """Репозиторий нарушения."""
 
@@ -19,3 +24,60 @@ class ImageRepository:
         self.session.add(file)
         return file
 
+
+    async def stream_referenced_hashes(self, chunk_size: int = IMAGE_GC_CHUNK_SIZE) -> AsyncIterator[Sequence[str]]:
+        """Хэши файлов, прикрепленных к существующим нарушениям, порциями через серверный курсор.
+
+        Связи с удаленными нарушениями не учитываются.
+        """
+        stmt = (
+            select(ViolationFile.file_hash)
+            .join(ViolationModel, ViolationFile.violation_id == ViolationModel.id)
+            .distinct()
+            .execution_options(yield_per=chunk_size)
+        )
+        result = await self.session.stream_scalars(stmt)
+        async for partition in result.partitions():
+            yield partition
+
+    async def stream_files(self, chunk_size: int = IMAGE_GC_CHUNK_SIZE) -> AsyncIterator[Sequence[Row]]:
+        """Хэш, путь и время добавления всех файлов порциями по возрастанию хэша.
+
+        Каждая порция выбирается отдельным запросом от последнего хэша предыдущей порции,
+        поэтому между порциями строки можно удалять и фиксировать транзакцию.
+        """
+        last_hash = ""
+        while True:
+            stmt = (
+                select(FileModel.hash, FileModel.path, FileModel.created_at)
+                .where(FileModel.hash > last_hash)
+                .order_by(FileModel.hash)
+                .limit(chunk_size)
+            )
+            rows = (await self.session.execute(stmt)).all()
+            if not rows:
+                return
+            yield rows
+            last_hash = rows[-1].hash
+
+    async def get_referenced(self, hashes: Collection[str]) -> set[str]:
+        """Хэши из hashes, которые прикреплены к существующим нарушениям."""
+        stmt = (
+            select(ViolationFile.file_hash)
+            .join(ViolationModel, ViolationFile.violation_id == ViolationModel.id)
+            .where(ViolationFile.file_hash.in_(hashes))
+        )
+        result = await self.session.execute(stmt)
+        return set(result.scalars())
+
+    async def delete_files(self, hashes: Collection[str]) -> None:
+        """Удаление файлов из базы вместе с их связями с нарушениями."""
+        try:
+            await self.session.execute(delete(ViolationFile).where(ViolationFile.file_hash.in_(hashes)))
+            await self.session.execute(delete(FileModel).where(FileModel.hash.in_(hashes)))
+            await self.session.commit()
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            log.error("SQLAlchemyError deleting {n} files", n=len(hashes))
+            log.exception(e)
+            raise
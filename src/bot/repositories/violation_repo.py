@@ -1,14 +1,16 @@
 """Репозитории зарегистрированного нарушения."""
-from typing import Any, Sequence
+from typing import Any
+from collections.abc import AsyncIterator, Sequence
 from datetime import datetime
 
-from sqlalchemy import delete, select, update, between, func, extract
+from sqlalchemy import Row, case, delete, select, update, between, func, extract
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm import aliased, joinedload, selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from bot.constants import STAT_EXPORT_CHUNK_SIZE
 from bot.enums import ViolationStatus
-from bot.db.models import AreaModel, ViolationModel
+from bot.db.models import AreaModel, UserModel, ViolationModel
 from bot.logger_config import log
 
 
@@ -103,6 +105,108 @@ class ViolationRepository:
             return violations
 
 
+    async def stream_violations_for_statistics(
+            self,
+            start_date: datetime | None = None,
+            end_date: datetime | None = None,
+            chunk_size: int = STAT_EXPORT_CHUNK_SIZE,
+    ) -> AsyncIterator[Sequence[Row]]:
+        """Выгрузка нарушений для статистики порциями через серверный курсор.
+
+        Выбираются только колонки, нужные отчёту, ORM-объекты не создаются.
+        Если задан период, выбираются нарушения, обнаруженные в этом периоде.
+        """
+        responsible = aliased(UserModel)
+        detector = aliased(UserModel)
+        stmt = (
+            select(
+                ViolationModel.number,
+                AreaModel.name.label("area_name"),
+                ViolationModel.description,
+                case(
+                    (AreaModel.responsible_user_id.is_not(None), responsible.first_name),
+                    else_=AreaModel.responsible_text,
+                ).label("responsible"),
+                ViolationModel.category,
+                ViolationModel.actions_needed,
+                ViolationModel.status,
+                ViolationModel.created_at,
+                ViolationModel.updated_at,
+                detector.first_name.label("detector_name"),
+                detector.user_role.label("detector_role"),
+            )
+            .join(AreaModel, ViolationModel.area_id == AreaModel.id)
+            .outerjoin(responsible, AreaModel.responsible_user_id == responsible.id)
+            .join(detector, ViolationModel.detector_id == detector.id)
+            .order_by(ViolationModel.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        if start_date is not None:
+            stmt = stmt.where(ViolationModel.created_at >= start_date)
+        if end_date is not None:
+            stmt = stmt.where(ViolationModel.created_at <= end_date)
+
+        rows_count = 0
+        try:
+            result = await self.session.stream(stmt)
+            async for partition in result.partitions():
+                rows_count += len(partition)
+                yield partition
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            log.error("SQLAlchemyError streaming violations for statistics")
+            log.exception(e)
+            raise
+        log.success("{col} violations streamed for statistics", col=rows_count)
+
+
+    async def count_violations_by_area_and_status(
+            self,
+            start_date: datetime | None = None,
+            end_date: datetime | None = None,
+    ) -> Sequence[Row]:
+        """Количество нарушений по каждому месту нарушения и статусу, подсчитанное в базе.
+
+        Каждая строка содержит имя места, ответственного, статус и количество нарушений.
+        """
+        responsible = aliased(UserModel)
+        responsible_name = case(
+            (AreaModel.responsible_user_id.is_not(None), responsible.first_name),
+            else_=AreaModel.responsible_text,
+        )
+        stmt = (
+            select(
+                AreaModel.name.label("area_name"),
+                responsible_name.label("responsible"),
+                ViolationModel.status,
+                func.count(ViolationModel.id).label("violations_count"),
+            )
+            .join(AreaModel, ViolationModel.area_id == AreaModel.id)
+            .outerjoin(responsible, AreaModel.responsible_user_id == responsible.id)
+            .group_by(ViolationModel.area_id, AreaModel.name, responsible_name, ViolationModel.status)
+            .order_by(ViolationModel.area_id)
+        )
+        if start_date is not None:
+            stmt = stmt.where(ViolationModel.created_at >= start_date)
+        if end_date is not None:
+            stmt = stmt.where(ViolationModel.created_at <= end_date)
+        try:
+            result = await self.session.execute(stmt)
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            log.error("SQLAlchemyError counting violations by area")
+            log.exception(e)
+            return tuple()
+        except Exception as e:
+            log.error("Error counting violations by area")
+            log.exception(e)
+            return tuple()
+        else:
+            rows = result.all()
+            log.success("{col} area/status groups counted successfully", col=len(rows))
+            return rows
+
+
     async def get_max_number(self):
         """Возвращает последний номер нарушения в этом году."""
         current_year = datetime.now().year
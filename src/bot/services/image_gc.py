@@ -0,0 +1,259 @@
+"""Сборка мусора в хранилище фотографий нарушений.
+
+Удаление нарушения не удаляет его фотографии: строки filemodel, связи violation_files и файлы
+images/<hh>/<hash>.jpg остаются. Сборка мусора выполняется в два этапа:
+пометка - из базы порциями читаются хэши фотографий существующих нарушений;
+очистка - порциями просматриваются строки filemodel и каталоги хранилища, и удаляются строки и файлы,
+на которые не ссылается ни одно нарушение.
+Строки фотографий существующих нарушений, файлов которых нет на диске, только выводятся в отчёт: файл может
+отсутствовать временно (не смонтирован диск, идет восстановление), а удаление строки удалило бы фотографию
+из нарушения. Такие строки удаляются только с флагом --delete-missing.
+Строки и файлы моложе срока grace не удаляются. Перед удалением каждой порции ссылки проверяются повторно,
+поэтому фотография, прикрепленная к новому нарушению во время сборки, не удаляется.
+
+Запуск: python -m bot.services.image_gc [--apply] [--delete-missing] [--grace-days N] [--verbose]
+Без --apply ничего не удаляется, выводится только отчёт.
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import sys
+import time
+from collections.abc import AsyncIterator, Sequence
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import settings
+from bot.constants import IMAGE_GC_CHUNK_SIZE, IMAGE_GC_GRACE
+from bot.db.database import async_session_factory
+from bot.logger_config import log
+from bot.repositories.image_repo import ImageRepository
+
+# каталоги и файлы хранилища: images/<hh>/<hash>.jpg; подписи (images/signs) не затрагиваются
+_SHARD_DIR = re.compile(r"[0-9a-f]{2}")
+_IMAGE_FILE = re.compile(r"[0-9a-f]{64}\.jpg")
+
+
+@dataclass(frozen=True)
+class GarbageItem:
+    """Найденный мусор.
+
+    kind: "row" - строка файла, на который не ссылается ни одно нарушение;
+    "missing" - строка фотографии существующего нарушения, файла которой нет на диске;
+    "file" - файл, на который не ссылается ни одно нарушение.
+    """
+
+    kind: str
+    hash: str
+    path: str
+    size: int = 0
+
+
+@dataclass
+class ImageGcReport:
+    """Итоги сборки мусора."""
+
+    dry_run: bool
+    delete_missing: bool = False
+    referenced: int = 0  # фотографий у существующих нарушений
+    rows: int = 0
+    missing: int = 0
+    files: int = 0
+    freed_bytes: int = 0
+    skipped: int = 0  # кандидаты, которые прикрепили к нарушению во время сборки
+    seconds: float = 0.0
+
+    def add(self, item: GarbageItem) -> None:
+        """Учитывает найденный мусор."""
+        if item.kind == "row":
+            self.rows += 1
+        elif item.kind == "missing":
+            self.missing += 1
+        else:
+            self.files += 1
+            self.freed_bytes += item.size
+
+    def __str__(self) -> str:
+        """Текст отчёта."""
+        action = "будет удалено" if self.dry_run else "удалено"
+        missing_action = action if self.delete_missing else "найдено (не удаляются без --delete-missing)"
+        return (
+            f"Фотографий у существующих нарушений: {self.referenced}.\n"
+            f"Строк без нарушений {action}: {self.rows}.\n"
+            f"Строк нарушений без файлов {missing_action}: {self.missing}.\n"
+            f"Файлов без нарушений {action}: {self.files}, {self.freed_bytes / 1024 / 1024:.1f} МБ.\n"
+            f"Пропущено прикрепленных во время сборки: {self.skipped}.\n"
+            f"Время сборки: {self.seconds:.1f} с."
+        )
+
+
+def _files_exist(paths: Sequence[str]) -> list[bool]:
+    """Есть ли на диске файлы по путям от DATA_DIR."""
+    return [(settings.DATA_DIR / path).exists() for path in paths]
+
+
+def _scan_shard(directory: Path, cutoff: float) -> list[GarbageItem]:
+    """Фотографии каталога хранилища, которые не менялись с момента cutoff.
+
+    Время изменения inode (st_ctime) учитывается, потому что при переносе из области ожидания
+    время изменения файла остается временем скачивания.
+    """
+    found = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not _IMAGE_FILE.fullmatch(entry.name):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if max(stat.st_mtime, stat.st_ctime) < cutoff:
+                found.append(
+                    GarbageItem(kind="file", hash=entry.name[:-4], path=entry.path, size=stat.st_size)
+                )
+    return found
+
+
+class ImageGarbageCollector:
+    """Сборщик мусора хранилища фотографий, см. описание модуля.
+
+    В памяти держатся только хэши фотографий существующих нарушений, строки filemodel и файлы хранилища
+    просматриваются и удаляются порциями.
+    delete_missing - удалять и строки фотографий существующих нарушений, файлов которых нет на диске.
+    """
+
+    def __init__(
+        self,
+        session: AsyncSession,
+        grace: timedelta = IMAGE_GC_GRACE,
+        chunk_size: int = IMAGE_GC_CHUNK_SIZE,
+        delete_missing: bool = False,
+    ) -> None:
+        """Инициализация сборщика."""
+        self.images = ImageRepository(session)
+        self.grace = grace
+        self.chunk_size = chunk_size
+        self.delete_missing = delete_missing
+        self.report = ImageGcReport(dry_run=True, delete_missing=delete_missing)
+
+    async def run(self, dry_run: bool = True) -> AsyncIterator[GarbageItem]:
+        """Находит мусор и, если dry_run=False, удаляет его; найденное возвращается по мере обработки порций.
+
+        Итоги накапливаются в self.report.
+        """
+        if not settings.image_write_dir.is_dir():
+            # без хранилища все строки выглядели бы строками без файлов
+            raise FileNotFoundError(f"Хранилище фотографий {settings.image_write_dir} не найдено")
+        self.report = ImageGcReport(dry_run=dry_run, delete_missing=self.delete_missing)
+        started = time.perf_counter()
+
+        referenced = await self._mark()
+        self.report.referenced = len(referenced)
+
+        row_cutoff = datetime.now(UTC).replace(tzinfo=None) - self.grace
+        async for rows in self.images.stream_files(self.chunk_size):
+            candidates = await self._find_garbage_rows(rows, referenced, row_cutoff)
+            for item in await self._sweep_rows(candidates, dry_run):
+                yield item
+
+        cutoff = time.time() - self.grace.total_seconds()
+        shards = sorted(
+            path for path in settings.image_write_dir.iterdir() if path.is_dir() and _SHARD_DIR.fullmatch(path.name)
+        )
+        for shard in shards:
+            found = await asyncio.to_thread(_scan_shard, shard, cutoff)
+            garbage = [item for item in found if item.hash not in referenced]
+            for start in range(0, len(garbage), self.chunk_size):
+                for item in await self._sweep_files(garbage[start:start + self.chunk_size], dry_run):
+                    yield item
+
+        self.report.seconds = time.perf_counter() - started
+        log.info(
+            "Сборка мусора фотографий{dry}:\n{report}", dry=" (без удаления)" if dry_run else "", report=self.report
+        )
+
+    async def collect(self, dry_run: bool = True) -> ImageGcReport:
+        """Выполняет сборку мусора и возвращает только отчёт."""
+        async for _ in self.run(dry_run):
+            pass
+        return self.report
+
+    async def _mark(self) -> set[str]:
+        """Хэши фотографий существующих нарушений."""
+        referenced: set[str] = set()
+        async for hashes in self.images.stream_referenced_hashes(self.chunk_size):
+            referenced.update(hashes)
+        return referenced
+
+    @staticmethod
+    async def _find_garbage_rows(rows: Sequence[Row], referenced: set[str], cutoff: datetime) -> list[GarbageItem]:
+        """Строки порции, добавленные раньше cutoff, без нарушений или без файла на диске."""
+        rows = [row for row in rows if row.created_at is None or row.created_at < cutoff]
+        on_disk = await asyncio.to_thread(_files_exist, [row.path for row in rows])
+        candidates = []
+        for row, exists in zip(rows, on_disk, strict=True):
+            if row.hash not in referenced:
+                candidates.append(GarbageItem(kind="row", hash=row.hash, path=row.path))
+            elif not exists:
+                candidates.append(GarbageItem(kind="missing", hash=row.hash, path=row.path))
+        return candidates
+
+    async def _sweep_rows(self, items: list[GarbageItem], dry_run: bool) -> list[GarbageItem]:
+        """Удаляет порцию строк, повторно проверив, что они все еще мусор.
+
+        Строки без файлов удаляются, только если задан delete_missing.
+        """
+        referenced_now = await self.images.get_referenced([item.hash for item in items if item.kind == "row"])
+        still_missing = await asyncio.to_thread(
+            lambda: {item.hash for item in items if not (settings.DATA_DIR / item.path).exists()}
+        )
+        garbage = [
+            item for item in items
+            if (item.kind == "row" and item.hash not in referenced_now)
+            or (item.kind == "missing" and item.hash in still_missing)
+        ]
+        self.report.skipped += len(items) - len(garbage)
+        deleted = [item.hash for item in garbage if item.kind == "row" or self.delete_missing]
+        if deleted and not dry_run:
+            await self.images.delete_files(deleted)
+        for item in garbage:
+            self.report.add(item)
+        return garbage
+
+    async def _sweep_files(self, items: list[GarbageItem], dry_run: bool) -> list[GarbageItem]:
+        """Удаляет порцию файлов, повторно проверив, что на них не ссылается ни одно нарушение."""
+        referenced_now = await self.images.get_referenced([item.hash for item in items])
+        garbage = [item for item in items if item.hash not in referenced_now]
+        self.report.skipped += len(items) - len(garbage)
+        if garbage and not dry_run:
+            await asyncio.to_thread(lambda: [Path(item.path).unlink(missing_ok=True) for item in garbage])
+        for item in garbage:
+            self.report.add(item)
+        return garbage
+
+
+async def _main(apply: bool, delete_missing: bool, grace: timedelta, verbose: bool) -> None:
+    async with async_session_factory() as session:
+        collector = ImageGarbageCollector(session, grace=grace, delete_missing=delete_missing)
+        async for item in collector.run(dry_run=not apply):
+            if verbose:
+                sys.stdout.write(f"{item.kind}\t{item.hash}\t{item.path}\t{item.size}\n")
+    sys.stdout.write(f"{collector.report}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="удалить найденный мусор")
+    parser.add_argument("--delete-missing", action="store_true",
+                        help="удалять и строки фотографий существующих нарушений, файлов которых нет на диске")
+    parser.add_argument("--grace-days", type=float, default=IMAGE_GC_GRACE / timedelta(days=1),
+                        help="не удалять фотографии моложе стольких дней")
+    parser.add_argument("--verbose", action="store_true", help="выводить каждую найденную строку и файл")
+    args = parser.parse_args()
+    asyncio.run(_main(args.apply, args.delete_missing, timedelta(days=args.grace_days), args.verbose))
@@ -0,0 +1,163 @@
+"""Сборка альбомов фотографий (media group) из отдельных сообщений telegram."""
+
+import asyncio
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Coroutine
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any
+
+from bot.constants import (
+    MAX_SECONDS_TO_WAIT_WHILE_UPLOADING_PHOTOS,
+    MAX_SEND_PHOTO,
+    MEDIA_GROUP_MAX_PENDING,
+    MEDIA_GROUP_MAX_SIZE,
+    MEDIA_GROUP_TTL,
+)
+from bot.logger_config import log
+
+
+class MediaGroupAdd(Enum):
+    """Результат добавления фото в альбом."""
+
+    ACCEPTED = "accepted"  # фото добавлено в альбом
+    REJECTED = "rejected"  # новый альбом не принят из-за ограничения количества собираемых альбомов
+    LATE = "late"  # фото получено после завершения сборки альбома и в альбом не добавлено
+
+
+@dataclass
+class MediaGroup:
+    """Альбом фотографий одного пользователя."""
+
+    user_id: int
+    media_group_id: str
+    caption: str | None = None  # подпись
+    received: int = 0  # сколько фото альбома получено
+    downloads: list[asyncio.Task[str]] = field(default_factory=list)  # скачивание фото в порядке получения
+    overflow: bool = False  # получено больше фото, чем можно прикрепить; лишние не скачиваются
+    hashes: list[str] = field(default_factory=list)  # хэши скачанных фото, заполняются после сборки
+    error: Exception | None = None  # ошибка скачивания или превышение времени сборки
+    closed: bool = False  # ожидание фото завершено, новые фото в альбом не добавляются
+    arrived: asyncio.Event = field(default_factory=asyncio.Event)  # получено очередное фото
+    task: asyncio.Task | None = None  # задача сборки альбома
+
+
+class MediaGroupAggregator:
+    """Собирает альбомы фотографий нарушений.
+
+    Telegram присылает каждое фото альбома отдельным сообщением с общим media_group_id. Альбомы хранятся
+    по ключу (пользователь, media_group_id), и у пользователя собирается только последний отправленный альбом,
+    поэтому альбомы разных пользователей не мешают друг другу. Фото скачиваются параллельно сразу при получении.
+    Альбом собран, когда получено MEDIA_GROUP_MAX_SIZE фото (больше telegram не присылает) или следующее фото
+    не пришло за quiet секунд, и все скачивания завершены. Количество одновременно собираемых альбомов
+    и время сборки одного альбома ограничены. Фото, полученное после завершения сборки своего альбома,
+    в альбом не добавляется, об этом сообщает результат add.
+    """
+
+    def __init__(
+        self,
+        max_pending: int = MEDIA_GROUP_MAX_PENDING,
+        max_photos: int = MAX_SEND_PHOTO,
+        quiet: float = MAX_SECONDS_TO_WAIT_WHILE_UPLOADING_PHOTOS,
+        ttl: float = MEDIA_GROUP_TTL,
+    ) -> None:
+        """Инициализация сборщика."""
+        self.max_pending = max_pending
+        self.max_photos = max_photos
+        self.quiet = quiet
+        self.ttl = ttl
+        self._groups: dict[tuple[int, str], MediaGroup] = {}
+        # недавно собранные альбомы, чтобы опоздавшее фото не начинало новый альбом
+        self._finished: OrderedDict[tuple[int, str], None] = OrderedDict()
+
+    def __len__(self) -> int:
+        """Количество собираемых альбомов."""
+        return len(self._groups)
+
+    def add(
+        self,
+        user_id: int,
+        media_group_id: str,
+        download: Callable[[], Coroutine[Any, Any, str]],
+        caption: str | None,
+        on_complete: Callable[[MediaGroup], Awaitable[None]],
+    ) -> MediaGroupAdd:
+        """Добавляет фото в альбом и запускает его скачивание.
+
+        download - функция, которая скачивает фото и возвращает его хэш; вызывается, только если фото
+        можно прикрепить. on_complete вызывается один раз после сборки альбома, в том числе с ошибкой.
+        Возвращает REJECTED, если новый альбом не принят из-за ограничения количества собираемых альбомов,
+        и LATE, если сборка альбома уже завершена и фото в него не попадет.
+        """
+        key = (user_id, media_group_id)
+        group = self._groups.get(key)
+        if (group is None and key in self._finished) or (group is not None and group.closed):
+            log.warning("Фото альбома {id} получено после завершения сборки", id=media_group_id)
+            return MediaGroupAdd.LATE
+        if group is None:
+            # новый альбом пользователя заменяет прежний, который еще собирается
+            for other_key in [other_key for other_key in self._groups if other_key[0] == user_id]:
+                self._discard(self._groups.pop(other_key))
+            if len(self._groups) >= self.max_pending:
+                log.warning("Собирается {n} альбомов, альбом {user} не принят", n=len(self._groups), user=user_id)
+                return MediaGroupAdd.REJECTED
+            group = MediaGroup(user_id=user_id, media_group_id=media_group_id)
+            self._groups[key] = group
+            group.task = asyncio.create_task(self._collect(key, group, on_complete))
+
+        if caption:
+            group.caption = caption
+        group.received += 1
+        if len(group.downloads) < self.max_photos:
+            group.downloads.append(asyncio.create_task(download()))
+        else:
+            group.overflow = True
+        group.arrived.set()
+        return MediaGroupAdd.ACCEPTED
+
+    async def _collect(
+        self,
+        key: tuple[int, str],
+        group: MediaGroup,
+        on_complete: Callable[[MediaGroup], Awaitable[None]],
+    ) -> None:
+        """Дожидается всех фото альбома и их скачивания, затем передает альбом в on_complete."""
+        try:
+            async with asyncio.timeout(self.ttl):
+                while group.received < MEDIA_GROUP_MAX_SIZE:
+                    group.arrived.clear()
+                    try:
+                        await asyncio.wait_for(group.arrived.wait(), timeout=self.quiet)
+                    except TimeoutError:
+                        break
+                group.closed = True
+                group.hashes = list(await asyncio.gather(*group.downloads))
+        except Exception as e:
+            group.error = e
+            for download in group.downloads:
+                download.cancel()
+            log.opt(exception=e).error("Не удалось собрать альбом {id}", id=group.media_group_id)
+        finally:
+            if self._groups.get(key) is group:
+                del self._groups[key]
+                self._finished[key] = None
+                while len(self._finished) > self.max_pending:
+                    self._finished.popitem(last=False)
+
+        log.info("альбом {id} собран: {n} фото", id=group.media_group_id, n=group.received)
+        try:
+            await on_complete(group)
+        except Exception as e:
+            log.opt(exception=e).error("Ошибка обработки альбома {id}", id=group.media_group_id)
+
+    @staticmethod
+    def _discard(group: MediaGroup) -> None:
+        """Отменяет сборку альбома и скачивание его фото."""
+        if group.task is not None:
+            group.task.cancel()
+        for download in group.downloads:
+            download.cancel()
+        log.info("альбом {id} заменен новым альбомом пользователя", id=group.media_group_id)
+
+
+media_group_aggregator = MediaGroupAggregator()
@@ -0,0 +1,217 @@
+"""Хранилище готовых отчётов (pdf, zip, xlsx, превью png) с метаданными и ограничением размера и возраста."""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from collections.abc import Iterable, Sequence
+from datetime import datetime
+from pathlib import Path
+
+from bot.config import settings
+from bot.constants import REPORT_STORE_MAX_AGE, REPORT_STORE_MAX_BYTES, tz
+from bot.db.models import UserModel, ViolationModel
+from bot.logger_config import log
+
+# увеличивать при изменениях в генерации typst-кода, которые не отражаются в файлах шаблона
+REPORT_FORMAT_VERSION = 5
+
+
+def _file_version(path: Path) -> str:
+    """Возвращает строку, меняющуюся при изменении файла."""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return f"{path.name}:-"
+    return f"{path.name}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def template_version() -> str:
+    """Версия шаблонов typst и настроек отчёта."""
+    files = sorted(settings.report_template.glob("*.typ"))
+    files.append(settings.report_config_file)
+    return "|".join([str(REPORT_FORMAT_VERSION), *(_file_version(file) for file in files)])
+
+
+def report_fingerprint(
+        created_by: UserModel,
+        violations: Iterable[ViolationModel],
+        file_name: str = "",
+        variant: str = "",
+) -> str:
+    """Отпечаток отчёта: всё, от чего зависит содержимое pdf.
+
+    Учитываются id и время изменения нарушений, хэши фотографий, данные места нарушения с именем
+    ответственного, имя зафиксировавшего нарушение, версия шаблонов, автор отчёта с его подписью,
+    дата формирования, которая печатается в документе, и имя файла. Имена пользователей меняются
+    без изменения нарушения, поэтому учитываются отдельно, как и в ключе generate_typst.FragmentCache.
+    variant - прочие параметры создания отчёта, например ограничение размера.
+    """
+    digest = hashlib.sha256()
+
+    def add(*parts: object) -> None:
+        digest.update("\x1f".join(str(part) for part in parts).encode())
+        digest.update(b"\x1e")
+
+    add(template_version(), file_name, variant)
+    add(datetime.now(tz=tz).date().isoformat())
+    add(created_by.id, created_by.user_role, created_by.first_name)
+    add(_file_version(settings.image_write_dir / "signs" / f"{created_by.id}.png"))
+    for violation in violations:
+        area = violation.area
+        add(violation.id, violation.updated_at.isoformat(), violation.status)
+        responsible_name = area.responsible_user.first_name if area.responsible_user else None
+        add(area.id, area.name, area.responsible_text, area.responsible_user_id, responsible_name)
+        add(violation.detector.first_name)
+        add(*(file.hash for file in violation.files))
+    return digest.hexdigest()
+
+
+class ReportStore:
+    """Хранилище готовых отчётов на диске.
+
+    Каждая запись - каталог с именем ключа, внутри которого лежит файл отчёта под своим пользовательским
+    именем и META_FILE с метаданными: параметрами создания, отпечатком, размером и временем создания отчёта.
+    Имена каталогов уникальны, поэтому одновременно созданные отчёты с одинаковыми именами файлов не мешают
+    друг другу. Ключ pdf-отчёта - его отпечаток, поэтому неизменившийся отчёт отдается повторно без компиляции.
+    Страницы превью хранятся в одной записи несколькими файлами (put_pages).
+    Время изменения каталога обновляется при каждом обращении и используется для вытеснения.
+    """
+
+    META_FILE = "meta.json"
+
+    def __init__(
+        self,
+        root: Path,
+        max_bytes: int = REPORT_STORE_MAX_BYTES,
+        max_age_seconds: float = REPORT_STORE_MAX_AGE.total_seconds(),
+    ) -> None:
+        """Инициализация хранилища."""
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+
+    @staticmethod
+    def new_key(prefix: str) -> str:
+        """Уникальный ключ для отчёта, который не нужно искать повторно (например, статистика)."""
+        return f"{prefix}-{uuid.uuid4().hex}"
+
+    def get(self, key: str) -> Path | None:
+        """Возвращает путь к сохраненному отчёту или None."""
+        entry = self.root / key
+        files = [file for file in entry.iterdir() if not file.name.startswith(self.META_FILE)] if entry.is_dir() else []
+        if not files:
+            return None
+        try:
+            os.utime(entry)
+        except OSError:
+            return None
+        log.debug("отчёт взят из хранилища: {f}", f=files[0])
+        return files[0]
+
+    def metadata(self, key: str) -> dict | None:
+        """Метаданные отчёта или None, если отчёта нет."""
+        try:
+            return json.loads((self.root / key / self.META_FILE).read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, key: str, file: Path, file_name: str | None = None, **params: object) -> Path:
+        """Переносит готовый отчёт в хранилище и возвращает его новый путь.
+
+        file_name - имя отчёта в хранилище, по умолчанию имя переносимого файла.
+        params - параметры создания отчёта, они сохраняются в метаданных вместе с размером файла;
+        render_seconds, если передан, - время создания отчёта.
+        """
+        entry = self.root / key
+        entry.mkdir(parents=True, exist_ok=True)
+        stored = entry / (file_name or file.name)
+        # перенос атомарный, поэтому параллельные запросы не получат недописанный файл
+        file.replace(stored)
+        meta = {
+            "key": key,
+            "file_name": stored.name,
+            "size": stored.stat().st_size,
+            "created_at": datetime.now(tz=tz).isoformat(timespec="seconds"),
+            **params,
+        }
+        self._write_meta(entry, meta)
+        self.evict()
+        return stored
+
+    def get_pages(self, key: str) -> list[Path]:
+        """Файлы отчёта из нескольких страниц (см. put_pages) по порядку или пустой список.
+
+        Запись считается готовой, только когда записаны метаданные, то есть перенесены все страницы.
+        """
+        entry = self.root / key
+        if not (entry / self.META_FILE).is_file():
+            return []
+        pages = sorted(file for file in entry.iterdir() if not file.name.startswith(self.META_FILE))
+        try:
+            os.utime(entry)
+        except OSError:
+            return []
+        return pages
+
+    def put_pages(self, key: str, pages: Sequence[Path], **params: object) -> list[Path]:
+        """Переносит в хранилище отчёт из нескольких файлов, например страницы превью, и возвращает их новые пути.
+
+        Имена файлов должны задавать порядок страниц. params - как в put.
+        """
+        entry = self.root / key
+        entry.mkdir(parents=True, exist_ok=True)
+        stored = []
+        for page in pages:
+            page.replace(entry / page.name)
+            stored.append(entry / page.name)
+        meta = {
+            "key": key,
+            "files": [page.name for page in stored],
+            "size": sum(page.stat().st_size for page in stored),
+            "created_at": datetime.now(tz=tz).isoformat(timespec="seconds"),
+            **params,
+        }
+        self._write_meta(entry, meta)
+        self.evict()
+        return stored
+
+    def evict(self) -> None:
+        """Удаляет записи старше допустимого возраста, затем самые давние, пока размер хранилища превышает лимит."""
+        if not self.root.exists():
+            return
+        now = time.time()
+        entries = []
+        for entry in self.root.iterdir():
+            try:
+                mtime = entry.stat().st_mtime
+                size = sum(file.stat().st_size for file in entry.iterdir())
+            except OSError:
+                continue
+            if now - mtime > self.max_age_seconds:
+                self._remove(entry)
+            else:
+                entries.append((mtime, size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda item: item[0]):
+            if total <= self.max_bytes:
+                break
+            self._remove(entry)
+            total -= size
+
+    def _write_meta(self, entry: Path, meta: dict) -> None:
+        """Атомарно записывает метаданные записи."""
+        tmp_meta = entry / f"{self.META_FILE}.{uuid.uuid4().hex}.tmp"
+        tmp_meta.write_text(json.dumps(meta, ensure_ascii=False, default=str), encoding="utf-8")
+        tmp_meta.replace(entry / self.META_FILE)
+
+    @staticmethod
+    def _remove(entry: Path) -> None:
+        log.debug("отчёт удален из хранилища: {e}", e=entry.name)
+        shutil.rmtree(entry, ignore_errors=True)
+
+
+report_store = ReportStore(settings.report_store_dir)
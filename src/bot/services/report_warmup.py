@@ -0,0 +1,56 @@
+"""Фоновый прогрев кэша отчётов по отдельным нарушениям."""
+
+import asyncio
+
+from bot.config import settings
+from bot.constants import VIOLATION_REVIEW_PREVIEW
+from bot.db.database import async_session_factory
+from bot.enums import ViolationStatus
+from bot.handlers.reports_handlers.create_reports import create_typst_preview, create_typst_report
+from bot.logger_config import log
+from bot.repositories.user_repo import UserRepository
+from bot.repositories.violation_repo import ViolationRepository
+
+# ссылки на фоновые задачи, чтобы их не собрал сборщик мусора до завершения
+_warmup_tasks: set[asyncio.Task] = set()
+
+
+async def warm_up_violation_report(violation_id: int) -> None:
+    """Создает отчёт нарушения для администраторов, чтобы при следующем просмотре он был взят из кэша.
+
+    Нарушение заново читается в собственной сессии: объекты сессии обработчика к этому моменту
+    могут быть уже закрыты или устаревшими. Автор отчёта входит в его отпечаток, поэтому отчёт создается
+    для каждого администратора. Создается только то, что администратор увидит следующим: для нарушения
+    на проверке - то, что отправляет /check (превью при VIOLATION_REVIEW_PREVIEW, иначе pdf), для активного -
+    pdf, который отправляет /close. Устраненные и отклоненные нарушения не прогреваются.
+    """
+    async with async_session_factory() as session:
+        violation = await ViolationRepository(session).get_violation_by_id(violation_id)
+        if violation is None:
+            return
+        if violation.status == ViolationStatus.REVIEW and VIOLATION_REVIEW_PREVIEW:
+            create = create_typst_preview
+        elif violation.status in (ViolationStatus.REVIEW, ViolationStatus.ACTIVE):
+            create = create_typst_report
+        else:
+            return
+        user_repo = UserRepository(session)
+        for admin_tg_id in settings.SUPER_USERS_TG_ID:
+            admin = await user_repo.get_user_by_telegram_id(admin_tg_id)
+            if admin is None:
+                continue
+            await create(violations=(violation,), created_by=admin, background=True)
+    log.debug("кэш отчёта нарушения {id} прогрет", id=violation_id)
+
+
+def schedule_report_warmup(violation_id: int) -> None:
+    """Ставит фоновый прогрев отчёта нарушения, не дожидаясь его завершения."""
+    task = asyncio.create_task(warm_up_violation_report(violation_id))
+    _warmup_tasks.add(task)
+    task.add_done_callback(_on_warmup_done)
+
+
+def _on_warmup_done(task: asyncio.Task) -> None:
+    _warmup_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        log.opt(exception=task.exception()).error("Ошибка фонового создания отчёта нарушения")
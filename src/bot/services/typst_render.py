@@ -0,0 +1,386 @@
+"""Асинхронная компиляция typst-документов."""
+
+import asyncio
+import os
+import platform
+import re
+import shutil
+import tempfile
+import uuid
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from bot.bot_exceptions import TypstCompileError, TypstWatchError
+from bot.config import settings
+from bot.constants import (
+    MAX_TYPST_BACKGROUND_WORKERS,
+    MAX_TYPST_WORKERS,
+    TYPST_BACKEND,
+    TYPST_BACKGROUND_NICENESS,
+    TYPST_USE_BUNDLED_FONTS,
+    TYPST_WATCH_TIMEOUT,
+)
+from bot.logger_config import log
+
+
+def get_typst_command() -> list[str]:
+    """Возвращает команду запуска компилятора typst для текущей платформы."""
+    if platform.system() == "Windows":
+        return [str(settings.typst_dir / "typst.exe")]
+    return ["typst"]
+
+
+def get_font_args() -> list[str]:
+    """Аргументы typst со шрифтами: только шрифты бота, без поиска системных шрифтов при каждом запуске."""
+    if not TYPST_USE_BUNDLED_FONTS:
+        return []
+    return ["--font-path", str(settings.font_dir), "--ignore-system-fonts"]
+
+
+def get_background_prefix() -> list[str]:
+    """Префикс команды, понижающий приоритет процесса фоновой компиляции, если это поддерживается системой."""
+    nice = shutil.which("nice")
+    if platform.system() == "Windows" or nice is None:
+        return []
+    return [nice, "-n", str(TYPST_BACKGROUND_NICENESS)]
+
+
+# строка состояния typst watch после каждой компиляции: "[12:00:00] compiled successfully in 52.10ms"
+_WATCH_STATUS = re.compile(r"compiled (successfully|with warnings|with errors)")
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+
+
+class TypstWatcher:
+    """Долгоживущий процесс typst watch, который перекомпилирует файл своего каталога при каждом изменении.
+
+    Новый документ записывается в отслеживаемый файл с уникальной меткой в ключевых словах pdf: по ней
+    отличается результат своего задания от повторных компиляций прежнего содержимого. После задания
+    документ заменяется пустым (reset), чтобы удаление каталога задания с данными отчёта не вызвало
+    перекомпиляцию с ошибкой, которую следующее задание приняло бы за свою.
+    """
+
+    def __init__(self, slot_dir: Path, timeout: float = TYPST_WATCH_TIMEOUT) -> None:
+        """Инициализация процесса без запуска."""
+        self.slot_dir = slot_dir
+        self.typ_file = slot_dir / "report.typ"
+        self.pdf_file = slot_dir / "report.pdf"
+        self.timeout = timeout
+        self._process: asyncio.subprocess.Process | None = None
+        self._reader: asyncio.Task | None = None
+        self._events: asyncio.Queue[tuple[bool, list[str]]] = asyncio.Queue()
+
+    @property
+    def alive(self) -> bool:
+        """Процесс запущен и не завершился."""
+        return self._process is not None and self._process.returncode is None
+
+    async def start(self) -> None:
+        """Запускает typst watch и дожидается первой компиляции пустого документа."""
+        self.typ_file.write_text("", encoding="utf-8")
+        cmd = [
+            *get_typst_command(),
+            "watch",
+            "--root",
+            str(settings.BASE_DIR),
+            *get_font_args(),
+            str(self.typ_file),
+            str(self.pdf_file),
+        ]
+        self._process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self._reader = asyncio.create_task(self._read_output())
+        await self._next_status(self.timeout)
+        log.info("запущен typst watch в {d}", d=self.slot_dir.name)
+
+    async def _read_output(self) -> None:
+        """Разбирает вывод typst watch на события завершения компиляции с сообщениями после них."""
+        lines: list[str] = []
+        async for raw_line in self._process.stderr:
+            line = _ANSI_ESCAPE.sub("", raw_line.decode(errors="replace")).rstrip()
+            match = _WATCH_STATUS.search(line)
+            if match:
+                lines = [line]
+                self._events.put_nowait((match[1] != "with errors", lines))
+            else:
+                lines.append(line)
+
+    async def _next_status(self, timeout: float) -> tuple[bool, list[str]]:
+        """Ждет очередной компиляции; если процесс завершился или не ответил, вызывает TypstWatchError."""
+        event = asyncio.create_task(self._events.get())
+        exited = asyncio.create_task(self._process.wait())
+        done, _ = await asyncio.wait((event, exited), timeout=max(timeout, 0), return_when=asyncio.FIRST_COMPLETED)
+        if event in done:
+            exited.cancel()
+            return event.result()
+        event.cancel()
+        exited.cancel()
+        if done:
+            raise TypstWatchError(f"typst watch завершился с кодом {self._process.returncode}")
+        raise TypstWatchError("typst watch не ответил вовремя")
+
+    def _write_source(self, source: str) -> None:
+        tmp_file = self.typ_file.with_suffix(".tmp")
+        tmp_file.write_text(source, encoding="utf-8")
+        # замена файла целиком: typst не увидит недописанный документ
+        os.replace(tmp_file, self.typ_file)
+
+    def _pdf_has_marker(self, marker: str) -> bool:
+        try:
+            return marker.encode() in self.pdf_file.read_bytes()
+        except FileNotFoundError:
+            return False
+
+    async def compile(self, typ_file: Path, pdf_file: Path) -> Path:
+        """Компилирует typ-файл задания в отслеживаемом каталоге и копирует результат в pdf_file."""
+        marker = f"job-{uuid.uuid4().hex}"
+        source = await asyncio.to_thread(typ_file.read_text, encoding="utf-8")
+        while not self._events.empty():
+            self._events.get_nowait()
+        await asyncio.to_thread(self._write_source, f'{source}\n#set document(keywords: ("{marker}",))\n')
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        while True:
+            success, lines = await self._next_status(deadline - loop.time())
+            if not success:
+                # сообщения об ошибках печатаются после строки состояния
+                await asyncio.sleep(0.1)
+                log.error("\n".join(lines))
+                raise TypstCompileError("\n".join(lines))
+            if await asyncio.to_thread(self._pdf_has_marker, marker):
+                await asyncio.to_thread(shutil.copyfile, self.pdf_file, pdf_file)
+                return pdf_file
+
+    async def reset(self) -> None:
+        """Заменяет документ пустым и дожидается его компиляции.
+
+        После этого документ не зависит от файлов задания, и их удаление не вызывает перекомпиляцию.
+        Если пустой документ не скомпилирован, вызывает TypstWatchError.
+        """
+        while not self._events.empty():
+            self._events.get_nowait()
+        await asyncio.to_thread(self._write_source, "")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        success = False
+        # ошибки относятся к прежнему документу, если он скомпилирован до замены
+        while not success:
+            success, _ = await self._next_status(deadline - loop.time())
+
+    async def stop(self) -> None:
+        """Останавливает процесс и удаляет его каталог."""
+        if self.alive:
+            self._process.terminate()
+            try:
+                await asyncio.wait_for(self._process.wait(), timeout=5)
+            except TimeoutError:
+                self._process.kill()
+                await self._process.wait()
+        if self._reader is not None:
+            self._reader.cancel()
+        await asyncio.to_thread(shutil.rmtree, self.slot_dir, True)
+
+
+class TypstRenderService:
+    """Сервис компиляции typst-документов.
+
+    Каждое задание получает собственный временный каталог, а компиляция выполняется в отдельном процессе,
+    не блокируя цикл событий. Количество одновременных компиляций ограничено семафором.
+    Фоновые компиляции занимают не больше max_background_workers слотов и запускаются с пониженным
+    приоритетом, поэтому интерактивным запросам всегда остается хотя бы один слот. Если слот всего один,
+    фоновым компиляциям слоты не выделяются: они используют общий слот и запускаются, только когда
+    интерактивных компиляций нет.
+    При backend="watch" интерактивные компиляции выполняются долгоживущими процессами typst watch
+    (не больше max_workers), а если процесс завершился или не ответил - обычным запуском typst.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = MAX_TYPST_WORKERS,
+        max_background_workers: int = MAX_TYPST_BACKGROUND_WORKERS,
+        backend: str = TYPST_BACKEND,
+    ) -> None:
+        """Инициализация сервиса."""
+        self._semaphore = asyncio.Semaphore(max_workers)
+        background_workers = min(max_background_workers, max_workers - 1)
+        self._background_semaphore = asyncio.Semaphore(background_workers) if background_workers > 0 else None
+        self._interactive = 0  # интерактивные компиляции, ожидающие слота или выполняющиеся
+        self._interactive_idle = asyncio.Event()
+        self._interactive_idle.set()
+        self._backend = backend
+        self._idle_watchers: list[TypstWatcher] = []
+
+    @asynccontextmanager
+    async def workspace(self) -> AsyncIterator[Path]:
+        """Создает временный каталог задания внутри каталога typst и удаляет его после завершения работы."""
+        job_dir = Path(tempfile.mkdtemp(prefix="job_", dir=settings.typst_dir))
+        try:
+            yield job_dir
+        finally:
+            await asyncio.to_thread(shutil.rmtree, job_dir, True)
+
+    async def compile(self, typ_file: Path, pdf_file: Path, background: bool = False) -> Path:
+        """Компилирует typ-файл в pdf и возвращает путь к результату.
+
+        background - фоновая компиляция с пониженным приоритетом.
+        """
+        cmd = [
+            *get_typst_command(),
+            "compile",
+            "--root",
+            str(settings.BASE_DIR),
+            *get_font_args(),
+            str(typ_file),
+            str(pdf_file),
+        ]
+        if background:
+            async with self._background_slot():
+                stdout, stderr, returncode = await self._run([*get_background_prefix(), *cmd])
+        elif self._backend == "watch":
+            async with self._interactive_slot():
+                async with self._semaphore:
+                    try:
+                        return await self._compile_watch(typ_file, pdf_file)
+                    except TypstWatchError as e:
+                        log.warning("{e}, отчёт компилируется отдельным процессом", e=e)
+                stdout, stderr, returncode = await self._run(cmd)
+        else:
+            async with self._interactive_slot():
+                stdout, stderr, returncode = await self._run(cmd)
+
+        self._check_result(stdout, stderr, returncode)
+        return pdf_file
+
+    async def compile_png(
+        self, typ_file: Path, output_dir: Path, ppi: int, pages: int, background: bool = False
+    ) -> list[Path]:
+        """Компилирует первые pages страниц документа в png с разрешением ppi и возвращает пути страниц по порядку.
+
+        background - фоновая компиляция с пониженным приоритетом, как в compile.
+        """
+        cmd = [
+            *get_typst_command(),
+            "compile",
+            "--root",
+            str(settings.BASE_DIR),
+            *get_font_args(),
+            "--format",
+            "png",
+            "--ppi",
+            str(ppi),
+            "--pages",
+            f"1-{pages}",
+            str(typ_file),
+            str(output_dir / "page-{0p}.png"),
+        ]
+        if background:
+            async with self._background_slot():
+                self._check_result(*await self._run([*get_background_prefix(), *cmd]))
+        else:
+            async with self._interactive_slot():
+                self._check_result(*await self._run(cmd))
+        return sorted(output_dir.glob("page-*.png"))
+
+    @asynccontextmanager
+    async def _interactive_slot(self) -> AsyncIterator[None]:
+        """Отмечает интерактивную компиляцию на время ожидания слота и выполнения."""
+        self._interactive += 1
+        self._interactive_idle.clear()
+        try:
+            yield
+        finally:
+            self._interactive -= 1
+            if not self._interactive:
+                self._interactive_idle.set()
+
+    @asynccontextmanager
+    async def _background_slot(self) -> AsyncIterator[None]:
+        """Ограничивает фоновые компиляции выделенными им слотами.
+
+        Если слоты не выделены, фоновая компиляция ждет, пока не останется интерактивных компиляций.
+        """
+        if self._background_semaphore is not None:
+            async with self._background_semaphore:
+                yield
+            return
+        while self._interactive:
+            await self._interactive_idle.wait()
+        yield
+
+    @staticmethod
+    def _check_result(stdout: bytes, stderr: bytes, returncode: int) -> None:
+        """Записывает вывод typst в лог и вызывает TypstCompileError, если компиляция не удалась."""
+        out_text = stdout.decode(errors="replace")
+        err_text = stderr.decode(errors="replace")
+        if returncode != 0:
+            log.warning(out_text)
+            log.error(err_text)
+            raise TypstCompileError(err_text)
+        if out_text:
+            log.info(out_text)
+        if err_text:
+            log.warning(err_text)
+
+    async def _compile_watch(self, typ_file: Path, pdf_file: Path) -> Path:
+        """Компиляция свободным процессом typst watch, при необходимости процесс запускается заново."""
+        watcher = self._idle_watchers.pop() if self._idle_watchers else None
+        if watcher is not None and not watcher.alive:
+            await watcher.stop()
+            watcher = None
+        try:
+            if watcher is None:
+                watcher = TypstWatcher(Path(tempfile.mkdtemp(prefix="watch_", dir=settings.typst_dir)))
+                await watcher.start()
+            result = await watcher.compile(typ_file, pdf_file)
+        except TypstWatchError:
+            await watcher.stop()
+            raise
+        except Exception:
+            # ошибка в самом документе не мешает процессу компилировать следующие
+            await self._release_watcher(watcher)
+            raise
+        except BaseException:
+            # при отмене процесс может еще компилировать документ задания, каталог которого будет удален
+            await watcher.stop()
+            raise
+        await self._release_watcher(watcher)
+        return result
+
+    async def _release_watcher(self, watcher: TypstWatcher) -> None:
+        """Возвращает процесс typst watch в число свободных, предварительно заменив его документ пустым."""
+        try:
+            if watcher.alive:
+                await watcher.reset()
+                self._idle_watchers.append(watcher)
+                return
+        except TypstWatchError as e:
+            log.warning("{e}, процесс typst watch остановлен", e=e)
+        await watcher.stop()
+
+    async def close(self) -> None:
+        """Останавливает процессы typst watch."""
+        while self._idle_watchers:
+            await self._idle_watchers.pop().stop()
+
+    async def _run(self, cmd: list[str]) -> tuple[bytes, bytes, int]:
+        """Запускает процесс компиляции, занимая слот семафора."""
+        async with self._semaphore:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            stdout, stderr = await process.communicate()
+        return stdout, stderr, process.returncode
+
+    async def compile_to_bytes(self, typ_file: Path) -> bytes:
+        """Компилирует typ-файл и возвращает содержимое pdf."""
+        pdf_file = await self.compile(typ_file, typ_file.with_suffix(".pdf"))
+        return await asyncio.to_thread(pdf_file.read_bytes)
+
+
+typst_renderer = TypstRenderService()
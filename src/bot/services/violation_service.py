@@ -5,7 +5,7 @@ from bot.constants import action_needed_deadline
 from bot.db.models import FileModel, ViolationModel
 from bot.repositories.violation_repo import ViolationRepository
 from bot.repositories.image_repo import ImageRepository
-from bot.utils.image_utils import handle_image
+from bot.utils.image_utils import ingest_images
 from bot.logger_config import log
 
 class ViolationService:
@@ -17,6 +17,9 @@ class ViolationService:
 
     async def add(self, data):
         log.info("Добавляем новое нарушение.")
+        # фотографии переносятся из области ожидания в хранилище (см. ingest_images) до обращений к базе;
+        # если регистрация устарела и фотографии удалены, вызывается FileNotFoundError
+        image_infos = await ingest_images(data["images"])
         number = await self.violations.get_max_number()
         actions = [f"{line["action"]}. Срок устранения: {line["fix_time"]}" for line in action_needed_deadline()]
         violation = ViolationModel(
@@ -34,8 +37,12 @@ class ViolationService:
         # no_autoflush чтобы file не делал ленивую загрузку violations, иначе будет ошибка асинхронного запроса
         # ошибка будет в том, что сессия пытается получить filemodel.violations, которых еще нет
         with self.session.no_autoflush:
-            for image in data["images"]:
-                image_info = handle_image(image)
+            attached = set()
+            for image_info in image_infos:
+                # одна и та же фотография, отправленная дважды, прикрепляется один раз
+                if image_info.hash in attached:
+                    continue
+                attached.add(image_info.hash)
                 existing_file = await self.images.get(image_info.hash)
                 if existing_file:
                     img_file = existing_file
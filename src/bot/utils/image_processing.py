@@ -0,0 +1,131 @@
+"""Уменьшение фотографий.
+
+Функции модуля выполняются в процессах пула (см. image_utils.get_process_pool), которые запускаются
+методом forkserver или spawn и импортируют модуль заново. Поэтому здесь нет импортов с побочными эффектами:
+настроек, логгера и базы данных - иначе каждый процесс добавлял бы свой обработчик лог-файла
+и создавал бы свое подключение к базе.
+"""
+
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+
+from bot.constants import IMAGE_DECODE_PROFILE
+from PIL import Image
+
+MAX_SIDE = 640
+JPEG_QUALITY = 45
+
+
+@dataclass(frozen=True)
+class DecodeProfile:
+    """Соотношение скорости и качества при уменьшении фотографии.
+
+    reducing_gap - во сколько раз изображение после чернового декодирования jpeg (в 1/2, 1/4 или 1/8 масштаба
+    прямо из коэффициентов DCT) должно остаться больше целевого размера; None - полное декодирование.
+    resample - фильтр окончательного уменьшения.
+    """
+
+    reducing_gap: float | None
+    resample: Image.Resampling
+
+
+DECODE_PROFILES = {
+    "quality": DecodeProfile(reducing_gap=None, resample=Image.Resampling.LANCZOS),
+    "balanced": DecodeProfile(reducing_gap=2.0, resample=Image.Resampling.LANCZOS),
+    "fast": DecodeProfile(reducing_gap=1.0, resample=Image.Resampling.BILINEAR),
+}
+
+
+@dataclass(frozen=True)
+class ThumbnailProfile:
+    """Параметры уменьшенной копии изображения."""
+
+    max_side: int = MAX_SIDE
+    quality: int = JPEG_QUALITY
+    decode: str = IMAGE_DECODE_PROFILE
+
+    @property
+    def name(self) -> str:
+        """Имя профиля, используется как каталог в хранилище уменьшенных копий."""
+        return f"{self.max_side}q{self.quality}-{self.decode}"
+
+
+REPORT_PROFILE = ThumbnailProfile()
+
+
+def _draft_size(size: tuple[int, int], max_side: int, reducing_gap: float) -> tuple[int, int]:
+    """Наименьший размер, который должен остаться после чернового декодирования."""
+    scale = min(1.0, max_side * reducing_gap / max(size))
+    return math.ceil(size[0] * scale), math.ceil(size[1] * scale)
+
+
+def process_image(image: bytes, max_side: int = MAX_SIDE, decode: str = IMAGE_DECODE_PROFILE) -> Image.Image:
+    """Уменьшает изображение так, чтобы большая сторона была не больше max_side."""
+    decode_profile = DECODE_PROFILES[decode]
+    with Image.open(BytesIO(image)) as im:
+        # черновое декодирование должно быть до первой загрузки пикселей (convert, copy),
+        # для других форматов draft ничего не делает и изображение декодируется полностью
+        if decode_profile.reducing_gap is not None and im.format == "JPEG":
+            im.draft(None, _draft_size(im.size, max_side, decode_profile.reducing_gap))
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        # работаем с копией, чтобы не зависеть от закрытого файла
+        out = im.copy()
+        out.thumbnail((max_side, max_side), decode_profile.resample, reducing_gap=None)
+        return out
+
+
+
+def image_to_buffer(img: Image.Image, quality: int = JPEG_QUALITY) -> BytesIO:
+    """Сохраняет изображение в jpeg в памяти."""
+    buf = BytesIO()
+    img.save(
+        buf,
+        "JPEG",
+        quality=quality,
+        optimize=True,
+        progressive=True,
+        subsampling="4:2:0",
+    )
+    buf.seek(0)          # важно, если буфер будут читать
+    return buf
+
+def buffer_to_file(filename: Path, buf: BytesIO) -> None:
+    """Записывает содержимое буфера в файл."""
+    with filename.open("wb") as f:
+        f.write(buf.getvalue())
+    return
+
+
+def shrink_image(data: bytes, profile: ThumbnailProfile = REPORT_PROFILE) -> BytesIO:
+    """Уменьшенная копия изображения в jpeg по профилю."""
+    processed_img = process_image(data, profile.max_side, profile.decode)
+    return image_to_buffer(processed_img, profile.quality)
+
+
+def build_thumbnail(source: Path, thumb_path: Path, profile: ThumbnailProfile = REPORT_PROFILE) -> None:
+    """Создает уменьшенную копию изображения."""
+    buffer = shrink_image(source.read_bytes(), profile)
+    thumb_path.parent.mkdir(parents=True, exist_ok=True)
+    # запись во временный файл и переименование, чтобы параллельные задания не увидели недописанный файл
+    tmp_path = thumb_path.with_name(f"{thumb_path.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+    buffer_to_file(tmp_path, buffer)
+    tmp_path.replace(thumb_path)
+
+
+def lower_priority(niceness: int) -> None:
+    """Инициализатор процессов фонового пула: понижает приоритет процесса, если это поддерживается системой."""
+    if hasattr(os, "nice"):
+        os.nice(niceness)
+
+
+def build_thumbnail_timed(source: Path, thumb_path: Path, profile: ThumbnailProfile) -> float:
+    """Выполняется в процессе пула: создает уменьшенную копию и возвращает время работы в секундах."""
+    started = time.perf_counter()
+    build_thumbnail(source, thumb_path, profile)
+    return time.perf_counter() - started
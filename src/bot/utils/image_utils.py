@@ -1,15 +1,44 @@
 """Функции для обработки изображений, добавляемых во время регистрации нарушений."""
+import asyncio
+import contextlib
 import hashlib
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
+from multiprocessing import get_all_start_methods, get_context
+from multiprocessing.context import BaseContext
 from pathlib import Path
 from dataclasses import dataclass
-from typing import Iterable
+from datetime import timedelta
+from typing import BinaryIO
+from collections import Counter
+from collections.abc import AsyncIterator, Iterable, Iterator, Mapping, Sequence
 
-from PIL import Image, ImageOps
+from aiogram import Bot
+from PIL import Image
 from bot.config import settings
+from bot.constants import (
+    IMAGE_BACKGROUND_NICENESS,
+    IMAGE_STAGING_SWEEP_INTERVAL,
+    IMAGE_STAGING_TTL,
+    MAX_IMAGE_BACKGROUND_WORKERS,
+    MAX_IMAGE_INGEST_WORKERS,
+    MAX_IMAGE_WORKERS,
+    THUMBNAIL_STORE_MAX_BYTES,
+)
 from bot.logger_config import log
 from bot.db.models import FileModel, ViolationModel
-from bot.config import settings
+# уменьшение фотографий вынесено в модуль без побочных эффектов импорта, см. image_processing
+from bot.utils.image_processing import (
+    REPORT_PROFILE,
+    ThumbnailProfile,
+    build_thumbnail,
+    build_thumbnail_timed,
+    lower_priority,
+)
 
 @dataclass()
 class ImageInfo:
@@ -25,41 +54,207 @@ def get_hash(image: bytes) -> str:
     return hashlib.sha256(image).hexdigest()
 
 
-def save_image(image: bytes, img_hash: str) -> Path:
-    """Сохраняет двоичные данные в файл изображения и возвращает путь к этому файлу."""
-    subdir = settings.image_write_dir / img_hash[:2]
-    if not subdir.exists():
-        subdir.mkdir()
-    filename = f"{img_hash}.jpg"
-    filepath = subdir / filename
-    rel_filepath = settings.image_dir / img_hash[:2] / filename
-    if not filepath.exists():
-        try:
-            with filepath.open("wb") as f:
-                f.write(image)
-        except Exception as e:
-            err_msg = "Ошибка при сохранении изображения в нарушении. %"
-            log.error(err_msg % filepath)
-            log.exception(e)
-            raise Exception(err_msg % filepath)
-    return rel_filepath
+def image_rel_path(img_hash: str) -> Path:
+    """Путь фотографии от DATA_DIR, который записывается в базу."""
+    return settings.image_dir / img_hash[:2] / f"{img_hash}.jpg"
 
 
-def get_image_aspect_ratio(image_body: bytes) -> float:
+def get_image_aspect_ratio(image: bytes | Path) -> float:
     """Определяет ориентацию изображения для последуюшей компоновки в отчете."""
-    image = Image.open(BytesIO(image_body))
-    width, height = image.size
+    with Image.open(BytesIO(image) if isinstance(image, bytes) else image) as img:
+        width, height = img.size
     return width / height
 
 
-def handle_image(image: bytes) ->ImageInfo:
-    """Сохраняет двоичные данные в файл и возвращает сведения об этом файле."""
-    img_hash = get_hash(image)
-    aspect_ratio = get_image_aspect_ratio(image)
-    rel_path = save_image(image, img_hash)
+def describe_image(img_hash: str) -> ImageInfo:
+    """Сведения о сохраненной фотографии: размеры читаются из заголовка файла без декодирования."""
+    rel_path = image_rel_path(img_hash)
+    aspect_ratio = get_image_aspect_ratio(settings.DATA_DIR / rel_path)
     return ImageInfo(hash=img_hash, path=str(rel_path), aspect_ratio=aspect_ratio)
 
 
+class _HashingWriter:
+    """Файл для записи, который по мере записи считает sha256 содержимого."""
+
+    def __init__(self, file: BinaryIO) -> None:
+        self._file = file
+        self._digest = hashlib.sha256()
+
+    def write(self, chunk: bytes) -> int:
+        self._digest.update(chunk)
+        return self._file.write(chunk)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+
+def _touch(path: Path) -> bool:
+    """Обновляет время изменения файла; возвращает False, если файла нет."""
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+class StagingArea:
+    """Фотографии нарушений, регистрация которых еще не завершена.
+
+    Фотографии адресуются хэшем содержимого: staging/<hash>.jpg. В состоянии FSM хранятся только хэши,
+    поэтому память не зависит от количества незавершенных регистраций. После подтверждения нарушения
+    фотография переносится в хранилище изображений, а брошенные регистрации удаляются по истечении ttl.
+    """
+
+    def __init__(self, root: Path, ttl: timedelta = IMAGE_STAGING_TTL) -> None:
+        """Инициализация области."""
+        self.root = root
+        self.ttl = ttl
+
+    def path_for(self, img_hash: str) -> Path:
+        """Путь фотографии в области ожидания."""
+        return self.root / f"{img_hash}.jpg"
+
+    def new_tmp_path(self) -> Path:
+        """Путь временного файла для скачивания; он в том же каталоге, поэтому переименование атомарное."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        return self.root / f"{uuid.uuid4().hex}.part"
+
+    def add(self, tmp_path: Path, img_hash: str) -> None:
+        """Переносит скачанный файл в область ожидания.
+
+        Если фотография уже сохранена в хранилище или ожидает в другой регистрации, временный файл удаляется,
+        а время изменения существующей копии обновляется, чтобы ее не удалила очистка области ожидания
+        или сборка мусора хранилища (services.image_gc не удаляет файлы моложе IMAGE_GC_GRACE).
+        """
+        if _touch(settings.DATA_DIR / image_rel_path(img_hash)) or _touch(self.path_for(img_hash)):
+            tmp_path.unlink()
+        else:
+            tmp_path.replace(self.path_for(img_hash))
+
+    def locate(self, img_hash: str) -> Path:
+        """Путь фотографии: в хранилище, если она уже сохранена, иначе в области ожидания."""
+        stored = settings.DATA_DIR / image_rel_path(img_hash)
+        return stored if stored.exists() else self.path_for(img_hash)
+
+    def commit(self, img_hash: str) -> Path:
+        """Переносит фотографию подтвержденного нарушения в хранилище изображений и возвращает путь.
+
+        Если фотографии нет ни в хранилище, ни в области ожидания (регистрация устарела и была очищена),
+        вызывается FileNotFoundError.
+        """
+        target = settings.DATA_DIR / image_rel_path(img_hash)
+        if _touch(target):
+            return target
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self.path_for(img_hash).replace(target)
+        except FileNotFoundError:
+            # фотографию могла одновременно перенести другая регистрация с тем же снимком
+            if not target.exists():
+                raise
+        return target
+
+    def sweep(self) -> int:
+        """Удаляет фотографии и недокачанные файлы, которые не менялись дольше ttl; возвращает их количество."""
+        deadline = time.time() - self.ttl.total_seconds()
+        removed = 0
+        if not self.root.exists():
+            return removed
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < deadline:
+                        os.unlink(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        if removed:
+            log.info("Удалено {n} фотографий незавершенных регистраций нарушений", n=removed)
+        return removed
+
+
+image_staging = StagingArea(settings.image_staging_dir)
+
+# ссылка на задачу периодической очистки, чтобы ее не собрал сборщик мусора
+_staging_sweeper: asyncio.Task | None = None
+
+
+async def _sweep_staging_periodically(interval: timedelta) -> None:
+    while True:
+        try:
+            await asyncio.to_thread(image_staging.sweep)
+        except Exception as e:
+            log.opt(exception=e).error("Ошибка очистки фотографий незавершенных регистраций")
+        await asyncio.sleep(interval.total_seconds())
+
+
+def start_staging_sweeper(interval: timedelta = IMAGE_STAGING_SWEEP_INTERVAL) -> None:
+    """Запускает периодическую очистку области ожидания; первая очистка выполняется сразу."""
+    global _staging_sweeper
+    if _staging_sweeper is None or _staging_sweeper.done():
+        _staging_sweeper = asyncio.create_task(_sweep_staging_periodically(interval))
+
+
+async def stop_staging_sweeper() -> None:
+    """Останавливает периодическую очистку области ожидания."""
+    global _staging_sweeper
+    if _staging_sweeper is not None:
+        _staging_sweeper.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _staging_sweeper
+        _staging_sweeper = None
+
+
+async def download_image(bot: Bot, file_id: str) -> str:
+    """Скачивает фотографию из telegram в область ожидания и возвращает ее хэш.
+
+    Файл скачивается частями во временный файл с одновременным подсчетом хэша и затем атомарно
+    переименовывается в staging/<hash>.jpg, поэтому в памяти находится только одна часть файла.
+    В хранилище изображений фотография попадает только после подтверждения нарушения, см. ingest_images.
+    """
+    file = await bot.get_file(file_id)
+    tmp_path = image_staging.new_tmp_path()
+    try:
+        with tmp_path.open("wb") as tmp_file:
+            writer = _HashingWriter(tmp_file)
+            await bot.download_file(file.file_path, destination=writer, seek=False)
+        img_hash = writer.hexdigest()
+        image_staging.add(tmp_path, img_hash)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    log.debug("фотография {h} скачана, {n} байт", h=img_hash[:12], n=file.file_size)
+    return img_hash
+
+
+def _commit_image(img_hash: str) -> ImageInfo:
+    image_staging.commit(img_hash)
+    return describe_image(img_hash)
+
+
+_ingest_pool = ThreadPoolExecutor(max_workers=MAX_IMAGE_INGEST_WORKERS, thread_name_prefix="image_ingest")
+
+
+async def ingest_images(image_hashes: Sequence[str]) -> list[ImageInfo]:
+    """Переносит фотографии нового нарушения из области ожидания в хранилище.
+
+    Сведения о фотографиях возвращаются в том же порядке, см. download_image.
+
+    Работа с файлами выполняется в пуле потоков вне цикла событий, фотографии одного нарушения
+    обрабатываются параллельно.
+    """
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    infos = await asyncio.gather(
+        *(loop.run_in_executor(_ingest_pool, _commit_image, img_hash) for img_hash in image_hashes)
+    )
+    log.debug("обработано {n} фотографий за {t:.3f} с", n=len(infos), t=time.perf_counter() - started)
+    return infos
+
+
 def get_file(path: Path) -> bytes:
     """Возвращает тело файла по его пути."""
     try:
@@ -70,55 +265,221 @@ def get_file(path: Path) -> bytes:
         log.exception(e)
         raise e
 
-MAX_SIDE = 640
-def process_image(image: bytes)-> Image.Image:
-    with Image.open(BytesIO(image)) as im:
-        if im.mode not in ("RGB", "L"):
-            im = im.convert("RGB")
-        # работаем с копией, чтобы не зависеть от закрытого файла
-        out = im.copy()
-        out.thumbnail((MAX_SIDE, MAX_SIDE), Image.Resampling.LANCZOS)
-        return out
-
-
-
-def image_to_buffer(img: Image.Image) -> BytesIO:
-    buf = BytesIO()
-    img.save(
-        buf,
-        "JPEG",
-        quality=45,
-        optimize=True,
-        progressive=True,
-        subsampling="4:2:0",
-    )
-    buf.seek(0)          # важно, если буфер будут читать
-    return buf
+def typst_root_path(path: Path) -> str:
+    """Возвращает путь от корня проекта (--root typst), не зависящий от расположения typ-файла."""
+    return "/" + path.relative_to(settings.BASE_DIR).as_posix()
+
+
+class ThumbnailStore:
+    """Постоянное хранилище уменьшенных копий фотографий.
+
+    Копии адресуются хэшем исходного файла и профилем уменьшения и создаются по первому запросу.
+    Время изменения файла обновляется при каждом обращении; при превышении лимита размера
+    удаляются копии, которые дольше всего не использовались. Копии фотографий, закрепленных
+    выполняющимися отчётами (pinned), не удаляются. Размер хранилища считается один раз при первой проверке
+    и затем увеличивается на размер созданных копий (added), поэтому каталог целиком просматривается
+    только при очистке, а не при каждом отчёте.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = THUMBNAIL_STORE_MAX_BYTES) -> None:
+        """Инициализация хранилища."""
+        self.root = root
+        self.max_bytes = max_bytes
+        # хэш фотографии -> число отчётов, которые используют ее копии
+        self._pinned: Counter[str] = Counter()
+        # размер хранилища в байтах, None - еще не подсчитан
+        self._size: int | None = None
+        self._lock = threading.Lock()
 
-def buffer_to_file(filename: Path, buf: BytesIO) -> None:
-    with filename.open("wb") as f:
-        f.write(buf.getvalue())
-    return
+    def path_for(self, img_hash: str, profile: ThumbnailProfile = REPORT_PROFILE) -> Path:
+        """Путь уменьшенной копии изображения для профиля."""
+        return self.root / profile.name / img_hash[:2] / f"{img_hash}.jpg"
 
+    def lookup(self, img_hash: str, profile: ThumbnailProfile = REPORT_PROFILE) -> Path | None:
+        """Возвращает путь к существующей уменьшенной копии и отмечает ее использование."""
+        thumb_path = self.path_for(img_hash, profile)
+        try:
+            os.utime(thumb_path)
+        except FileNotFoundError:
+            return None
+        return thumb_path
+
+    def get_or_create(self, image: FileModel, profile: ThumbnailProfile = REPORT_PROFILE) -> Path:
+        """Возвращает путь к уменьшенной копии изображения, при необходимости создает ее."""
+        thumb_path = self.lookup(image.hash, profile)
+        if thumb_path is None:
+            thumb_path = self.path_for(image.hash, profile)
+            build_thumbnail(settings.DATA_DIR / image.path, thumb_path, profile)
+            self.added([thumb_path])
+        return thumb_path
+
+    def added(self, thumb_paths: Iterable[Path]) -> None:
+        """Учитывает в размере хранилища только что созданные копии."""
+        size = 0
+        for thumb_path in thumb_paths:
+            with contextlib.suppress(OSError):
+                size += thumb_path.stat().st_size
+        with self._lock:
+            if self._size is not None:
+                self._size += size
 
-def shrink_image(data: bytes) -> BytesIO:
-    processed_img = process_image(data)
-    return image_to_buffer(processed_img)
+    def needs_eviction(self) -> bool:
+        """Нужно ли очищать хранилище: размер еще не подсчитан или превышает лимит."""
+        with self._lock:
+            return self._size is None or self._size > self.max_bytes
+
+    @contextlib.contextmanager
+    def pinned(self, hashes: Iterable[str]) -> Iterator[None]:
+        """Копии фотографий hashes во всех профилях не удаляются при очистке, пока выполняется блок."""
+        hashes = list(hashes)
+        with self._lock:
+            self._pinned.update(hashes)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pinned.subtract(hashes)
+                self._pinned = +self._pinned
 
+    def evict(self) -> None:
+        """Удаляет давно не использованные копии, пока размер хранилища превышает лимит."""
+        with self._lock:
+            pinned = set(self._pinned)
+        files = []
+        total = 0
+        for thumb in self.root.glob("*/*/*.jpg"):
+            try:
+                stat = thumb.stat()
+            except OSError:
+                continue
+            total += stat.st_size
+            if thumb.stem not in pinned:
+                files.append((stat.st_mtime, stat.st_size, thumb))
+        removed = 0
+        if total > self.max_bytes:
+            files.sort(key=lambda item: item[0])
+            for _, size, thumb in files:
+                if total <= self.max_bytes:
+                    break
+                thumb.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+            log.info("Из хранилища уменьшенных копий удалено {n} файлов", n=removed)
+        with self._lock:
+            self._size = total
 
-def create_temp_images(path: Path, violations: Iterable[ViolationModel]) -> dict[str, str]:
-    processed_images: dict[str, str] = {}
+
+thumbnail_store = ThumbnailStore(settings.thumbnail_dir)
+
+
+_process_pool: ProcessPoolExecutor | None = None
+_background_process_pool: ProcessPoolExecutor | None = None
+
+
+def _pool_context() -> BaseContext:
+    """Способ запуска процессов пула обработки изображений.
+
+    forkserver (POSIX): процессы копируются из сервера, в который заранее загружен только image_processing,
+    поэтому не импортируют заново PIL и модули бота; spawn - там, где forkserver недоступен. Ни один
+    из способов не наследует потоки и блокировки цикла событий и логгера. Верхний уровень модуля __main__
+    процессы пула выполняют в обоих случаях, см. main.py.
+    """
+    if "forkserver" in get_all_start_methods():
+        context = get_context("forkserver")
+        context.set_forkserver_preload(["bot.utils.image_processing"])
+        return context
+    return get_context("spawn")
+
+
+def get_process_pool(background: bool = False) -> ProcessPoolExecutor:
+    """Пул процессов для обработки изображений, создается при первом обращении.
+
+    background - отдельный пул для фоновых отчётов: в нем меньше процессов, и они работают с пониженным
+    приоритетом, поэтому прогрев кэша не занимает процессы, которые нужны интерактивным запросам.
+    """
+    global _process_pool, _background_process_pool
+    if background:
+        if _background_process_pool is None:
+            _background_process_pool = ProcessPoolExecutor(
+                max_workers=MAX_IMAGE_BACKGROUND_WORKERS,
+                mp_context=_pool_context(),
+                initializer=lower_priority,
+                initargs=(IMAGE_BACKGROUND_NICENESS,),
+            )
+        return _background_process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=MAX_IMAGE_WORKERS, mp_context=_pool_context())
+    return _process_pool
+
+
+async def shutdown_process_pool() -> None:
+    """Останавливает пулы процессов обработки изображений, отменяя задания, которые еще не начались."""
+    global _process_pool, _background_process_pool
+    pools = [pool for pool in (_process_pool, _background_process_pool) if pool is not None]
+    _process_pool = _background_process_pool = None
+    for pool in pools:
+        await asyncio.to_thread(pool.shutdown, wait=True, cancel_futures=True)
+
+
+@contextlib.asynccontextmanager
+async def report_images_in_use(violations: Iterable[ViolationModel]) -> AsyncIterator[None]:
+    """Закрепляет копии фотографий нарушений на время создания отчёта.
+
+    Хранилище копий очищается только после выхода из блока, когда typst уже прочитал фотографии,
+    и только если его размер превысил лимит (ThumbnailStore.needs_eviction).
+    """
+    with thumbnail_store.pinned(img.hash for violation in violations for img in violation.files):
+        yield
+    if thumbnail_store.needs_eviction():
+        await asyncio.to_thread(thumbnail_store.evict)
+
+
+async def prepare_report_images(
+        violations: Iterable[ViolationModel],
+        profiles: Mapping[str, ThumbnailProfile] | None = None,
+        background: bool = False,
+) -> dict[str, str]:
+    """Подготавливает уменьшенные копии фотографий нарушений для отчёта.
+
+    profiles - профиль уменьшения для каждого хэша фотографии, для остальных используется REPORT_PROFILE.
+    background - копии фонового отчёта создаются в фоновом пуле процессов, см. get_process_pool.
+    Фотографии дедуплицируются по хэшу: фотография, прикрепленная к нескольким нарушениям, обрабатывается
+    один раз, и все строки отчёта ссылаются на одну и ту же копию. Недостающие копии создаются параллельно
+    в пуле процессов. Хранилище копий здесь не очищается, см. report_images_in_use.
+    Возвращает словарь: хэш фотографии -> путь копии от корня проекта для использования в typst.
+    """
+    started = time.perf_counter()
+    profiles = profiles or {}
+    unique_images: dict[str, FileModel] = {}
     for violation in violations:
         for img in violation.files:
-            img_data = get_file(settings.DATA_DIR / img.path)
-            buffer = shrink_image(img_data)
-            abs_img_path = path / Path(img.path).name
-            buffer_to_file(abs_img_path, buffer)
-            rel_path = abs_img_path.relative_to(settings.typst_dir).as_posix()
-            processed_images[img.path] = rel_path
-    return processed_images
-
+            unique_images.setdefault(img.hash, img)
 
+    def profile_for(img_hash: str) -> ThumbnailProfile:
+        return profiles.get(img_hash, REPORT_PROFILE)
 
+    def find_existing() -> dict[str, Path | None]:
+        return {img_hash: thumbnail_store.lookup(img_hash, profile_for(img_hash)) for img_hash in unique_images}
 
+    thumbnails = await asyncio.to_thread(find_existing)
+    missing = [img_hash for img_hash, thumb_path in thumbnails.items() if thumb_path is None]
+    if missing:
+        loop = asyncio.get_running_loop()
+        pool = get_process_pool(background)
+        tasks = []
+        for img_hash in missing:
+            profile = profile_for(img_hash)
+            thumb_path = thumbnail_store.path_for(img_hash, profile)
+            thumbnails[img_hash] = thumb_path
+            source = settings.DATA_DIR / unique_images[img_hash].path
+            tasks.append(loop.run_in_executor(pool, build_thumbnail_timed, source, thumb_path, profile))
+        timings = await asyncio.gather(*tasks)
+        for img_hash, elapsed in zip(missing, timings, strict=True):
+            log.debug("уменьшенная копия {h} создана за {t:.3f} с", h=img_hash[:12], t=elapsed)
+        await asyncio.to_thread(thumbnail_store.added, [thumbnails[img_hash] for img_hash in missing])
 
+    log.info(
+        "подготовлено {n} изображений, создано {m}, за {t:.3f} с",
+        n=len(unique_images), m=len(missing), t=time.perf_counter() - started,
+    )
+    return {img_hash: typst_root_path(thumb_path) for img_hash, thumb_path in thumbnails.items()}
@@ -1,40 +1,60 @@
-"""Точка вхожа в приложение."""
+"""Точка вхожа в приложение.
+
+Процессы пула обработки изображений заново выполняют верхний уровень модуля, запущенного как __main__,
+поэтому aiogram и модули бота импортируются внутри функций: иначе каждый процесс пула загружал бы
+настройки, базу данных и обработчики и добавлял бы свой обработчик лог-файла.
+"""
 import asyncio
 import contextlib
-
 from asyncio.exceptions import CancelledError
-from aiogram.client.session.aiohttp import AiohttpSession
-from aiogram import Bot, Dispatcher
-from aiogram.exceptions import TelegramForbiddenError
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums.parse_mode import ParseMode
+from typing import TYPE_CHECKING
 
+if TYPE_CHECKING:
+    from aiogram import Bot
 
-from bot.handlers import router as main_router
-from bot.config import settings
-from bot.logger_config import log
-from bot.set_bot_commands import check_main_menu_on_startup
 
-async def on_startup(bot: Bot) -> None:  # функция выполняется при запуске бота
+async def on_startup(bot: "Bot") -> None:  # функция выполняется при запуске бота
     """Функция на выполнение при запуске бота."""
+    from aiogram.exceptions import TelegramForbiddenError
+    from bot.config import settings
+    from bot.logger_config import log
+    from bot.set_bot_commands import check_main_menu_on_startup
+    from bot.utils.image_utils import start_staging_sweeper
+
     await check_main_menu_on_startup(bot)
+    start_staging_sweeper()
     for chat in settings.SUPER_USERS_TG_ID:
         with contextlib.suppress(TelegramForbiddenError):
             await bot.send_message(chat_id=chat, text="Бот вышел online.")
     log.info("Бот запушен.")
 
 
-async def on_shutdown(bot: Bot) -> None:
+async def on_shutdown(bot: "Bot") -> None:
     """Функция на выполнение при отключении бота."""
+    from aiogram.exceptions import TelegramForbiddenError
+    from bot.config import settings
+    from bot.logger_config import log
+    from bot.services.typst_render import typst_renderer
+    from bot.utils.image_utils import shutdown_process_pool, stop_staging_sweeper
+
     for chat in settings.SUPER_USERS_TG_ID:
         with contextlib.suppress(TelegramForbiddenError):
             await bot.send_message(chat_id=chat, text="Бот offline.")
+    await typst_renderer.close()
+    await stop_staging_sweeper()
+    await shutdown_process_pool()
     log.info("Бот выключен.")
 
 
 async def main() -> None:
     """Точка входа."""
-
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.enums.parse_mode import ParseMode
+    from bot.config import settings
+    from bot.handlers import router as main_router
+    from bot.logger_config import log
 
     session = AiohttpSession(
         timeout=120  # секунды
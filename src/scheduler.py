@@ -2,27 +2,45 @@ import asyncio
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from datetime import date
+from pathlib import Path
 
 from bot.config import settings
+from bot.db.database import async_session_factory
 from bot.services.email import  send_email_parallel
+from bot.services.image_gc import ImageGarbageCollector
 from bot.services.reports import make_daily_report, make_monthly_report, make_active_orders_report
 
 
+async def send_report_volumes(subject: str, volumes: list[Path]):
+    """Большой отчёт приходит несколькими томами, каждый отправляется отдельным письмом."""
+    for index, volume in enumerate(volumes, start=1):
+        volume_subject = subject if len(volumes) == 1 else f"{subject} (том {index} из {len(volumes)})"
+        await send_email_parallel(settings.MAILING_LIST, volume_subject, volume)
+
+
 async def send_daily_report():
     date_string = date.today().strftime("%Y.%m.%d")
-    attachment = await make_daily_report()
-    await send_email_parallel(settings.MAILING_LIST, f"ежедневный отчет {date_string}", attachment)
+    volumes = await make_daily_report()
+    await send_report_volumes(f"ежедневный отчет {date_string}", volumes)
 
 
 async def send_monthly_report():
     date_string = date.today().strftime("%Y.%m.%d")
-    attachment = await make_monthly_report()
-    await send_email_parallel(settings.MAILING_LIST, f"ежемесячный отчет {date_string}", attachment)
+    volumes = await make_monthly_report()
+    await send_report_volumes(f"ежемесячный отчет {date_string}", volumes)
 
 async def send_active_orders_report():
     date_string = date.today().strftime("%Y.%m.%d")
-    attachment = await make_active_orders_report()
-    await send_email_parallel(settings.MAILING_LIST, f"активные предписания {date_string}", attachment)
+    volumes = await make_active_orders_report()
+    await send_report_volumes(f"активные предписания {date_string}", volumes)
+
+async def collect_image_garbage():
+    """Удаляет фотографии удаленных нарушений, см. services.image_gc.
+
+    Строки фотографий существующих нарушений без файлов только выводятся в лог, они удаляются вручную.
+    """
+    async with async_session_factory() as session:
+        await ImageGarbageCollector(session).collect(dry_run=False)
 
 
 def create_scheduler() -> AsyncIOScheduler:
@@ -53,6 +71,12 @@ def create_scheduler() -> AsyncIOScheduler:
         CronTrigger(day_of_week="wed,fri", hour="16"),
         id = "активные предписания",
     )
+
+    scheduler.add_job(
+        collect_image_garbage,
+        CronTrigger(day_of_week="sun", hour="3"),
+        id = "Сборка мусора фотографий",
+    )
     return scheduler
 
 async def main():
@@ -0,0 +1,111 @@
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from pytest_mock import MockerFixture
+
+from bot.handlers.reports_handlers import create_reports
+from bot.services.report_store import ReportStore
+
+
+@pytest.fixture
+def render_mock(mocker: MockerFixture):
+    mocker.patch.object(create_reports, "report_fingerprint", return_value="fp")
+    mocker.patch.object(create_reports.report_store, "get", return_value=None)
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def render(*args) -> Path:
+        started.set()
+        await release.wait()
+        # фоновая компиляция возвращает другой файл, чтобы было видно, чей результат получен
+        return Path("background.pdf" if args[4] else "report.pdf")
+
+    mock = mocker.patch.object(create_reports, "_render_typst_report", side_effect=render)
+    mock.started, mock.release = started, release
+    return mock
+
+
+@pytest.mark.asyncio
+async def test_create_typst_report_shares_inflight_render(render_mock):
+    violations = (SimpleNamespace(id=1, number=1),)
+    user = SimpleNamespace(id=1)
+
+    first = asyncio.create_task(create_reports.create_typst_report(user, violations))
+    await render_mock.started.wait()
+    # фоновый прогрев присоединяется к обычной компиляции
+    second = asyncio.create_task(create_reports.create_typst_report(user, violations, background=True))
+    while create_reports._inflight_reports["fp"].waiters < 2:
+        await asyncio.sleep(0)
+    render_mock.release.set()
+
+    assert await first == await second == Path("report.pdf")
+    render_mock.assert_called_once()
+    assert create_reports._inflight_reports == {}
+
+
+@pytest.mark.asyncio
+async def test_interactive_request_replaces_background_render(render_mock):
+    violations = (SimpleNamespace(id=1, number=1),)
+    user = SimpleNamespace(id=1)
+
+    warmup = asyncio.create_task(create_reports.create_typst_report(user, violations, background=True))
+    await render_mock.started.wait()
+    background_render = create_reports._inflight_reports["fp"]
+    check = asyncio.create_task(create_reports.create_typst_report(user, violations))
+    while create_reports._inflight_reports["fp"].waiters < 2:
+        await asyncio.sleep(0)
+
+    assert background_render.task.cancelled()
+    assert not create_reports._inflight_reports["fp"].background
+    render_mock.release.set()
+
+    # прогрев получает результат обычной компиляции, которая его заменила
+    assert await warmup == await check == Path("report.pdf")
+    assert [call.args[4] for call in render_mock.call_args_list] == [True, False]
+    assert create_reports._inflight_reports == {}
+
+
+@pytest.mark.asyncio
+async def test_create_typst_report_cancels_render_without_waiters(render_mock):
+    violations = (SimpleNamespace(id=1, number=1),)
+    waiter = asyncio.create_task(create_reports.create_typst_report(SimpleNamespace(id=1), violations))
+    await render_mock.started.wait()
+    inflight = create_reports._inflight_reports["fp"]
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    with pytest.raises(asyncio.CancelledError):
+        await inflight.task
+    await asyncio.sleep(0)
+    assert create_reports._inflight_reports == {}
+
+
+@pytest.mark.asyncio
+async def test_create_typst_preview_shares_inflight_render_and_uses_cache(tmp_path, mocker: MockerFixture):
+    mocker.patch.object(create_reports, "report_fingerprint", return_value="preview")
+    store = ReportStore(tmp_path / "cache")
+    mocker.patch.object(create_reports, "report_store", store)
+    release = asyncio.Event()
+
+    async def render(created_by, violations, fingerprint, *args) -> list[Path]:
+        await release.wait()
+        page = tmp_path / "page-1.png"
+        page.write_bytes(b"png")
+        return store.put_pages(fingerprint, [page])
+
+    render_mock = mocker.patch.object(create_reports, "_render_typst_preview", side_effect=render)
+    violations = (SimpleNamespace(id=1, number=1),)
+    user = SimpleNamespace(id=1)
+
+    first = asyncio.create_task(create_reports.create_typst_preview(user, violations))
+    second = asyncio.create_task(create_reports.create_typst_preview(user, violations, background=True))
+    while "preview" not in create_reports._inflight_reports or create_reports._inflight_reports["preview"].waiters < 2:
+        await asyncio.sleep(0)
+    release.set()
+
+    assert await first == await second == [b"png"]
+    assert await create_reports.create_typst_preview(user, violations) == [b"png"]
+    render_mock.assert_called_once()
@@ -0,0 +1,71 @@
+import json
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from bot.enums import UserRole, ViolationStatus
+from bot.handlers.reports_handlers import generate_typst
+from bot.handlers.reports_handlers.generate_typst import FragmentCache
+
+
+def _violation(updated_at=datetime(2025, 1, 1, 12, 0), description="Нет ограждения"):
+    return SimpleNamespace(
+        id=1,
+        number=7,
+        description=description,
+        category="Работы на высоте",
+        status=ViolationStatus.ACTIVE,
+        actions_needed="Устранить",
+        created_at=datetime(2025, 1, 1, 12, 0),
+        updated_at=updated_at,
+        area=SimpleNamespace(name="Цех №1", responsible_text="Петров П.П.", responsible_user=None),
+        detector=SimpleNamespace(first_name="Иванов И.И."),
+        files=[SimpleNamespace(hash="a" * 64, aspect_ratio=0.75)],
+    )
+
+
+def test_generate_report_data_reuses_unchanged_rows():
+    cache = FragmentCache()
+    created_by = SimpleNamespace(id=0, first_name="Сидоров С.С.", user_role=UserRole.ADMIN)
+    imgs_mapping = {"a" * 64: "/data/thumbnails/aa/a.jpg"}
+
+    with patch.object(generate_typst, "fragment_cache", cache), \
+            patch.object(generate_typst, "_violation_data", wraps=generate_typst._violation_data) as build:
+        first = json.loads(generate_typst.generate_report_data((_violation(),), created_by, imgs_mapping))
+        generate_typst.generate_report_data((_violation(),), created_by, imgs_mapping)
+        assert build.call_count == 1
+
+        changed = _violation(updated_at=datetime(2025, 1, 2), description="Ограждение сломано")
+        second = json.loads(generate_typst.generate_report_data((changed,), created_by, imgs_mapping))
+        assert build.call_count == 2
+
+    assert first["violations"][0]["description"] == "Нет ограждения"
+    assert first["violations"][0]["photo_rows"] == [[{"path": "/data/thumbnails/aa/a.jpg", "ratio": 0.75}]]
+    assert second["violations"][0]["description"] == "Ограждение сломано"
+    assert first["created_by"] == {"role": UserRole.ADMIN.value, "name": "Сидоров С.С."}
+
+
+def test_fragment_cache_key_includes_status():
+    active = _violation()
+    corrected = _violation()
+    # статус сменился в ту же секунду, время изменения осталось прежним
+    corrected.status = ViolationStatus.CORRECTED
+
+    def img_resolver(image):
+        return "/a.jpg"
+
+    assert FragmentCache.key(active, img_resolver) != FragmentCache.key(corrected, img_resolver)
+
+
+def test_fragment_cache_evicts_least_recently_used():
+    cache = FragmentCache(max_size=1)
+    resolver = {"a" * 64: "/a.jpg"}
+    first, second = _violation(), _violation(updated_at=datetime(2025, 1, 2))
+
+    def img_resolver(image):
+        return resolver[image.hash]
+
+    cache.get(first, img_resolver)
+    cache.get(second, img_resolver)
+
+    assert list(cache._fragments) == [cache.key(second, img_resolver)]
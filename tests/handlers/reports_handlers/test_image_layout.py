@@ -0,0 +1,95 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from bot.handlers.reports_handlers.image_layout import (
+    pack_image_rows,
+    photo_cell_width_mm,
+    plan_thumbnail_profiles,
+    row_image_sides_px,
+)
+
+
+def images(*ratios: float) -> list[SimpleNamespace]:
+    return [SimpleNamespace(aspect_ratio=ratio, index=index) for index, ratio in enumerate(ratios)]
+
+
+def indices(rows: list[list[SimpleNamespace]]) -> list[list[int]]:
+    return [[image.index for image in row] for row in rows]
+
+
+def total_height(rows: list[list[SimpleNamespace]]) -> float:
+    return sum(1 / sum(image.aspect_ratio for image in row) for row in rows)
+
+
+def test_pack_image_rows_three_portraits_in_one_row():
+    assert indices(pack_image_rows(images(0.56, 0.56, 0.56))) == [[0, 1, 2]]
+
+
+def test_pack_image_rows_landscape_alone():
+    assert indices(pack_image_rows(images(1.78, 0.75, 1.33, 0.56))) == [[0], [1, 3], [2]]
+
+
+def test_pack_image_rows_keeps_input_and_rows_within_limit():
+    rnd = random.Random(1)
+    for count in (1, 4, 8, 9, 30):
+        photos = images(*(rnd.choice((0.56, 0.75, 1.0, 1.33, 1.78)) for _ in range(count)))
+        original = list(photos)
+        rows = pack_image_rows(photos, max_row_ratio=1.9, max_per_row=3)
+
+        assert photos == original
+        assert sorted(image.index for row in rows for image in row) == list(range(count))
+        for row in rows:
+            assert 1 <= len(row) <= 3
+            assert len(row) == 1 or sum(image.aspect_ratio for image in row) <= 1.9
+
+
+def test_pack_image_rows_not_higher_than_pairs():
+    photos = images(0.56, 0.56, 0.75, 0.56, 0.56, 0.75)
+    # раскладка по два в ряд, как раньше
+    pairs = [photos[index:index + 2] for index in range(0, len(photos), 2)]
+
+    assert total_height(pack_image_rows(photos)) < total_height(pairs)
+
+
+def test_pack_image_rows_empty():
+    assert pack_image_rows([]) == []
+
+
+REPORT_SETTINGS = {
+    "col_width": {"number": "1cm", "photos": "auto", "terms": "40mm"},
+    "page_size": {"width": "100mm", "height": "100mm", "margin": "0.5cm"},
+}
+
+
+def test_photo_cell_width_auto_takes_remaining_width():
+    # 100 - 2 * 5 - 10 - 40 мм минус отступы ячейки по 5pt
+    assert photo_cell_width_mm(REPORT_SETTINGS) == pytest.approx(40 - 2 * 5 * 25.4 / 72)
+
+
+def test_photo_cell_width_unknown_length():
+    assert photo_cell_width_mm({"col_width": {"photos": "1fr"}}) is None
+
+
+def test_row_image_sides_px_shrinks_with_more_images_in_row():
+    single = row_image_sides_px(images(0.75), cell_width_mm=50.8, dpi=100)
+    triple = row_image_sides_px(images(0.56, 0.56, 0.56), cell_width_mm=50.8, dpi=100)
+
+    # 2 дюйма ширины при 100 dpi: вертикальная фотография 200 x 267 пикселей
+    assert single == [267]
+    assert max(triple) < single[0] / 2
+
+
+def test_plan_thumbnail_profiles_takes_largest_size_for_shared_image():
+    shared = SimpleNamespace(hash="a", aspect_ratio=0.56)
+    violations = [
+        SimpleNamespace(files=[shared]),
+        SimpleNamespace(files=[shared, SimpleNamespace(hash="b", aspect_ratio=0.56)]),
+    ]
+
+    profiles = plan_thumbnail_profiles(violations, REPORT_SETTINGS, quality=30, dpi=150)
+
+    assert profiles["a"].max_side > profiles["b"].max_side
+    assert profiles["a"].quality == profiles["b"].quality == 30
+    assert all(profile.max_side % 32 == 0 for profile in profiles.values())
@@ -0,0 +1,19 @@
+from bot.handlers.reports_handlers.reports_utils import split_report_parts
+
+
+def test_split_report_parts_small_report_is_single_part():
+    assert split_report_parts([1, 2, 3], [10, 10, 10], max_bytes=100, max_items=10) == [[1, 2, 3]]
+
+
+def test_split_report_parts_by_size_and_count():
+    parts = split_report_parts(list(range(7)), [40, 40, 40, 10, 10, 10, 10], max_bytes=100, max_items=3)
+
+    assert parts == [[0, 1], [2, 3, 4], [5, 6]]
+
+
+def test_split_report_parts_oversized_item_gets_own_part():
+    assert split_report_parts(["a", "b", "c"], [10, 500, 10], max_bytes=100, max_items=10) == [["a"], ["b"], ["c"]]
+
+
+def test_split_report_parts_empty():
+    assert split_report_parts([], [], max_bytes=100, max_items=10) == [[]]
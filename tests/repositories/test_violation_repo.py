@@ -1,13 +1,16 @@
 import pytest
+import pytest_asyncio
 
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from pytest_mock import MockType, MockerFixture
 from aiogram.types import Message
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 
-from bot.enums import UserRole
+from bot.enums import UserRole, ViolationStatus
 from bot.handlers.approve_handlers import approve_commands
-from bot.db.database import async_session_factory
+from bot.db.database import SimpleBase, async_session_factory
+from bot.db.models import AreaModel, UserModel, ViolationModel
 from bot.repositories.violation_repo import ViolationRepository
 
 @pytest.mark.asyncio
@@ -21,3 +24,50 @@ async def test_get_active_violations_id_description():
         assert isinstance(res[0], dict)
 
     assert repo is not None
+
+
+@pytest_asyncio.fixture
+async def memory_session():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(SimpleBase.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as session:
+        detector = UserModel(telegram_id=1, first_name="Иванов")
+        responsible = UserModel(telegram_id=2, first_name="Петров")
+        first_area = AreaModel(name="Цех 1", responsible_user=responsible)
+        second_area = AreaModel(name="Цех 2", responsible_text="Сидоров")
+        session.add_all([detector, responsible, first_area, second_area])
+        await session.flush()
+        statuses = [ViolationStatus.ACTIVE, ViolationStatus.ACTIVE, ViolationStatus.REVIEW, ViolationStatus.CORRECTED]
+        for number, status in enumerate(statuses, start=1):
+            area = first_area if number < 4 else second_area
+            session.add(ViolationModel(detector_id=detector.id, area_id=area.id, description="описание",
+                                       category="категория", actions_needed="устранить", number=number, status=status))
+        await session.commit()
+        yield session
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_stream_violations_for_statistics(memory_session):
+    repo = ViolationRepository(memory_session)
+    chunks = [rows async for rows in repo.stream_violations_for_statistics(chunk_size=3)]
+
+    assert [len(rows) for rows in chunks] == [3, 1]
+    assert [row.responsible for row in chunks[0]] == ["Петров"] * 3
+    assert chunks[1][0].responsible == "Сидоров"
+    assert chunks[1][0].detector_name == "Иванов"
+
+
+@pytest.mark.asyncio
+async def test_count_violations_by_area_and_status(memory_session):
+    repo = ViolationRepository(memory_session)
+    rows = await repo.count_violations_by_area_and_status()
+
+    counts = {(row.area_name, row.status): row.violations_count for row in rows}
+    assert counts == {
+        ("Цех 1", ViolationStatus.ACTIVE): 2,
+        ("Цех 1", ViolationStatus.REVIEW): 1,
+        ("Цех 2", ViolationStatus.CORRECTED): 1,
+    }
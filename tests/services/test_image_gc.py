@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+from pytest_mock import MockerFixture
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from bot.db.database import SimpleBase
+from bot.db.models import AreaModel, FileModel, UserModel, ViolationFile, ViolationModel
+from bot.enums import ViolationStatus
+from bot.services import image_gc
+from bot.services.image_gc import ImageGarbageCollector
+
+LIVE, DELETED, UNTRACKED, MISSING = ("a" * 64, "b" * 64, "c" * 64, "d" * 64)
+
+
+def _rel_path(img_hash):
+    return f"images/{img_hash[:2]}/{img_hash}.jpg"
+
+
+@pytest_asyncio.fixture
+async def store(tmp_path, mocker: MockerFixture):
+    mocker.patch.object(image_gc, "settings", SimpleNamespace(DATA_DIR=tmp_path, image_write_dir=tmp_path / "images"))
+    for img_hash in (LIVE, DELETED, UNTRACKED):
+        path = tmp_path / _rel_path(img_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"jpeg")
+    (tmp_path / "images" / "signs").mkdir()
+    (tmp_path / "images" / "signs" / "1.png").write_bytes(b"png")
+
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(SimpleBase.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as session:
+        detector = UserModel(telegram_id=1, first_name="Иванов")
+        area = AreaModel(name="Цех 1", responsible_text="Сидоров")
+        session.add_all([detector, area])
+        await session.flush()
+        violation = ViolationModel(detector_id=detector.id, area_id=area.id, description="описание", number=1,
+                                   category="категория", actions_needed="устранить", status=ViolationStatus.ACTIVE)
+        session.add(violation)
+        old = datetime(2020, 1, 1)
+        session.add_all(
+            FileModel(hash=img_hash, path=_rel_path(img_hash), aspect_ratio=1.0, created_at=old)
+            for img_hash in (LIVE, DELETED, MISSING)
+        )
+        await session.flush()
+        # связь удаленного нарушения остается в violation_files
+        session.add_all([
+            ViolationFile(violation_id=violation.id, file_hash=LIVE),
+            ViolationFile(violation_id=violation.id, file_hash=MISSING),
+            ViolationFile(violation_id=violation.id + 1, file_hash=DELETED),
+        ])
+        await session.commit()
+        yield session, tmp_path
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_dry_run_reports_without_deleting(store):
+    session, data_dir = store
+    collector = ImageGarbageCollector(session, grace=timedelta(0), chunk_size=2)
+
+    items = [item async for item in collector.run(dry_run=True)]
+
+    assert sorted((item.kind, item.hash) for item in items) == [
+        ("file", DELETED), ("file", UNTRACKED), ("missing", MISSING), ("row", DELETED)
+    ]
+    assert (collector.report.rows, collector.report.missing, collector.report.files) == (1, 1, 2)
+    assert (data_dir / _rel_path(DELETED)).exists()
+    assert len((await session.execute(select(FileModel.hash))).all()) == 3
+
+
+@pytest.mark.asyncio
+async def test_apply_deletes_garbage_after_grace(store):
+    session, data_dir = store
+
+    report = await ImageGarbageCollector(session, grace=timedelta(days=1)).collect(dry_run=False)
+    # файлы только что созданы и моложе grace, удаляются только строки
+    assert (report.rows, report.missing, report.files) == (1, 1, 0)
+
+    await ImageGarbageCollector(session, grace=timedelta(0), chunk_size=1).collect(dry_run=False)
+
+    # строка существующего нарушения без файла остается, пока ее не удалят явно
+    assert {row.hash for row in (await session.execute(select(FileModel.hash))).all()} == {LIVE, MISSING}
+    links = {row.file_hash for row in (await session.execute(select(ViolationFile.file_hash))).all()}
+    assert links == {LIVE, MISSING}
+    files = {path.relative_to(data_dir).as_posix() for path in (data_dir / "images").rglob("*") if path.is_file()}
+    assert files == {_rel_path(LIVE), "images/signs/1.png"}
+    assert Path(data_dir / _rel_path(LIVE)).read_bytes() == b"jpeg"
+
+
+@pytest.mark.asyncio
+async def test_delete_missing_removes_rows_without_files(store):
+    session, _ = store
+
+    report = await ImageGarbageCollector(session, grace=timedelta(0), delete_missing=True).collect(dry_run=False)
+
+    assert (report.rows, report.missing) == (1, 1)
+    assert {row.hash for row in (await session.execute(select(FileModel.hash))).all()} == {LIVE}
+    assert [row.file_hash for row in (await session.execute(select(ViolationFile.file_hash))).all()] == [LIVE]
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from bot.services.media_group_aggregator import MediaGroupAdd, MediaGroupAggregator
+
+
+class _Downloads:
+    """Скачивание, которое завершается только по команде теста."""
+
+    def __init__(self) -> None:
+        self.started: list[str] = []
+        self.release = asyncio.Event()
+
+    def __call__(self, file_id: str):
+        async def download() -> str:
+            self.started.append(file_id)
+            await self.release.wait()
+            return f"hash-{file_id}"
+        return download
+
+
+@pytest.mark.asyncio
+async def test_albums_of_different_users_are_collected_separately():
+    aggregator = MediaGroupAggregator(max_photos=2, quiet=0.05)
+    downloads = _Downloads()
+    completed = {}
+
+    async def on_complete(album):
+        completed[album.user_id] = album
+
+    for user_id, file_ids in ((1, ("a", "b")), (2, ("c", "d", "e"))):
+        for file_id in file_ids:
+            result = aggregator.add(user_id, f"album-{user_id}", downloads(file_id), None, on_complete)
+            assert result is MediaGroupAdd.ACCEPTED
+    await asyncio.sleep(0)
+
+    # фото скачиваются параллельно, лишнее фото не скачивается
+    assert downloads.started == ["a", "b", "c", "d"]
+    await asyncio.sleep(0.1)
+    assert not completed  # альбом ждет завершения скачиваний
+    downloads.release.set()
+    await asyncio.sleep(0.01)
+
+    assert completed[1].hashes == ["hash-a", "hash-b"] and not completed[1].overflow
+    assert completed[2].overflow
+    assert len(aggregator) == 0
+
+
+@pytest.mark.asyncio
+async def test_limits_pending_albums_and_replaces_users_previous_album():
+    aggregator = MediaGroupAggregator(max_pending=1, quiet=0.05)
+    downloads = _Downloads()
+    downloads.release.set()
+    completed = []
+
+    async def on_complete(album):
+        completed.append(album.media_group_id)
+
+    assert aggregator.add(1, "first", downloads("a"), None, on_complete) is MediaGroupAdd.ACCEPTED
+    assert aggregator.add(2, "other", downloads("b"), None, on_complete) is MediaGroupAdd.REJECTED
+    assert aggregator.add(1, "second", downloads("c"), "подпись", on_complete) is MediaGroupAdd.ACCEPTED
+    await asyncio.sleep(0.1)
+
+    assert completed == ["second"]
+
+
+@pytest.mark.asyncio
+async def test_photo_after_album_is_collected_is_reported_late():
+    aggregator = MediaGroupAggregator(quiet=0.05)
+    downloads = _Downloads()
+    completed = []
+
+    async def on_complete(album):
+        completed.append(album)
+
+    assert aggregator.add(1, "album", downloads("a"), None, on_complete) is MediaGroupAdd.ACCEPTED
+    await asyncio.sleep(0.1)
+    # ожидание фото завершено, альбом ждет скачивания
+    assert aggregator.add(1, "album", downloads("b"), None, on_complete) is MediaGroupAdd.LATE
+    downloads.release.set()
+    await asyncio.sleep(0.01)
+    # альбом собран, опоздавшее фото не начинает новый альбом
+    assert aggregator.add(1, "album", downloads("c"), None, on_complete) is MediaGroupAdd.LATE
+    await asyncio.sleep(0.1)
+
+    assert [album.hashes for album in completed] == [["hash-a"]]
+    assert downloads.started == ["a"]
+    assert len(aggregator) == 0
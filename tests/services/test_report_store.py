@@ -0,0 +1,98 @@
+import os
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from bot.services.report_store import ReportStore, report_fingerprint
+
+
+def _make_pdf(path, size):
+    path.write_bytes(b"0" * size)
+    return path
+
+
+def test_put_and_get(tmp_path):
+    cache = ReportStore(tmp_path / "cache")
+    cached = cache.put("abc", _make_pdf(tmp_path / "предписание_1.pdf", 10))
+
+    assert cached.name == "предписание_1.pdf"
+    assert cache.get("abc") == cached
+    assert cache.get("def") is None
+
+
+def test_put_stores_metadata_under_unique_keys(tmp_path):
+    cache = ReportStore(tmp_path / "cache")
+    first_key, second_key = cache.new_key("stat"), cache.new_key("stat")
+    first = cache.put(first_key, _make_pdf(tmp_path / "1.tmp", 10), file_name="статистика.xlsx", kind="xlsx")
+    second = cache.put(second_key, _make_pdf(tmp_path / "2.tmp", 20), file_name="статистика.xlsx", render_seconds=1.5)
+
+    assert first != second
+    assert first.name == second.name == "статистика.xlsx"
+    assert cache.get(first_key) == first
+    meta = cache.metadata(second_key)
+    assert meta["size"] == 20
+    assert meta["render_seconds"] == 1.5
+    assert meta["file_name"] == "статистика.xlsx"
+    assert cache.metadata(first_key)["kind"] == "xlsx"
+
+
+def test_put_pages_and_get_pages(tmp_path):
+    cache = ReportStore(tmp_path / "cache")
+    pages = [_make_pdf(tmp_path / f"page-{index}.png", 10) for index in (2, 1)]
+
+    assert cache.get_pages("abc") == []
+    stored = cache.put_pages("abc", pages, kind="preview")
+
+    assert cache.get_pages("abc") == sorted(stored)
+    assert [page.name for page in cache.get_pages("abc")] == ["page-1.png", "page-2.png"]
+    assert cache.metadata("abc")["size"] == 20
+
+
+def test_evict_by_size_removes_least_recently_used(tmp_path):
+    # в размер записи входят и метаданные, поэтому помещаются две записи из трех
+    cache = ReportStore(tmp_path / "cache", max_bytes=2500)
+    cache.put("first", _make_pdf(tmp_path / "1.pdf", 1000))
+    cache.put("second", _make_pdf(tmp_path / "2.pdf", 1000))
+    old = time.time() - 100
+    os.utime(tmp_path / "cache" / "first", (old, old))
+    os.utime(tmp_path / "cache" / "second", (old - 10, old - 10))
+
+    cache.put("third", _make_pdf(tmp_path / "3.pdf", 1000))
+
+    assert cache.get("second") is None
+    assert cache.get("first") is not None
+    assert cache.get("third") is not None
+
+
+def test_evict_by_age(tmp_path):
+    cache = ReportStore(tmp_path / "cache", max_age_seconds=60)
+    cache.put("stale", _make_pdf(tmp_path / "1.pdf", 10))
+    old = time.time() - 120
+    os.utime(tmp_path / "cache" / "stale", (old, old))
+
+    cache.evict()
+
+    assert cache.get("stale") is None
+
+
+def test_fingerprint_changes_when_user_is_renamed():
+    responsible = SimpleNamespace(first_name="Петров П.П.")
+    violation = SimpleNamespace(
+        id=1,
+        updated_at=datetime(2025, 1, 1),
+        status="ACTIVE",
+        area=SimpleNamespace(id=1, name="Цех", responsible_text=None, responsible_user_id=2,
+                             responsible_user=responsible),
+        detector=SimpleNamespace(first_name="Иванов И.И."),
+        files=[],
+    )
+    created_by = SimpleNamespace(id=3, user_role="ADMIN", first_name="Сидоров С.С.")
+    first = report_fingerprint(created_by, [violation])
+
+    # имена меняются без изменения самого нарушения
+    violation.detector.first_name = "Иванов И.И. (цех 2)"
+    renamed_detector = report_fingerprint(created_by, [violation])
+    responsible.first_name = "Петров П.П. (зам.)"
+    renamed_responsible = report_fingerprint(created_by, [violation])
+
+    assert len({first, renamed_detector, renamed_responsible}) == 3
@@ -0,0 +1,57 @@
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+from pytest_mock import MockerFixture
+
+from bot.enums import ViolationStatus
+from bot.services import report_warmup
+
+
+@pytest.fixture
+def warmup(mocker: MockerFixture):
+    @asynccontextmanager
+    async def session_factory():
+        yield None
+
+    violation = SimpleNamespace(id=1, status=ViolationStatus.REVIEW)
+    admin = SimpleNamespace(id=10)
+    mocker.patch.object(report_warmup, "async_session_factory", session_factory)
+    mocker.patch.object(report_warmup, "settings", SimpleNamespace(SUPER_USERS_TG_ID=[100, 200]))
+    violation_repo = mocker.patch.object(report_warmup, "ViolationRepository").return_value
+    violation_repo.get_violation_by_id = mocker.AsyncMock(return_value=violation)
+    user_repo = mocker.patch.object(report_warmup, "UserRepository").return_value
+    user_repo.get_user_by_telegram_id = mocker.AsyncMock(side_effect=[admin, None])
+    preview = mocker.patch.object(report_warmup, "create_typst_preview", mocker.AsyncMock())
+    pdf = mocker.patch.object(report_warmup, "create_typst_report", mocker.AsyncMock())
+    return SimpleNamespace(violation=violation, admin=admin, preview=preview, pdf=pdf)
+
+
+@pytest.mark.asyncio
+async def test_review_violation_warms_preview_only(warmup, mocker: MockerFixture):
+    mocker.patch.object(report_warmup, "VIOLATION_REVIEW_PREVIEW", True)
+
+    await report_warmup.warm_up_violation_report(1)
+
+    warmup.preview.assert_awaited_once_with(violations=(warmup.violation,), created_by=warmup.admin, background=True)
+    warmup.pdf.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("status", "preview_enabled", "warms_pdf"),
+    [
+        (ViolationStatus.REVIEW, False, True),
+        (ViolationStatus.ACTIVE, True, True),
+        (ViolationStatus.CORRECTED, True, False),
+        (ViolationStatus.REJECTED, True, False),
+    ],
+)
+async def test_warms_pdf_only_when_it_is_viewed_next(warmup, mocker: MockerFixture, status, preview_enabled, warms_pdf):
+    mocker.patch.object(report_warmup, "VIOLATION_REVIEW_PREVIEW", preview_enabled)
+    warmup.violation.status = status
+
+    await report_warmup.warm_up_violation_report(1)
+
+    assert warmup.pdf.await_count == int(warms_pdf)
+    warmup.preview.assert_not_awaited()
@@ -0,0 +1,135 @@
+import asyncio
+import sys
+import textwrap
+
+import pytest
+
+from bot.services import typst_render
+from bot.services.typst_render import TypstRenderService
+
+# заменитель компилятора: "pdf" - это исходный текст документа, watch перекомпилирует файл при изменении
+FAKE_TYPST = textwrap.dedent(
+    """
+    import os, sys, time
+    mode, *args = sys.argv[1:]
+    typ, pdf = [arg for arg in args if arg.endswith((".typ", ".pdf"))]
+    if mode == "compile":
+        open(pdf, "wb").write(b"oneshot " + open(typ, "rb").read())
+        sys.exit(0)
+    if os.environ.get("FAKE_TYPST_NO_WATCH"):
+        sys.exit(1)
+    last = None
+    while True:
+        # как typst, перекомпилирует документ и при изменении файла данных, который он читает (строка "#data <путь>")
+        source = open(typ, "rb").read()
+        data = [line.split(b" ", 1)[1].decode() for line in source.splitlines() if line.startswith(b"#data ")]
+        state = (os.stat(typ).st_mtime_ns, [os.path.exists(path) for path in data])
+        if state != last:
+            last = state
+            if not all(state[1]):
+                # компиляция без файла данных заканчивается ошибкой не сразу
+                time.sleep(0.05)
+            if b"#error" in source or not all(state[1]):
+                print("[00:00:00] compiled with errors", file=sys.stderr, flush=True)
+                print("error: unknown variable", file=sys.stderr, flush=True)
+            else:
+                open(pdf, "wb").write(b"watch " + source)
+                print("[00:00:00] compiled successfully in 1.00ms", file=sys.stderr, flush=True)
+        time.sleep(0.005)
+    """
+)
+
+
+@pytest.fixture
+def fake_typst(tmp_path, monkeypatch):
+    script = tmp_path / "typst.py"
+    script.write_text(FAKE_TYPST)
+    monkeypatch.setattr(typst_render, "get_typst_command", lambda: [sys.executable, str(script)])
+    return tmp_path
+
+
+@pytest.mark.asyncio
+async def test_watch_backend_reuses_process(fake_typst):
+    renderer = TypstRenderService(max_workers=1, backend="watch")
+    try:
+        for text in ("первый", "второй"):
+            typ_file = fake_typst / "report.typ"
+            typ_file.write_text(text, encoding="utf-8")
+            pdf_file = await renderer.compile(typ_file, fake_typst / "report.pdf")
+
+            assert pdf_file.read_bytes().startswith(f"watch {text}".encode())
+        assert len(renderer._idle_watchers) == 1
+
+        typ_file.write_text("#error", encoding="utf-8")
+        with pytest.raises(typst_render.TypstCompileError):
+            await renderer.compile(typ_file, fake_typst / "report.pdf")
+        assert renderer._idle_watchers[0].alive
+    finally:
+        await renderer.close()
+    assert not list(typst_render.settings.typst_dir.glob("watch_*"))
+
+
+@pytest.mark.asyncio
+async def test_watch_backend_survives_removed_data_of_previous_job(fake_typst):
+    jobs = []
+    for index in range(5):
+        job_dir = fake_typst / f"job_{index}"
+        job_dir.mkdir()
+        data_file = job_dir / "report.json"
+        data_file.write_text("{}", encoding="utf-8")
+        typ_file = job_dir / "report.typ"
+        typ_file.write_text(f"отчёт {index}\n#data {data_file}", encoding="utf-8")
+        jobs.append((index, typ_file, data_file))
+
+    renderer = TypstRenderService(max_workers=1, backend="watch")
+    try:
+        for index, typ_file, data_file in jobs:
+            pdf_file = await renderer.compile(typ_file, typ_file.with_suffix(".pdf"))
+
+            assert pdf_file.read_bytes().startswith(f"watch отчёт {index}".encode())
+            # как workspace(): данные задания удаляются сразу после компиляции, затем начинается следующее задание
+            data_file.unlink()
+            await asyncio.sleep(0.02)
+        assert renderer._idle_watchers[0].alive
+    finally:
+        await renderer.close()
+
+
+@pytest.mark.asyncio
+async def test_watch_backend_falls_back_to_oneshot(fake_typst, monkeypatch):
+    monkeypatch.setenv("FAKE_TYPST_NO_WATCH", "1")
+    renderer = TypstRenderService(backend="watch")
+    typ_file = fake_typst / "report.typ"
+    typ_file.write_text("отчёт", encoding="utf-8")
+
+    pdf_file = await renderer.compile(typ_file, fake_typst / "report.pdf")
+
+    assert pdf_file.read_bytes() == "oneshot отчёт".encode()
+    assert not renderer._idle_watchers
+
+
+@pytest.mark.asyncio
+async def test_single_slot_runs_background_compile_after_interactive(tmp_path):
+    renderer = TypstRenderService(max_workers=1)
+    started = []
+    release = asyncio.Event()
+
+    async def run(cmd):
+        async with renderer._semaphore:
+            started.append(cmd[-1].rsplit("/", 1)[-1])
+            await release.wait()
+        return b"", b"", 0
+
+    renderer._run = run
+    first = asyncio.create_task(renderer.compile(tmp_path / "a.typ", tmp_path / "a.pdf"))
+    while not started:
+        await asyncio.sleep(0)
+    warmup = asyncio.create_task(renderer.compile(tmp_path / "b.typ", tmp_path / "b.pdf", background=True))
+    await asyncio.sleep(0.01)
+    check = asyncio.create_task(renderer.compile(tmp_path / "c.typ", tmp_path / "c.pdf"))
+    await asyncio.sleep(0.01)
+    release.set()
+    await asyncio.gather(first, warmup, check)
+
+    # фоновая компиляция не занимает единственный слот раньше интерактивной
+    assert started == ["a.pdf", "c.pdf", "b.pdf"]
@@ -0,0 +1,235 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+from pytest_mock import MockerFixture
+
+from bot.db.models import FileModel
+from bot.utils import image_utils
+from bot.utils.image_processing import ThumbnailProfile, process_image
+from bot.utils.image_utils import ThumbnailStore, prepare_report_images
+
+
+def _make_file(tmp_path, name, size=(1600, 1200)):
+    path = tmp_path / f"{name}.jpg"
+    Image.new("RGB", size, color=(120, 30, 200)).save(path, "JPEG")
+    return FileModel(hash=name * 8, path=str(path), aspect_ratio=size[0] / size[1])
+
+
+def test_thumbnail_created_once(tmp_path):
+    store = ThumbnailStore(tmp_path / "thumbs")
+    image = _make_file(tmp_path, "ab")
+
+    thumb = store.get_or_create(image)
+    first_mtime = thumb.stat().st_mtime_ns
+    os.utime(thumb, ns=(first_mtime - 10**9, first_mtime - 10**9))
+
+    assert store.get_or_create(image) == thumb
+    assert thumb.stat().st_mtime_ns > first_mtime - 10**9
+    with Image.open(thumb) as im:
+        assert max(im.size) == 640
+
+
+def test_thumbnail_profiles_are_separate(tmp_path):
+    store = ThumbnailStore(tmp_path / "thumbs")
+    image = _make_file(tmp_path, "cd")
+
+    small = store.get_or_create(image, ThumbnailProfile(max_side=200, quality=30))
+
+    assert small != store.get_or_create(image)
+    with Image.open(small) as im:
+        assert max(im.size) == 200
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    store = ThumbnailStore(tmp_path / "thumbs")
+    old = store.get_or_create(_make_file(tmp_path, "ef"))
+    new = store.get_or_create(_make_file(tmp_path, "gh"))
+    os.utime(old, (1, 1))
+    store.max_bytes = new.stat().st_size
+
+    store.evict()
+
+    assert not old.exists()
+    assert new.exists()
+
+
+def test_store_size_is_tracked_between_evictions(tmp_path):
+    store = ThumbnailStore(tmp_path / "thumbs")
+    first = store.get_or_create(_make_file(tmp_path, "qr"))
+    assert store.needs_eviction()  # размер еще не подсчитан
+
+    store.evict()
+    assert not store.needs_eviction()
+    store.max_bytes = first.stat().st_size
+    os.utime(first, (1, 1))
+    second = store.get_or_create(_make_file(tmp_path, "st"))
+    assert store.needs_eviction()
+
+    store.evict()
+    assert not first.exists()
+    assert second.exists()
+    assert not store.needs_eviction()
+
+
+def test_evict_skips_pinned_images(tmp_path):
+    store = ThumbnailStore(tmp_path / "thumbs")
+    image = _make_file(tmp_path, "mn")
+    pinned = store.get_or_create(image)
+    other = store.get_or_create(_make_file(tmp_path, "op"))
+    os.utime(pinned, (1, 1))
+    store.max_bytes = 0
+
+    with store.pinned([image.hash]):
+        store.evict()
+        assert pinned.exists()
+        assert not other.exists()
+    store.evict()
+
+    assert not pinned.exists()
+
+
+@pytest.mark.parametrize("decode", ["quality", "balanced", "fast"])
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG"])
+def test_process_image_decode_profiles(decode, image_format):
+    buffer = BytesIO()
+    Image.new("RGB", (3000, 2000), color=(10, 200, 30)).save(buffer, image_format)
+
+    image = process_image(buffer.getvalue(), max_side=300, decode=decode)
+
+    assert image.size == (300, 200)
+    assert image.getpixel((150, 100)) == pytest.approx((10, 200, 30), abs=3)
+
+
+@pytest.mark.asyncio
+async def test_prepare_report_images_processes_shared_image_once(tmp_path, mocker: MockerFixture):
+    mocker.patch.object(image_utils, "thumbnail_store", ThumbnailStore(tmp_path / "thumbs"))
+    mocker.patch.object(image_utils, "get_process_pool", return_value=ThreadPoolExecutor(max_workers=2))
+    mocker.patch.object(image_utils, "typst_root_path", side_effect=str)
+    build = mocker.spy(image_utils, "build_thumbnail_timed")
+    shared, own = _make_file(tmp_path, "ij"), _make_file(tmp_path, "kl")
+    violations = [SimpleNamespace(files=[shared]), SimpleNamespace(files=[own, shared])]
+
+    mapping = await prepare_report_images(violations)
+
+    assert build.call_count == 2
+    assert mapping.keys() == {shared.hash, own.hash}
+    assert await prepare_report_images(violations) == mapping
+    assert build.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_pool_worker_does_not_import_bot_modules():
+    pool = image_utils.get_process_pool()
+    try:
+        modules = await asyncio.wrap_future(pool.submit(eval, "sorted(__import__('sys').modules)"))
+    finally:
+        await image_utils.shutdown_process_pool()
+
+    assert "bot.config" not in modules
+    assert "bot.logger_config" not in modules
+    assert "aiogram" not in modules
+
+
+def test_main_module_top_level_imports_no_bot_modules():
+    # так процесс пула выполняет модуль, запущенный как __main__
+    main_path = Path(__file__).resolve().parents[2] / "src" / "main.py"
+    code = (
+        "import runpy, sys\n"
+        f"runpy.run_path({str(main_path)!r}, run_name='__mp_main__')\n"
+        "print(sorted(name for name in sys.modules if name.split('.')[0] in ('bot', 'aiogram')))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == "[]"
+
+
+class _FakeBot:
+    """Бот, который отдает файлы частями, как aiogram при скачивании из telegram."""
+
+    def __init__(self, files: dict[str, bytes]) -> None:
+        self.files = files
+
+    async def get_file(self, file_id):
+        return SimpleNamespace(file_path=file_id, file_size=len(self.files[file_id]))
+
+    async def download_file(self, file_path, destination, seek=True):
+        body = self.files[file_path]
+        for start in range(0, len(body), 1000):
+            destination.write(body[start:start + 1000])
+            destination.flush()
+
+
+@pytest.fixture
+def data_dir(tmp_path, mocker: MockerFixture):
+    fake_settings = SimpleNamespace(DATA_DIR=tmp_path, image_dir=Path("images"), image_write_dir=tmp_path / "images")
+    mocker.patch.object(image_utils, "settings", fake_settings)
+    mocker.patch.object(image_utils, "image_staging", image_utils.StagingArea(tmp_path / "staging"))
+    return tmp_path
+
+
+@pytest.mark.asyncio
+async def test_download_and_ingest_images(data_dir):
+    bodies = {}
+    for file_id, size in (("wide", (800, 600)), ("tall", (600, 800))):
+        buffer = BytesIO()
+        Image.new("RGB", size, color=(10, 200, 30)).save(buffer, "JPEG")
+        bodies[file_id] = buffer.getvalue()
+    bot = _FakeBot(bodies)
+
+    hashes = [await image_utils.download_image(bot, file_id) for file_id in ("wide", "tall", "wide")]
+    # до подтверждения нарушения фотографии находятся только в области ожидания
+    assert not (data_dir / "images").exists()
+    assert sorted(path.name for path in (data_dir / "staging").iterdir()) == sorted(
+        f"{img_hash}.jpg" for img_hash in set(hashes)
+    )
+    infos = await image_utils.ingest_images(hashes)
+
+    assert hashes == [image_utils.get_hash(bodies[file_id]) for file_id in ("wide", "tall", "wide")]
+    assert [info.aspect_ratio for info in infos] == [800 / 600, 600 / 800, 800 / 600]
+    assert (data_dir / infos[0].path).read_bytes() == bodies["wide"]
+    # временные файлы не остаются, повторная фотография не создает копию
+    assert {path.name for path in (data_dir / "images").rglob("*") if path.is_file()} == {
+        f"{hashes[0]}.jpg", f"{hashes[1]}.jpg"
+    }
+    assert not list((data_dir / "staging").iterdir())
+
+
+def test_staging_sweep_removes_abandoned_files(data_dir):
+    staging = image_utils.image_staging
+    old_file, fresh_file = staging.path_for("a" * 64), staging.path_for("b" * 64)
+    part_file = staging.new_tmp_path()
+    for path in (old_file, fresh_file, part_file):
+        path.write_bytes(b"jpeg")
+    expired = time.time() - staging.ttl.total_seconds() - 60
+    for path in (old_file, part_file):
+        os.utime(path, (expired, expired))
+
+    assert staging.sweep() == 2
+    assert list(staging.root.iterdir()) == [fresh_file]
+    with pytest.raises(FileNotFoundError):
+        staging.commit("a" * 64)
+
+
+@pytest.mark.asyncio
+async def test_download_of_stored_photo_refreshes_its_mtime(data_dir):
+    body = b"\xff\xd8 already stored"
+    img_hash = image_utils.get_hash(body)
+    stored = data_dir / image_utils.image_rel_path(img_hash)
+    stored.parent.mkdir(parents=True)
+    stored.write_bytes(body)
+    os.utime(stored, (0, 0))
+
+    assert await image_utils.download_image(_FakeBot({"photo": body}), "photo") == img_hash
+
+    # сборка мусора не удалит фотографию, которую снова прикрепляют к нарушению
+    assert stored.stat().st_mtime > time.time() - 60
+    assert not list((data_dir / "staging").iterdir())